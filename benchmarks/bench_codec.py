@@ -0,0 +1,130 @@
+#packets/sec and bytes allocated per packet: msgpack.packb vs codec.PacketEncoder,
+#and msgpack.unpackb vs a long-lived streaming Unpacker on the receive side
+#usage: python benchmarks/bench_codec.py [--count N]
+import argparse
+import os
+import random
+import sys
+import time
+import tracemalloc
+import msgpack
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from codec import PacketEncoder
+
+SESSION = 2840193377
+
+#(request_type, extra fields) roughly in the proportions the client sends them
+REQUESTS = [
+    (9, 0.45, lambda rng: {"channel": "general", "message": "hello " * rng.randint(1, 40)}),
+    (12, 0.25, lambda rng: {"to_username": "clear-bob", "message": "hey there"}),
+    (3, 0.15, lambda rng: {}),
+    (10, 0.05, lambda rng: {"username": "clear-alice"}),
+    (14, 0.05, lambda rng: {"offset": rng.randrange(0, 200)}),
+    (6, 0.05, lambda rng: {"channel": "general"}),
+]
+
+RESPONSES = [
+    {"response_type": 30, "username": "clear-alice", "channel": "general", "message": "hello there " * 5},
+    {"response_type": 33, "from_username": "clear-bob", "message": "hey"},
+    {"response_type": 24, "response_handle": 12345},
+    {"response_type": 35, "users": [f"clear-user{i}" for i in range(20)], "next_page": True, "response_handle": 99},
+]
+
+def make_packets(count: int, seed: int = 1):
+    rng = random.Random(seed)
+    weights = [w for _, w, _ in REQUESTS]
+    packets = []
+    for _ in range(count):
+        request_type, _, fields = rng.choices(REQUESTS, weights)[0]
+        packet = {"request_type": request_type, "session": SESSION, "request_handle": rng.getrandbits(32)}
+        packet.update(fields(rng))
+        packets.append(packet)
+    return packets
+
+def legacy_encode(message):
+    return msgpack.packb(message)
+
+def head_and_fields(encoder):
+    #the cached head extended to packets with fields: map header from the field count, then each
+    #field packed on its own. Kept here to show why PacketEncoder does not do it
+    pack = encoder.packer.pack
+    header_keys = ("request_type", "session", "request_handle")
+
+    def encode(message):
+        prefix = encoder.prefixes.get((message["request_type"], True))
+        if prefix is None:
+            prefix = encoder._prefix(message["request_type"], True)
+        parts = [b"", prefix[1:], pack(message["request_handle"])]
+        for key, value in message.items():
+            if key not in header_keys:
+                parts.append(pack(key))
+                parts.append(pack(value))
+        parts[0] = encoder.packer.pack_map_header(3 + (len(parts) - 3) // 2)
+        return b"".join(parts)
+    return encode
+
+def throughput(fn, items):
+    start = time.perf_counter()
+    for item in items:
+        fn(item)
+    return len(items) / (time.perf_counter() - start)
+
+def bytes_per_item(fn, items):
+    #peak transient allocation while handling one item, averaged
+    tracemalloc.start()
+    total = 0
+    for item in items:
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+        fn(item)
+        total += tracemalloc.get_traced_memory()[1] - base
+    tracemalloc.stop()
+    return total / len(items)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--count", type=int, default=200000)
+    args = parser.parse_args()
+
+    packets = make_packets(args.count)
+    encoder = PacketEncoder()
+    encoder.set_session(SESSION)
+    for packet in packets[:1000]:
+        assert encoder.encode(packet) == legacy_encode(packet), packet
+
+    sample = packets[:2000]
+    print("encode")
+    legacy = throughput(legacy_encode, packets)
+    new = throughput(encoder.encode, packets)
+    print(f"  msgpack.packb   : {legacy:12,.0f} packets/s {bytes_per_item(legacy_encode, sample):8.1f} B/packet")
+    print(f"  PacketEncoder   : {new:12,.0f} packets/s {bytes_per_item(encoder.encode, sample):8.1f} B/packet ({new / legacy:.2f}x)")
+
+    #packets with fields only: the long-lived Packer against the cached head plus per-field packing
+    fielded = [packet for packet in packets if len(packet) > 3]
+    head_encode = head_and_fields(encoder)
+    for packet in fielded[:1000]:
+        assert head_encode(packet) == legacy_encode(packet), packet
+    packer = throughput(encoder.encode, fielded)
+    head = throughput(head_encode, fielded)
+    print("encode, packets with fields")
+    print(f"  PacketEncoder   : {packer:12,.0f} packets/s")
+    print(f"  head + fields   : {head:12,.0f} packets/s ({head / packer:.2f}x)")
+
+    datagrams = [msgpack.packb(RESPONSES[i % len(RESPONSES)]) for i in range(args.count)]
+    unpacker = msgpack.Unpacker(use_list=False, raw=False)
+
+    def streaming_decode(data):
+        unpacker.feed(data)
+        return unpacker.unpack()
+
+    print("decode")
+    legacy = throughput(msgpack.unpackb, datagrams)
+    new = throughput(streaming_decode, datagrams)
+    sample = datagrams[:2000]
+    print(f"  msgpack.unpackb : {legacy:12,.0f} packets/s {bytes_per_item(msgpack.unpackb, sample):8.1f} B/packet")
+    print(f"  Unpacker.feed   : {new:12,.0f} packets/s {bytes_per_item(streaming_decode, sample):8.1f} B/packet ({new / legacy:.2f}x)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+#tab completion latency over a large name index, through the same completer the prompt uses
+#usage: python benchmarks/bench_completion.py [--names 50000] [--lookups 5000]
+import argparse
+import os
+import random
+import string
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import cli
+from chat_client import ChatClient
+from completion import NameIndex
+
+def percentile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--names", type=int, default=50000)
+    parser.add_argument("--lookups", type=int, default=5000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+
+    def name():
+        return "".join(rng.choices(string.ascii_lowercase + string.digits, k=rng.randint(4, 16)))
+
+    client = ChatClient()
+    client.connected = True #nothing is sent, the completer only checks availability
+    names = NameIndex()
+    users = [name() for _ in range(args.names)]
+    channels = [name() for _ in range(args.names // 10)]
+
+    start = time.perf_counter()
+    for page in range(0, len(users), 100): #USER_LIST pages as they arrive
+        names.users.update(users[page:page + 100])
+    names.channels.update(channels)
+    build = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for i in range(1000):
+        names.users.add(f"late-{i}")
+    insert = (time.perf_counter() - start) / 1000
+
+    completer = cli.CommandCompleter(client, names)
+    inputs = []
+    for _ in range(args.lookups):
+        kind = rng.choice(("/dm ", "/whois ", "/join ", "/info ", "/"))
+        pool = channels if kind in ("/join ", "/info ") else users
+        inputs.append(kind + rng.choice(pool)[:rng.randint(0, 3)])
+    samples = []
+    results = 0
+    for text in inputs:
+        start = time.perf_counter()
+        found, _ = completer.candidates(text)
+        samples.append(time.perf_counter() - start)
+        results += len(found)
+    samples.sort()
+
+    print(f"index           {len(names.users)} users, {len(names.channels)} channels, built from pages in {build * 1000:.1f} ms")
+    print(f"insert          {insert * 1e6:.2f} us per name")
+    print(f"complete        p50 {percentile(samples, 0.5) * 1e6:.1f} us  p99 {percentile(samples, 0.99) * 1e6:.1f} us"
+          f"  max {samples[-1] * 1e6:.1f} us  ({results / len(samples):.1f} results avg, limit {cli.COMPLETION_LIMIT})")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+#messages/sec through ChatClient.handle_message: the original if/elif ladder vs the dispatch table.
+#every handler is the same no-op on both sides, and the cost of request matching and the response
+#counter (measured on its own) is subtracted, so the ns/msg figures are finding the handler alone
+#usage: python benchmarks/bench_dispatch.py [--count N]
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chat_client import ChatClient
+
+def _noop(response):
+    pass
+
+#the pre-dispatch-table ladder, branch order and conditions kept, bodies reduced to the handler call
+async def legacy_handle_message(self, response: dict):
+    if not self.inflight.resolve(response):
+        return
+    response_type = response.get("response_type")
+    self.metrics.inc("responses", response_type)
+    if response_type == 22 and response.get("username"):  # CONNECT_response
+        _noop(response)
+    elif response_type == 23 and not response.get("username"):  # DISCONNECT_response
+        _noop(response)
+    elif response_type == 24:  # PING_response
+        _noop(response)
+    elif response_type == 21:  # OK_response
+        _noop(response)
+    elif response_type == 20:  # ERROR_response
+        _noop(response)
+    elif response_type == 36:  # SERVER_MESSAGE
+        _noop(response)
+    elif response_type == 37:  # SERVER_SHUTDOWN
+        _noop(response)
+    elif response_type == 32:  # WHOAMI
+        _noop(response)
+    elif response_type == 31:  # WHOIS_response
+        _noop(response)
+    elif response_type == 34:  # SETUSERNAME
+        _noop(response)
+    elif response_type == 25:  # CHANNEL_CREATE_response
+        _noop(response)
+    elif response_type == 28:  # CHANNEL_JOIN_response
+        _noop(response)
+    elif response_type == 26:  # CHANNEL_LIST_response
+        _noop(response)
+    elif response_type == 29:  # CHANNEL_LEFT_response
+        _noop(response)
+    elif response_type == 27:  # CHANNEL_INFO_response
+        _noop(response)
+    elif response_type == 35:  # USER_LIST_response
+        _noop(response)
+    elif response_type == 33:  # USER_MESSAGE_response
+        _noop(response)
+    elif response_type == 30:  # CHANNEL_MESSAGE_response
+        _noop(response)
+
+#what both paths do besides finding the handler
+async def baseline_handle_message(self, response: dict):
+    if not self.inflight.resolve(response):
+        return
+    response_type = response.get("response_type")
+    self.metrics.inc("responses", response_type)
+    _noop(response)
+
+#hot types dominate real traffic, everything else shows up occasionally
+MIX = [
+    (30, 0.55, lambda: {"response_type": 30, "username": "alice", "channel": "general", "message": "hello there"}),
+    (33, 0.25, lambda: {"response_type": 33, "from_username": "bob", "message": "hey"}),
+    (28, 0.05, lambda: {"response_type": 28, "username": "carol", "channel": "general"}),
+    (29, 0.05, lambda: {"response_type": 29, "username": "carol", "channel": "general"}),
+    (36, 0.04, lambda: {"response_type": 36, "message": "notice"}),
+    (24, 0.03, lambda: {"response_type": 24}),
+    (21, 0.03, lambda: {"response_type": 21}),
+]
+
+def make_messages(count: int, seed: int = 1):
+    rng = random.Random(seed)
+    weights = [w for _, w, _ in MIX]
+    return [rng.choices(MIX, weights)[0][2]() for _ in range(count)]
+
+async def run(count: int, rounds: int):
+    messages = make_messages(count)
+    client = ChatClient()
+    client.username = "me"
+    for response_type in list(client.handlers):
+        client.set_handler(response_type, _noop)
+    #all called the same way, as plain functions taking the client
+    paths = {"baseline": baseline_handle_message, "legacy": legacy_handle_message, "table": ChatClient.handle_message}
+    best = dict.fromkeys(paths, float("inf"))
+    for _ in range(rounds): #interleaved, best of each, so drift on the machine hits every path alike
+        for name, handle in paths.items():
+            client.inflight.completed.clear() #every pass sees the responses as new
+            start = time.perf_counter()
+            for m in messages:
+                await handle(client, m)
+            best[name] = min(best[name], time.perf_counter() - start)
+    client.close()
+    return best
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--count", type=int, default=200000)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+    best = asyncio.run(run(args.count, args.rounds))
+    n = args.count
+    legacy = max(0.0, best["legacy"] - best["baseline"]) / n * 1e9
+    table = max(0.0, best["table"] - best["baseline"]) / n * 1e9
+    print(f"if/elif ladder : {n / best['legacy']:12,.0f} msg/s  dispatch {legacy:6.1f} ns/msg")
+    print(f"dispatch table : {n / best['table']:12,.0f} msg/s  dispatch {table:6.1f} ns/msg"
+          f" ({legacy / table if table else float('inf'):.2f}x less)")
+
+if __name__ == "__main__":
+    main()
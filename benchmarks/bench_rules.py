@@ -0,0 +1,113 @@
+#messages/sec through the rule engine as the number of rules grows, against a per-rule Python loop,
+#and through the whole CHANNEL_MESSAGE handler (rendering to nowhere) with the compiled rules
+#usage: python benchmarks/bench_rules.py [--messages 20000] [--rules 0,10,100,1000,10000]
+import argparse
+import asyncio
+import os
+import random
+import string
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from chat_client import ChatClient
+from rules import RuleEngine, Rule, WORD, SENDER, CHANNEL
+from utility import RENDERER
+
+NAIVE_LIMIT = 1000 #the loop baseline gets too slow to wait for beyond this
+
+def word(rng):
+    return "".join(rng.choices(string.ascii_lowercase, k=rng.randint(3, 10)))
+
+def make_rules(rng, count: int) -> list:
+    #mostly keywords, like a real filter file, with some sender and channel rules
+    rules = []
+    for i in range(count):
+        roll = i % 10
+        if roll < 7:
+            action = ("mute", "highlight", "route")[i % 3]
+            rules.append(Rule(action, WORD, word(rng), "view" if action == "route" else None))
+        elif roll < 9:
+            rules.append(Rule("mute" if i % 2 else "highlight", SENDER, f"user{rng.randrange(100000)}"))
+        else:
+            rules.append(Rule("route", CHANNEL, f"chan{rng.randrange(100000)}", "view"))
+    return rules
+
+def make_messages(rng, count: int, vocabulary: list) -> list:
+    messages = []
+    for _ in range(count):
+        text = " ".join(rng.choice(vocabulary) for _ in range(rng.randint(5, 25)))
+        messages.append((f"chan{rng.randrange(50)}", f"user{rng.randrange(500)}", text))
+    return messages
+
+def naive(rules, channel, sender, text, username):
+    #what a per-message loop over the rules in handle_message would do
+    lowered = text.lower()
+    words = lowered.split()
+    highlight = username in words
+    views = []
+    for rule in rules:
+        if rule.field == SENDER:
+            hit = sender == rule.value
+        elif rule.field == CHANNEL:
+            hit = channel == rule.value
+        else:
+            hit = rule.value in words
+        if hit:
+            if rule.action == "mute":
+                return "muted"
+            if rule.action == "highlight":
+                highlight = True
+            else:
+                views.append(rule.view)
+    return highlight or views or None
+
+def rate(fn, messages) -> float:
+    start = time.perf_counter()
+    for channel, sender, text in messages:
+        fn(channel, sender, text)
+    return len(messages) / (time.perf_counter() - start)
+
+async def handler_rate(engine: RuleEngine, messages) -> float:
+    client = ChatClient()
+    client.username = "me"
+    client.rules = engine
+    responses = [{"response_type": 30, "channel": c, "username": s, "message": t} for c, s, t in messages]
+    start = time.perf_counter()
+    for response in responses:
+        await client.handle_message(response)
+    RENDERER.flush()
+    return len(responses) / (time.perf_counter() - start)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--rules", default="0,10,100,1000,10000")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+    RENDERER.sink = lambda lines: None
+    RENDERER.configure(max_fps=0)
+
+    vocabulary = [word(rng) for _ in range(5000)] + ["me"]
+    messages = make_messages(rng, args.messages, vocabulary)
+    print(f"{'rules':>6} {'compiled msg/s':>15} {'loop msg/s':>12} {'handler msg/s':>14} {'matched':>8}")
+    for count in (int(n) for n in args.rules.split(",")):
+        rules = make_rules(random.Random(count), count)
+        #rules over words that occur, or nothing would ever match
+        for rule in rules[::7]:
+            if rule.field == WORD:
+                rule.value = rng.choice(vocabulary)
+        engine = RuleEngine()
+        engine.rules = rules
+        engine.set_username("me")
+        compiled = rate(engine.evaluate, messages)
+        matched = engine.matched
+        loop = rate(lambda c, s, t: naive(rules, c, s, t, "me"), messages) if count <= NAIVE_LIMIT else None
+        handled = asyncio.run(handler_rate(engine, messages))
+        print(f"{count:>6} {compiled:>15,.0f} {f'{loop:,.0f}' if loop else '-':>12} {handled:>14,.0f} {matched:>8}")
+
+if __name__ == "__main__":
+    main()
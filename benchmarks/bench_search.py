@@ -0,0 +1,89 @@
+#query latency of search.SearchIndex against a linear scan of the history, by corpus size,
+#plus the cost of indexing on append and of reopening an existing index
+#usage: python benchmarks/bench_search.py [--sizes 10000,100000] [--queries N]
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from history import HistoryStore, CHANNEL, DIRECT, INCOMING
+from search import SearchIndex, tokenize
+
+WORDS = ("hello there anyone around for the lab tonight assignment due friday server down again "
+         "which port are you on packet loss is bad today lunch later maybe networks test marks "
+         "released check the channel about the tutorial question three udp tcp socket buffer").split()
+CHANNELS = ["general", "lab", "random", "tutorials", "offtopic"]
+USERS = [f"clear-user{i}" for i in range(50)]
+
+def fill(history, count, rng):
+    start = time.time() - count
+    for i in range(count):
+        text = " ".join(rng.choice(WORDS) for _ in range(rng.randint(3, 15)))
+        if rng.random() < 0.8:
+            history.append(CHANNEL, rng.choice(CHANNELS), rng.choice(USERS), text, INCOMING, start + i)
+        else:
+            peer = rng.choice(USERS)
+            history.append(DIRECT, peer, peer, text, INCOMING, start + i)
+
+def linear_search(history, query, key=None, limit=20):
+    tokens = set(tokenize(query))
+    results = []
+    for msg_id in range(history.next_id - 1, history.first_id - 1, -1):
+        message = history.get(msg_id)
+        if key is not None and message.key != key:
+            continue
+        if tokens <= set(tokenize(message.text)):
+            results.append(message)
+            if len(results) >= limit:
+                break
+    return results
+
+def timed(fn, queries):
+    samples = []
+    for query in queries:
+        start = time.perf_counter()
+        fn(query)
+        samples.append((time.perf_counter() - start) * 1e6)
+    samples.sort()
+    return statistics.median(samples), samples[int(len(samples) * 0.99) - 1]
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="10000,100000")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    for size in [int(s) for s in args.sizes.split(",")]:
+        rng = random.Random(args.seed)
+        with tempfile.TemporaryDirectory() as directory:
+            history = HistoryStore(directory, max_bytes=1 << 40)
+            index = SearchIndex(history)
+            start = time.perf_counter()
+            fill(history, size, rng)
+            append_us = (time.perf_counter() - start) / size * 1e6
+            #rare pairs, common pairs, and a filtered query
+            queries = [" ".join(rng.sample(WORDS, rng.randint(1, 3))) for _ in range(args.queries)]
+            indexed = timed(lambda q: index.search(q), queries)
+            filtered = timed(lambda q: index.search(q, key="lab"), queries)
+            for query in queries[:20]:
+                assert [m.msg_id for m in index.search(query)] == [m.msg_id for m in linear_search(history, query)], query
+            scan = timed(lambda q: linear_search(history, q), queries[:max(5, args.queries // 20)])
+            index.close()
+            start = time.perf_counter()
+            index = SearchIndex(history)
+            reopen_ms = (time.perf_counter() - start) * 1e3
+            index.close()
+            history.close()
+        print(f"{size:,} messages (append+index {append_us:.1f} us/msg, reopen {reopen_ms:.0f} ms)")
+        print(f"  linear scan   : p50 {scan[0]:10.0f} us  p99 {scan[1]:10.0f} us")
+        print(f"  index         : p50 {indexed[0]:10.0f} us  p99 {indexed[1]:10.0f} us ({scan[0] / indexed[0]:.0f}x)")
+        print(f"  index in:lab  : p50 {filtered[0]:10.0f} us  p99 {filtered[1]:10.0f} us")
+
+if __name__ == "__main__":
+    main()
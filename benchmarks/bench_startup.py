@@ -0,0 +1,55 @@
+#time from process start until the client can be used: headless.py until its "ready" event,
+#cli.py until the first byte of its banner, plus a bare interpreter as the floor
+#usage: python benchmarks/bench_startup.py [--runs 10]
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def time_to_output(argv, env, marker: bytes = b"") -> float:
+    start = time.perf_counter()
+    process = subprocess.Popen(argv, cwd=ROOT, env=env, stdin=subprocess.PIPE,
+                               stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    seen = b""
+    while True:
+        chunk = process.stdout.read1(4096)
+        if not chunk:
+            break
+        seen += chunk
+        if marker in seen:
+            break
+    elapsed = time.perf_counter() - start
+    process.kill()
+    process.wait()
+    return elapsed
+
+def loads_prompt_toolkit(module: str) -> bool:
+    code = f"import sys; import {module}; print(any(m.startswith('prompt_toolkit') for m in sys.modules))"
+    output = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True).stdout
+    return output.strip() == "True"
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        env = dict(os.environ, CHAT_HISTORY_DIR=directory, CHAT_EFFECTS="off", PYTHONDONTWRITEBYTECODE="1")
+        cases = [
+            ("bare python", [sys.executable, "-c", "print()"], b"\n"),
+            ("headless.py", [sys.executable, "headless.py"], b'"ready"'),
+            ("cli.py", [sys.executable, "cli.py"], b""),
+        ]
+        for name, argv, marker in cases:
+            time_to_output(argv, env, marker) #warm the page cache and bytecode
+            samples = sorted(time_to_output(argv, env, marker) * 1000 for _ in range(args.runs))
+            print(f"{name:16} median {statistics.median(samples):7.1f} ms  min {samples[0]:7.1f} ms  max {samples[-1]:7.1f} ms")
+    print(f"prompt_toolkit imported: headless {loads_prompt_toolkit('headless')}, cli {loads_prompt_toolkit('cli')}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+#drives many ChatClient instances against a chat server and reports throughput, latency and loss
+#by default a local_server.py is spawned on a free port, so no network access is needed
+#usage: python benchmarks/loadgen.py [--clients 300] [--duration 10] [--rate 5] [--host H --port P] [--engine --sockets 8]
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import chat_client
+from chat_client import ChatClient
+from engine import SessionEngine
+
+def _noop(*args, **kwargs):
+    pass
+
+#the load generator measures the protocol, not the terminal
+for _name in ("mod_print", "server_msg", "error_msg", "progress_msg"):
+    setattr(chat_client, _name, _noop)
+
+CHANNELS = ["load-0", "load-1", "load-2", "load-3"]
+
+def free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def percentile(ordered, fraction):
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+class Stats:
+    def __init__(self):
+        self.latencies = []
+        self.sent = 0
+        self.lost = 0
+        self.broadcasts = 0
+
+async def connect_all(clients, concurrency: int):
+    gate = asyncio.Semaphore(concurrency)
+
+    async def one(client):
+        async with gate:
+            await client.connect()
+
+    await asyncio.gather(*(one(c) for c in clients))
+    return [c for c in clients if c.connected]
+
+async def worker(client, others, stats: Stats, rate: float, stop_at: float, rng: random.Random):
+    channel = rng.choice(CHANNELS)
+    await client.join_channel(channel)
+    loop = asyncio.get_running_loop()
+    while loop.time() < stop_at:
+        roll = rng.random()
+        if roll < 0.5:
+            call = client.send_channel_msg(channel, "load test message " + "x" * rng.randint(0, 120))
+        elif roll < 0.7:
+            call = client.send_dm(rng.choice(others).username, "ping from load test")
+        elif roll < 0.85:
+            call = client.whois(rng.choice(others).username)
+        elif roll < 0.95:
+            call = client.channel_info(channel)
+        else:
+            call = client.list_users(offset=rng.randrange(0, 100))
+        stats.sent += 1
+        start = time.perf_counter()
+        response = await call
+        if response is None:
+            stats.lost += 1
+        else:
+            stats.latencies.append(time.perf_counter() - start)
+        await asyncio.sleep(rng.expovariate(rate))
+
+async def run(args):
+    rng = random.Random(args.seed)
+    engine = None
+    if args.engine: #every client on one shared socket pool instead of a socket and receive task each
+        engine = SessionEngine(args.host, args.port, sockets=args.sockets)
+        await engine.start()
+        clients = [await engine.add_session() for _ in range(args.clients)]
+    else:
+        clients = [ChatClient(args.host, args.port) for _ in range(args.clients)]
+    stats = Stats()
+    if args.capture:
+        clients[0].start_capture(args.capture) #a realistic traffic shape for benchmarks/replay.py
+
+    connect_start = time.perf_counter()
+    connected = await connect_all(clients, args.concurrency)
+    connect_time = time.perf_counter() - connect_start
+    if not connected:
+        raise SystemExit("no client managed to connect")
+
+    def count_broadcast(response):
+        if not response.get("response_handle"):
+            stats.broadcasts += 1
+
+    for client in connected:
+        client.subscribe(30, count_broadcast)
+        client.subscribe(33, count_broadcast)
+
+    #channels have to exist before anyone can join them
+    for name in CHANNELS:
+        await connected[0].create_channel(name, "load test")
+
+    stop_at = asyncio.get_running_loop().time() + args.duration
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(c, connected, stats, args.rate, stop_at, random.Random(rng.random())) for c in connected))
+    elapsed = time.perf_counter() - start
+
+    retransmits = sum(c.inflight.retransmits for c in connected)
+    duplicates = sum(c.inflight.duplicates for c in connected)
+    if engine is not None:
+        ingest_dropped = sum(s.ingest.dropped for s in engine.sockets)
+        sockets = len(engine.sockets)
+    else:
+        ingest_dropped = sum(c.ingest.dropped for c in connected)
+        sockets = len(connected)
+    tasks = len(asyncio.all_tasks())
+    await asyncio.gather(*(c.disconnect() for c in connected))
+    for c in clients:
+        c.stop_capture()
+        c.close()
+    if engine is not None:
+        await engine.close()
+
+    ordered = sorted(stats.latencies)
+    return {
+        "clients": args.clients,
+        "connected": len(connected),
+        "connect_seconds": round(connect_time, 3),
+        "duration_seconds": round(elapsed, 3),
+        "requests": stats.sent,
+        "completed": len(ordered),
+        "throughput_rps": round(len(ordered) / elapsed, 1),
+        "p50_ms": round(percentile(ordered, 0.50) * 1000, 3),
+        "p99_ms": round(percentile(ordered, 0.99) * 1000, 3),
+        "max_ms": round((ordered[-1] if ordered else 0.0) * 1000, 3),
+        "lost": stats.lost,
+        "loss_pct": round(100.0 * stats.lost / max(1, stats.sent), 3),
+        "retransmits": retransmits,
+        "duplicate_responses": duplicates,
+        "ingest_dropped": ingest_dropped,
+        "sockets": sockets,
+        "tasks": tasks,
+        "broadcasts_received": stats.broadcasts,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Load generator for ChatClient")
+    parser.add_argument("--clients", type=int, default=300)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--rate", type=float, default=5.0, help="requests per second per client")
+    parser.add_argument("--concurrency", type=int, default=50, help="parallel CONNECTs")
+    parser.add_argument("--host", help="target an already running server instead of spawning one")
+    parser.add_argument("--port", type=int, default=51825)
+    parser.add_argument("--loss", type=float, default=0.0, help="loss rate for the spawned server")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    parser.add_argument("--capture", help="record the first client's raw datagrams to this file")
+    parser.add_argument("--engine", action="store_true", help="host the clients in one SessionEngine")
+    parser.add_argument("--sockets", type=int, default=8, help="socket pool size with --engine")
+    args = parser.parse_args()
+
+    server = None
+    if args.host is None:
+        args.host = "127.0.0.1"
+        args.port = free_port()
+        server = subprocess.Popen(
+            [sys.executable, os.path.join(ROOT, "local_server.py"), "--port", str(args.port),
+             "--loss", str(args.loss), "--seed", str(args.seed)],
+            stdout=subprocess.PIPE, text=True)
+        server.stdout.readline() #wait for "Listening on ..."
+    try:
+        report = asyncio.run(run(args))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    if args.json:
+        print(json.dumps(report))
+    else:
+        for key, value in report.items():
+            print(f"{key:22} {value}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+#feeds a capture recorded with /capture (or loadgen.py --capture) back through the client pipeline,
+#decode -> handle_message -> render, with no server, and reports messages/sec and time per stage
+#usage: python benchmarks/replay.py CAPTURE [--speed 1.0] [--repeat N] [--fidelity cached] [--terminal] [--json]
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+import msgpack
+from prompt_toolkit.data_structures import Size
+from prompt_toolkit.output.vt100 import Vt100_Output
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from capture import read_capture, INCOMING
+from chat_client import ChatClient
+from ingest import DEFAULT_BATCH_SIZE
+from utility import RENDERER, configure_renderer
+
+def load(path: str):
+    incoming = []
+    username = None
+    sent = 0
+    for direction, at, data in read_capture(path):
+        if direction != INCOMING:
+            sent += 1
+            continue
+        incoming.append((at, data))
+        if username is None:
+            try:
+                response = msgpack.unpackb(data)
+            except Exception:
+                continue
+            if response.get("response_type") == 22: #the CONNECT answer names the user the traffic was addressed to
+                username = response.get("username")
+    return incoming, username, sent
+
+def batches(incoming, speed: float, batch_size: int):
+    #as fast as possible: full batches, like a receive_loop that never catches up.
+    #recorded speed: whatever has "arrived" by now, like a receive_loop that keeps up
+    if speed <= 0:
+        for i in range(0, len(incoming), batch_size):
+            yield 0.0, [data for _, data in incoming[i:i + batch_size]]
+        return
+    i = 0
+    while i < len(incoming):
+        due = incoming[i][0] / speed
+        batch = []
+        while i < len(incoming) and incoming[i][0] / speed <= due and len(batch) < batch_size:
+            batch.append(incoming[i][1])
+            i += 1
+        yield due, batch
+
+async def replay(incoming, username, args):
+    client = ChatClient()
+    client.username = username
+    client.connected = True
+    decode = dispatch = render = 0.0
+    errors = 0
+    count = 0
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    wall = time.perf_counter()
+    for _ in range(args.repeat):
+        base = loop.time()
+        for due, batch in batches(incoming, args.speed, args.batch_size):
+            delay = base + due - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            for data in batch:
+                t0 = time.perf_counter()
+                try:
+                    message = msgpack.unpackb(data)
+                except Exception:
+                    errors += 1
+                    continue
+                t1 = time.perf_counter()
+                await client.handle_message(message)
+                decode += t1 - t0
+                dispatch += time.perf_counter() - t1
+                count += 1
+            t0 = time.perf_counter()
+            RENDERER.flush() #one frame per batch, as receive_loop's batches give the renderer
+            render += time.perf_counter() - t0
+            await asyncio.sleep(0)
+        client.inflight.completed.clear() #each pass sees the responses as new
+    wall = time.perf_counter() - wall
+    #resyncs the handlers started: cancelled and waited for, so none finishes later with an unretrieved error
+    tasks = asyncio.all_tasks() - {asyncio.current_task()}
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    client.close()
+    busy = decode + dispatch + render
+    per = lambda seconds: round(seconds / max(1, count) * 1e6, 2)
+    return {
+        "messages": count,
+        "decode_errors": errors,
+        "wall_seconds": round(wall, 3),
+        "recorded_seconds": round(incoming[-1][0] if incoming else 0.0, 3),
+        "msgs_per_sec": round(count / busy, 1) if busy else 0.0, #pipeline time only, not the recorded gaps
+        "decode_us": per(decode),
+        "dispatch_us": per(dispatch),
+        "render_us": per(render),
+        "lines_rendered": RENDERER.lines,
+        "frames": RENDERER.frames,
+        "elapsed_loop_seconds": round(loop.time() - started, 3),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a raw datagram capture through ChatClient")
+    parser.add_argument("capture")
+    parser.add_argument("--speed", type=float, default=0.0, help="1.0 = recorded pacing, 0 = as fast as possible (default)")
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--fidelity", default=None, help="exact, cached or plain rendering")
+    parser.add_argument("--terminal", action="store_true", help="render to the terminal instead of discarding output")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args()
+
+    incoming, username, sent = load(args.capture)
+    if not incoming:
+        raise SystemExit(f"{args.capture} holds no incoming datagrams")
+    if not args.terminal:
+        #a real vt100 output into /dev/null, so escape generation is still paid for
+        devnull = open(os.devnull, "w")
+        configure_renderer(output=Vt100_Output(devnull, lambda: Size(rows=50, columns=120), term="xterm-256color"))
+    configure_renderer(max_fps=1000, fidelity=args.fidelity) #frames are flushed per batch by the replay
+    report = asyncio.run(replay(incoming, username, args))
+    report["outgoing_in_capture"] = sent
+    if args.json:
+        print(json.dumps(report))
+    else:
+        for key, value in report.items():
+            print(f"{key:22} {value}", file=sys.stderr if args.terminal else sys.stdout)
+
+if __name__ == "__main__":
+    main()
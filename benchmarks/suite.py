@@ -0,0 +1,379 @@
+#offline microbenchmarks for the client's hot paths: packet encode/decode, handle_message for every
+#response_type, line formatting and rendering to a prompt_toolkit DummyOutput. Results can be written
+#as JSON and compared against an earlier run, failing when a case got slower than the threshold
+#usage: python benchmarks/suite.py [--filter dispatch] [--scale 1.0] [--repeat 9] [--output now.json]
+#                                  [--baseline before.json [--threshold 0.15]]
+import argparse
+import asyncio
+import gc
+import itertools
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+import msgpack
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from chat_client import ChatClient
+from codec import PacketEncoder
+from metrics import TYPE_NAMES
+from utility import *
+
+SESSION = 2840193377
+CASES = {} #name -> Case, in registration order
+CLIENTS = [] #made by the current setup, closed once its run is timed
+NOISE_FACTOR = 2 #a slowdown must also exceed this many times the runs' own relative spread to count
+MAX_TOLERANCE = 0.5 #cases noisier than this are reported as noisy, not judged
+
+class Case:
+    def __init__(self, name: str, items: int, setup, unit: str):
+        self.name = name
+        self.items = items #work per run at scale 1
+        self.setup = setup #setup(rng, n) -> run, untimed; run() may be a coroutine function
+        self.unit = unit
+
+def case(name: str, items: int, unit: str = "ops"):
+    def register(setup):
+        CASES[name] = Case(name, items, setup, unit)
+        return setup
+    return register
+
+#synthetic traffic: a busy channel with some DMs, the occasional membership change and the rare listing
+def words(rng, low: int, high: int) -> str:
+    return " ".join(rng.choice(VOCABULARY) for _ in range(rng.randint(low, high)))
+
+VOCABULARY = ("the deploy is done can someone check logs on staging lgtm thanks brb ok build failed "
+              "again merged rollback ping me when ready meeting in five").split()
+USERS = [f"clear-user{i}" for i in range(200)]
+CHANNELS = ["general", "random", "ops", "dev", "help"]
+
+REQUESTS = [
+    (9, 0.45, lambda rng: {"channel": rng.choice(CHANNELS), "message": words(rng, 1, 40)}),
+    (12, 0.25, lambda rng: {"to_username": rng.choice(USERS), "message": words(rng, 1, 15)}),
+    (3, 0.15, lambda rng: {}),
+    (10, 0.05, lambda rng: {"username": rng.choice(USERS)}),
+    (14, 0.05, lambda rng: {"offset": rng.randrange(0, 200)}),
+    (6, 0.05, lambda rng: {"channel": rng.choice(CHANNELS)}),
+]
+
+def make_requests(rng, n: int) -> list:
+    weights = [w for _, w, _ in REQUESTS]
+    packets = []
+    for _ in range(n):
+        request_type, _, fields = rng.choices(REQUESTS, weights)[0]
+        packet = {"request_type": request_type, "session": SESSION, "request_handle": rng.getrandbits(32)}
+        packet.update(fields(rng))
+        packets.append(packet)
+    return packets
+
+#one builder per response_type, shaped like local_server.py's answers; broadcasts ignore the handle
+RESPONSES = {
+    20: lambda rng, handle: {"response_type": 20, "response_handle": handle, "error": "Channel not found."},
+    21: lambda rng, handle: {"response_type": 21, "response_handle": handle},
+    22: lambda rng, handle: {"response_type": 22, "response_handle": handle, "session": SESSION,
+                             "username": "clear-me", "message": "Welcome, clear-me."},
+    23: lambda rng, handle: {"response_type": 23, "response_handle": handle, "message": "Goodbye."},
+    24: lambda rng, handle: {"response_type": 24, "response_handle": handle},
+    25: lambda rng, handle: {"response_type": 25, "response_handle": handle, "channel": rng.choice(CHANNELS),
+                             "description": words(rng, 2, 6)},
+    26: lambda rng, handle: {"response_type": 26, "response_handle": handle, "channels": CHANNELS, "next_page": False},
+    27: lambda rng, handle: {"response_type": 27, "response_handle": handle, "channel": rng.choice(CHANNELS),
+                             "description": words(rng, 2, 6), "members": rng.sample(USERS, 12)},
+    28: lambda rng, handle: {"response_type": 28, "username": rng.choice(USERS), "channel": rng.choice(CHANNELS)},
+    29: lambda rng, handle: {"response_type": 29, "username": rng.choice(USERS), "channel": rng.choice(CHANNELS)},
+    30: lambda rng, handle: {"response_type": 30, "username": rng.choice(USERS), "channel": rng.choice(CHANNELS),
+                             "message": words(rng, 1, 40)},
+    31: lambda rng, handle: {"response_type": 31, "response_handle": handle, "username": rng.choice(USERS),
+                             "status": "active", "transport": "clear", "channels": rng.sample(CHANNELS, 2),
+                             "wireguard_public_key": ""},
+    32: lambda rng, handle: {"response_type": 32, "response_handle": handle, "username": "clear-me"},
+    33: lambda rng, handle: {"response_type": 33, "from_username": rng.choice(USERS), "message": words(rng, 1, 15)},
+    34: lambda rng, handle: {"response_type": 34, "response_handle": handle, "old_username": "clear-me",
+                             "new_username": "clear-me"},
+    35: lambda rng, handle: {"response_type": 35, "response_handle": handle, "users": rng.sample(USERS, 20),
+                             "next_page": True},
+    36: lambda rng, handle: {"response_type": 36, "message": words(rng, 3, 10)},
+    37: lambda rng, handle: {"response_type": 37},
+}
+
+MIX = {30: 0.55, 33: 0.25, 28: 0.05, 29: 0.05, 36: 0.03, 24: 0.03, 21: 0.02, 20: 0.01, 35: 0.01}
+
+_handles = itertools.count(1)
+
+def make_responses(rng, n: int, types) -> list:
+    #fresh handles every time, a repeated one would be dropped as a duplicate before dispatch
+    if isinstance(types, dict):
+        chosen = rng.choices(list(types), list(types.values()), k=n)
+    else:
+        chosen = [types] * n
+    return [RESPONSES[t](rng, next(_handles)) for t in chosen]
+
+class NullTransport:
+    def sendto(self, data, addr=None):
+        pass
+
+    def close(self):
+        pass
+
+def make_client() -> ChatClient:
+    client = ChatClient()
+    CLIENTS.append(client)
+    client.username = "clear-me"
+    client.session = SESSION
+    client.connected = True
+    client.auto_reconnect = False #23 and 37 drop the session, nothing should try to get it back
+    client.encoder.set_session(SESSION)
+    client.rules.set_username("clear-me")
+    client.joined_channels.update(CHANNELS[:3])
+    return client
+
+#encode
+@case("encode.packet_encoder", 100000, "packets")
+def encode_packet_encoder(rng, n):
+    packets = make_requests(rng, n)
+    encoder = PacketEncoder()
+    encoder.set_session(SESSION)
+    encode = encoder.encode
+
+    def run():
+        for packet in packets:
+            encode(packet)
+    return run
+
+@case("encode.packb", 100000, "packets")
+def encode_packb(rng, n):
+    packets = make_requests(rng, n)
+    packb = msgpack.packb
+
+    def run():
+        for packet in packets:
+            packb(packet)
+    return run
+
+@case("encode.client_send", 50000, "packets")
+def encode_client_send(rng, n):
+    #ChatClient.send: metrics, encoder and the unpaced scheduler down to a transport that drops it all
+    packets = make_requests(rng, n)
+    client = make_client()
+    client.transport = NullTransport()
+    client.configure_scheduler(rate=0)
+    send = client.send
+
+    def run():
+        for packet in packets:
+            send(packet)
+    return run
+
+#decode
+@case("decode.unpacker", 100000, "packets")
+def decode_unpacker(rng, n):
+    datagrams = [msgpack.packb(r) for r in make_responses(rng, n, MIX)]
+    unpacker = msgpack.Unpacker(use_list=False, raw=False)
+
+    def run():
+        for data in datagrams:
+            unpacker.feed(data)
+            unpacker.unpack()
+    return run
+
+@case("decode.unpackb", 100000, "packets")
+def decode_unpackb(rng, n):
+    datagrams = [msgpack.packb(r) for r in make_responses(rng, n, MIX)]
+    unpackb = msgpack.unpackb
+
+    def run():
+        for data in datagrams:
+            unpackb(data)
+    return run
+
+#dispatch: handle_message with rendering to a sink that drops the lines
+def dispatch_case(types):
+    def setup(rng, n):
+        responses = make_responses(rng, n, types)
+        client = make_client()
+
+        async def run():
+            handle = client.handle_message
+            for response in responses:
+                await handle(response)
+            RENDERER.flush()
+        return run
+    return setup
+
+case("dispatch.mix", 50000, "msgs")(dispatch_case(MIX))
+for _type in RESPONSES:
+    case(f"dispatch.{_type}_{TYPE_NAMES.get(_type, _type)}", 5000, "msgs")(dispatch_case(_type))
+
+#formatting: building the lines, without rendering them
+@case("format.current_time", 200000, "calls")
+def format_current_time(rng, n):
+    def run():
+        for _ in range(n):
+            current_time()
+    return run
+
+@case("format.channel_line", 200000, "lines")
+def format_channel_line(rng, n):
+    messages = [(rng.choice(CHANNELS), rng.choice(USERS), words(rng, 1, 40)) for _ in range(n)]
+
+    def run():
+        for channel, sender, text in messages:
+            f"{GREY}[{current_time()}] [{WHITE}Channel | {channel}{GREY}] {sender} {BRIGHT_RED}➜ {BRIGHT_YELLOW} {text}"
+    return run
+
+@case("format.server_msg", 200000, "lines")
+def format_server_msg(rng, n):
+    texts = [words(rng, 3, 10) for _ in range(n)]
+
+    def run():
+        for text in texts:
+            server_msg(f"[Server] {text}")
+        RENDERER.flush()
+    return run
+
+#rendering: frames of formatted lines through Renderer._print to a DummyOutput
+def render_case(fidelity):
+    def setup(rng, n):
+        from prompt_toolkit.output import DummyOutput
+        lines = [f"{GREY}[{current_time()}] [{WHITE}Channel | {rng.choice(CHANNELS)}{GREY}] {rng.choice(USERS)}"
+                 f" {BRIGHT_RED}➜ {BRIGHT_YELLOW} {words(rng, 1, 40)}" for _ in range(n)]
+        renderer = Renderer(max_fps=0, fidelity=fidelity, output=DummyOutput())
+        frame = 25 #lines arriving within one frame of a busy channel
+
+        def run():
+            for i in range(0, len(lines), frame):
+                renderer.pending.extend(lines[i:i + frame])
+                renderer.flush()
+        return run
+    return setup
+
+for _fidelity in (CACHED, EXACT, PLAIN):
+    case(f"render.{_fidelity}", 5000 if _fidelity == EXACT else 20000, "lines")(render_case(_fidelity))
+
+async def measure(bench: Case, scale: float, repeat: int, seed: int) -> dict:
+    n = max(1, int(bench.items * scale))
+    rates = []
+    for attempt in range(repeat + 1): #the first run warms caches and is not counted
+        run = bench.setup(random.Random(seed), n)
+        gc.collect()
+        start = time.perf_counter()
+        result = run()
+        if asyncio.iscoroutine(result):
+            await result
+        elapsed = time.perf_counter() - start
+        if attempt:
+            rates.append(n / elapsed)
+        await cleanup()
+    best = max(rates)
+    return {"unit": bench.unit, "items": n, "best": best, "median": statistics.median(rates),
+            "stdev": statistics.stdev(rates) if len(rates) > 1 else 0.0,
+            "spread": round(statistics.median(abs(best - r) for r in rates) / best, 4)} #typical shortfall from the best
+
+async def cleanup():
+    #clients the setup made, and whatever their handlers started (resyncs)
+    while CLIENTS:
+        CLIENTS.pop().close()
+    tasks = asyncio.all_tasks() - {asyncio.current_task()}
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+def compare(results: dict, baseline: dict, threshold: float) -> tuple:
+    #(regressed, noisy): cases whose best rate fell by more than threshold (a fraction) against the baseline
+    #and by more than the noise either run showed, and cases too noisy to judge. The best of several runs
+    #is far steadier than any single one or the median
+    regressions = []
+    noisy = []
+    for name, result in results.items():
+        before = baseline.get(name)
+        if before is None:
+            continue
+        change = result["best"] / before["best"] - 1
+        tolerance = max(threshold, NOISE_FACTOR * max(result["spread"], before.get("spread", 0.0)))
+        result["change"] = round(change, 4)
+        result["tolerance"] = round(min(tolerance, MAX_TOLERANCE), 4)
+        if tolerance > MAX_TOLERANCE:
+            noisy.append(name)
+        elif change < -tolerance:
+            regressions.append(name)
+    return regressions, noisy
+
+async def run_suite(args) -> dict:
+    results = {}
+    for name, bench in CASES.items():
+        if args.filter and not any(f in name for f in args.filter):
+            continue
+        results[name] = await measure(bench, args.scale, args.repeat, args.seed)
+        if not args.quiet:
+            r = results[name]
+            print(f"  {name:32} {r['best']:>14,.0f} {r['unit']}/s  (median {r['median']:,.0f}, spread {r['spread']:.1%})",
+                  file=sys.stderr)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline microbenchmarks for the chat client")
+    parser.add_argument("--filter", action="append", help="only cases whose name contains this (repeatable)")
+    parser.add_argument("--scale", type=float, default=1.0, help="multiplies the work per case, 0.1 for a quick run")
+    parser.add_argument("--repeat", type=int, default=9, help="timed runs per case, the best is compared")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="JSON from an earlier --output to compare against")
+    parser.add_argument("--threshold", type=float, default=0.15, help="slowdown against the baseline that fails the run")
+    parser.add_argument("--list", action="store_true", help="list the cases and exit")
+    parser.add_argument("--quiet", action="store_true")
+    args = parser.parse_args()
+    if args.list:
+        for name, bench in CASES.items():
+            print(f"{name:32} {bench.items:>8} {bench.unit}")
+        return 0
+    RENDERER.sink = lambda lines: None
+    RENDERER.configure(max_fps=0)
+    RENDERER.effects = False
+
+    results = asyncio.run(run_suite(args))
+    report = {
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "machine": platform.machine(),
+        "msgpack": ".".join(map(str, msgpack.version)),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "scale": args.scale,
+        "repeat": args.repeat,
+        "results": results,
+    }
+    regressions, noisy = [], []
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions, noisy = compare(results, baseline["results"], args.threshold)
+        report["baseline"] = args.baseline
+        report["threshold"] = args.threshold
+        report["regressions"] = regressions
+        report["noisy"] = noisy
+        print(f"{'case':32} {'baseline':>14} {'now':>14} {'change':>8} {'allowed':>8}")
+        for name, result in results.items():
+            if "change" in result:
+                mark = "  REGRESSED" if name in regressions else "  noisy" if name in noisy else ""
+                print(f"{name:32} {baseline['results'][name]['best']:>14,.0f} {result['best']:>14,.0f}"
+                      f" {result['change']:>+8.1%} {-result['tolerance']:>+8.1%}{mark}")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    elif not args.baseline:
+        print(json.dumps(report, indent=2))
+    if noisy:
+        print(f"{len(noisy)} case(s) varied too much between runs to judge, rerun on a quieter machine or with"
+              f" a higher --repeat: " + ", ".join(noisy), file=sys.stderr)
+    if regressions:
+        print(f"{len(regressions)} case(s) slower than the baseline by more than the allowed change: "
+              + ", ".join(regressions), file=sys.stderr)
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
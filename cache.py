@@ -0,0 +1,89 @@
+import time
+from collections import OrderedDict
+
+DEFAULT_CAPACITY = 1024
+DEFAULT_TTL = 30.0
+
+class Entry:
+    __slots__ = ("value", "stored_at", "expires_at")
+
+    def __init__(self, value, stored_at, expires_at):
+        self.value = value
+        self.stored_at = stored_at
+        self.expires_at = expires_at
+
+#size-bounded LRU map whose entries also expire, each after its own ttl. get() only returns
+#fresh entries and counts hits and misses; peek() returns whatever is held, for patching in place
+class LruCache:
+    def __init__(self, capacity: int = DEFAULT_CAPACITY, ttl: float = DEFAULT_TTL):
+        self.capacity = capacity
+        self.ttl = ttl
+        self.entries = OrderedDict() #least recently used first
+        #counters
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        if time.monotonic() >= entry.expires_at:
+            del self.entries[key]
+            self.expired += 1
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry.value
+
+    def peek(self, key):
+        #regardless of age, without touching the counters or the LRU order
+        entry = self.entries.get(key)
+        return None if entry is None else entry.value
+
+    def put(self, key, value, ttl: float = None):
+        now = time.monotonic()
+        self.entries[key] = Entry(value, now, now + (self.ttl if ttl is None else ttl))
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def set_ttl(self, key, ttl: float):
+        #measured from when the entry was stored, not from now
+        entry = self.entries.get(key)
+        if entry is not None:
+            entry.expires_at = entry.stored_at + ttl
+
+    def invalidate(self, key) -> bool:
+        if self.entries.pop(key, None) is None:
+            return False
+        self.invalidations += 1
+        return True
+
+    def values(self):
+        return [entry.value for entry in self.entries.values()]
+
+    def clear(self):
+        self.entries.clear()
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self.entries),
+            "capacity": self.capacity,
+            "hits": self.hits,
+            "misses": self.misses,
+            "expired": self.expired,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
@@ -0,0 +1,45 @@
+import struct
+import time
+
+INCOMING = 0
+OUTGOING = 1
+
+#record: direction, seconds since the capture started (monotonic), datagram length, then the raw datagram
+HEADER = struct.Struct("<BdH")
+FILE_MAGIC = b"CHATCAP1"
+
+#raw datagrams exactly as they crossed the socket, for replaying traffic through the client offline
+class CaptureWriter:
+    def __init__(self, path: str):
+        self.path = path
+        self.file = open(path, "wb")
+        self.file.write(FILE_MAGIC)
+        self.started = time.monotonic()
+        self.records = 0
+        self.bytes = 0
+
+    def write(self, direction: int, data: bytes):
+        self.file.write(HEADER.pack(direction, time.monotonic() - self.started, len(data)))
+        self.file.write(data)
+        self.records += 1
+        self.bytes += len(data)
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+def read_capture(path: str):
+    #yields (direction, offset seconds, datagram), stopping quietly at a torn last record
+    with open(path, "rb") as f:
+        data = f.read()
+    if data[:len(FILE_MAGIC)] != FILE_MAGIC:
+        raise ValueError(f"{path} is not a capture file")
+    offset = len(FILE_MAGIC)
+    while offset + HEADER.size <= len(data):
+        direction, at, length = HEADER.unpack_from(data, offset)
+        offset += HEADER.size
+        if offset + length > len(data):
+            break
+        yield direction, at, data[offset:offset + length]
+        offset += length
@@ -1,14 +1,32 @@
 import asyncio
+import inspect
 import socket
 import msgpack
 import random
+import time
+from collections import OrderedDict, deque
 from utility import *
+from inflight import InflightTable, RequestTimeout
+from codec import PacketEncoder
+from directory import Directory
+from endpoints import EndpointPool
+from history import CHANNEL, DIRECT, OUTGOING
+from metrics import Metrics, TYPE_NAMES
+from capture import CaptureWriter, INCOMING as CAPTURE_IN, OUTGOING as CAPTURE_OUT
+from rules import RuleEngine
+from chunking import Reassembler, split_message, parse_chunk, MESSAGE_LIMIT, MAX_PARTS, CHUNK_WINDOW
+from membership import MembershipModel
+from keepalive import Keepalive, RttEstimator
+from reconnect import ReconnectSupervisor, OfflineQueue
+from scheduler import SendScheduler, PRIORITY, INTERACTIVE, BULK, CLASS_NAMES
+from ingest import IngestProtocol, set_rcvbuf, DEFAULT_RCVBUF, DEFAULT_QUEUE_SIZE, DEFAULT_BATCH_SIZE, DROP_OLDEST
 
 SERVER_HOST = 'csc4026z.link'
 SERVER_PORT = 51825  #clear text
+VIEW_LIMIT = 500 #lines kept per rules view
 
 class ChatClient:
-    def __init__(self): #constructor
+    def __init__(self, host: str = SERVER_HOST, port: int = SERVER_PORT, endpoints: list = None): #constructor
         self.session = None #session id
         self.username = None #server assigned username
         self.connected = False
@@ -16,174 +34,755 @@ class ChatClient:
         self.dm_count = 0
         self.joined_channels = set()
         self.user_count = 0  
-        self.silent_update = False #to update user count 
+        self.directory = Directory() #full user/channel listings, refreshed when stale
+        self.quiet_handles = OrderedDict() #request handles whose responses are not rendered
+        self.history = None #HistoryStore, opt-in
+        self.search = None #SearchIndex over the history
+        self.capture = None #CaptureWriter while recording raw traffic
+        self.rules = RuleEngine() #mute/highlight/route for incoming messages
+        self.views = {} #view name -> recent lines routed there by the rules
+        self.chunking = False #split messages over MESSAGE_LIMIT into parts instead of refusing them
+        self.reassembly = Reassembler() #parts of chunked messages from others (and our own echoes)
+        self.membership = MembershipModel(on_gap=self.schedule_resync) #channel members kept current from broadcasts
         self.minimal_mode = False #suppress server messages
 
-        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.endpoints = EndpointPool(endpoints or [(host, port)]) #servers to try, best first
+        self.sock = None #created per endpoint and connected to it
+        self.rcvbuf_size = DEFAULT_RCVBUF
+        self.rcvbuf = None #effective kernel buffer size
+        self.server_addr = None #resolved address of the current endpoint
+        self.ingest = IngestProtocol() #bounded queue between the socket and handle_message
+        self.batch_size = DEFAULT_BATCH_SIZE
+        self.transport = None
+        self.encoder = PacketEncoder() #reused Packer, session baked in after CONNECT
+        self.metrics = Metrics()
+        self.metrics.collector(self.collect_metrics)
+        self.scheduler = SendScheduler(self.transmit) #token bucket pacing with priority classes
+        self.rtt = RttEstimator() #smoothed RTT/RTO of the current server, drives request timeouts
+        self.inflight = InflightTable(self.send, metrics=self.metrics, estimator=self.rtt) #outstanding requests by request_handle
+        self.keepalive = Keepalive(self.ping_once, self.on_session_lost)
+        self.receive_task = None
+        self.background = [self.ping] #coroutine functions run for as long as a session lasts
+        self.tasks = set() #running background tasks, owned by the client
+        self.offline = OfflineQueue() #messages typed while reconnecting
+        self.supervisor = ReconnectSupervisor(self)
+        self.auto_reconnect = True
+        self.leaving = False #we asked for the DISCONNECT, do not reconnect
+
+        #response_type -> handler, see set_handler/subscribe
+        self.handlers = {
+            20: self.on_error,
+            21: self.on_ok,
+            22: self.on_connect,
+            23: self.on_disconnect,
+            24: self.on_pong,
+            25: self.on_channel_create,
+            26: self.on_channel_list,
+            27: self.on_channel_info,
+            28: self.on_channel_join,
+            29: self.on_channel_left,
+            30: self.on_channel_message,
+            31: self.on_whois,
+            32: self.on_whoami,
+            33: self.on_user_message,
+            34: self.on_set_username,
+            35: self.on_user_list,
+            36: self.on_server_message,
+            37: self.on_server_shutdown,
+        }
+        self.async_handlers = set() #response_types whose handler is a coroutine function
+        self.subscribers = {} #response_type -> [(hook, is coroutine function)]
+        self.wildcard_subscribers = []
+
+    def send(self, message: dict, priority: int = None):
+        #False if the scheduler shed the packet, None without a transport
+        if self.transport is None:
+            return None
+        if priority is None:
+            priority = PRIORITY.get(message["request_type"], INTERACTIVE)
+        self.metrics.inc("requests", message["request_type"])
+        return self.scheduler.submit(self.encoder.encode(message), priority, message["request_handle"])
+
+    def transmit(self, data: bytes):
+        if self.transport is not None:
+            self.transport.sendto(data) #connected socket, no address lookup
+            self.keepalive.sent()
+            self.metrics.inc("tx_packets")
+            self.metrics.inc("tx_bytes", n=len(data))
+            if self.capture is not None:
+                self.capture.write(CAPTURE_OUT, data)
+
+    def start_capture(self, path: str):
+        self.stop_capture()
+        self.capture = CaptureWriter(path)
+
+    def stop_capture(self):
+        #returns the finished writer (for its counters), None if nothing was recording
+        capture, self.capture = self.capture, None
+        if capture is not None:
+            capture.close()
+        return capture
+
+    def configure_scheduler(self, rate: float = None, burst: int = None):
+        #rate 0 disables pacing
+        self.scheduler.configure(rate, burst)
+
+    def configure_keepalive(self, interval: float = None, max_missed: int = None):
+        if interval is not None:
+            self.keepalive.interval = interval
+        if max_missed is not None:
+            self.keepalive.max_missed = max_missed
+
+    def configure_ingest(self, queue_size: int = DEFAULT_QUEUE_SIZE, overflow: str = DROP_OLDEST,
+                         batch_size: int = DEFAULT_BATCH_SIZE, rcvbuf: int = None):
+        #must be called before connect(), the protocol is bound when the transport opens
+        self.ingest = IngestProtocol(queue_size, overflow)
+        self.batch_size = batch_size
+        if rcvbuf:
+            self.rcvbuf_size = rcvbuf
+
+    def collect_metrics(self) -> dict:
+        #state the components already keep, read only when a snapshot is taken
+        gauges = {
+            ("ingest_depth", None): len(self.ingest.queue),
+            ("ingest_high_water", None): self.ingest.high_water,
+            ("ingest_dropped", None): self.ingest.dropped,
+            ("inflight", None): len(self.inflight.pending),
+            ("send_tokens", None): round(self.scheduler.tokens, 2),
+            ("directory_hits", None): self.directory.hits,
+            ("directory_misses", None): self.directory.misses,
+            ("membership_gaps", None): self.membership.gaps,
+            ("connected", None): int(self.connected),
+            ("rto_ms", None): round(self.rtt.rto * 1000, 3),
+            ("pings_skipped", None): self.keepalive.skipped,
+            ("pongs_missing", None): self.keepalive.missed,
+        }
+        if self.rtt.srtt is not None:
+            gauges[("srtt_ms", None)] = round(self.rtt.srtt * 1000, 3)
+            gauges[("rttvar_ms", None)] = round(self.rtt.rttvar * 1000, 3)
+        for priority, name in enumerate(CLASS_NAMES):
+            gauges[("send_queue", name)] = len(self.scheduler.queues[priority])
+            gauges[("send_shed", name)] = self.scheduler.shed[priority]
+        for name, stats in self.membership.stats().items():
+            for counter in ("size", "hits", "misses", "evictions", "invalidations"):
+                gauges[(f"cache_{counter}", name)] = stats[counter]
+        for counter, value in self.reassembly.stats().items():
+            gauges[(f"chunks_{counter}", None)] = value
+        if self.history is not None:
+            gauges[("history_messages", None)] = len(self.history)
+        return gauges
+
+    async def open_transport(self, endpoint):
+        self.close()
+        self.rtt.reset() #possibly a different server
+        loop = asyncio.get_running_loop()
+        self.sock = socket.socket(endpoint.family, socket.SOCK_DGRAM)
         self.sock.setblocking(False)
-        self.server_addr = (SERVER_HOST, SERVER_PORT)
+        self.rcvbuf = set_rcvbuf(self.sock, self.rcvbuf_size)
+        #a connected socket skips the address lookup on send and the kernel drops datagrams from anyone else
+        self.sock.connect(endpoint.addr)
+        self.server_addr = endpoint.addr
+        self.transport, _ = await loop.create_datagram_endpoint(lambda: self.ingest, sock=self.sock)
+        self.receive_task = asyncio.create_task(self.receive_loop())
 
-    def send(self, message: dict):
-        packed = msgpack.packb(message)
-        self.sock.sendto(packed, self.server_addr)
+    def close(self):
+        self.scheduler.clear()
+        if self.receive_task is not None:
+            self.receive_task.cancel()
+            self.receive_task = None
+        if self.transport is not None:
+            self.transport.close()
+            self.transport = None
+        elif self.sock is not None:
+            self.sock.close()
+        self.sock = None
+
+    #send a request and wait for its response, None if the server never answered
+    async def request(self, packet: dict, timeout: float = None, priority: int = None, coalesce: bool = False):
+        try:
+            return await self.inflight.request(packet, timeout, priority, coalesce)
+        except RequestTimeout as e:
+            error_msg(f"[!] Request failed: {e}")
+            return None
     #receive loop
     async def receive_loop(self):
         while True:
-            try:
-                data, _ = await asyncio.get_event_loop().sock_recvfrom(self.sock, self.byte_limit)
-                message = msgpack.unpackb(data)
-                await self.handle_message(message)
-            except Exception as e:
-                error_msg(f"[!] Error receiving message: {e}")
+            batch = await self.ingest.get_batch(self.batch_size)
+            self.keepalive.heard() #any datagram proves the server is there
+            self.metrics.inc("rx_packets", n=len(batch))
+            self.metrics.inc("rx_bytes", n=sum(map(len, batch)))
+            if self.capture is not None:
+                for data in batch:
+                    self.capture.write(CAPTURE_IN, data)
+            for data in batch:
+                try:
+                    message = msgpack.unpackb(data)
+                except Exception as e:
+                    self.metrics.inc("decode_errors")
+                    error_msg(f"[!] Undecodable datagram ({len(data)} bytes): {e.__class__.__name__} {e}")
+                    continue
+                try:
+                    await self.handle_message(message)
+                except Exception as e:
+                    self.metrics.inc("handler_errors", message.get("response_type") if isinstance(message, dict) else None)
+                    error_msg(f"[!] Error receiving message: {e}")
+            await asyncio.sleep(0) #let the prompt and the transport run between batches
     #server response handler
     async def handle_message(self, response: dict):
+        if not self.inflight.resolve(response): #duplicate of an answered request
+            return
         response_type = response.get("response_type")
-        if response_type == 22 and response.get("username"):  # CONNECT_response
+        self.metrics.inc("responses", response_type)
+        handler = self.handlers.get(response_type)
+        if handler is not None:
+            if response_type in self.async_handlers:
+                await handler(response)
+            else:
+                handler(response)
+        if self.subscribers:
+            hooks = self.subscribers.get(response_type)
+            if hooks:
+                await self._run_hooks(hooks, response)
+        if self.wildcard_subscribers:
+            await self._run_hooks(self.wildcard_subscribers, response)
+
+    async def _run_hooks(self, hooks, response: dict):
+        for hook, is_async in hooks:
+            if is_async:
+                await hook(response)
+            else:
+                hook(response)
+
+    #dispatch table registration
+    def set_handler(self, response_type: int, handler):
+        #replaces the built-in handler, None removes it; handlers may also be coroutine functions,
+        #which is decided here once rather than on every message
+        self.async_handlers.discard(response_type)
+        if handler is None:
+            self.handlers.pop(response_type, None)
+            return
+        self.handlers[response_type] = handler
+        if inspect.iscoroutinefunction(handler):
+            self.async_handlers.add(response_type)
+
+    def subscribe(self, response_type, hook):
+        #hook(response) runs after the handler, it may be a plain function or a coroutine function
+        #response_type None subscribes to every message
+        entry = (hook, inspect.iscoroutinefunction(hook))
+        if response_type is None:
+            self.wildcard_subscribers.append(entry)
+        else:
+            self.subscribers.setdefault(response_type, []).append(entry)
+
+    def unsubscribe(self, response_type, hook):
+        #builds new lists, so a hook removing itself does not disturb the loop running it
+        if response_type is None:
+            self.wildcard_subscribers = [entry for entry in self.wildcard_subscribers if entry[0] != hook]
+            return
+        hooks = [entry for entry in self.subscribers.get(response_type, ()) if entry[0] != hook]
+        if hooks:
+            self.subscribers[response_type] = hooks
+        else:
+            self.subscribers.pop(response_type, None)
+
+    #message history
+    def record_sent(self, kind: int, key: str, text: str):
+        if self.history is not None:
+            self.history.append(kind, key, self.username or "You", text, OUTGOING)
+
+    def show_history(self, target: str, count: int = 20):
+        if self.history is None:
+            error_msg("[!] History is disabled.")
+            return
+        #"#name" forces a channel, "@name" a user, otherwise channels win
+        if target.startswith("#"):
+            kind, key = CHANNEL, target[1:]
+        elif target.startswith("@"):
+            kind, key = DIRECT, target[1:]
+        elif (CHANNEL, target) in self.history.index or target in self.joined_channels:
+            kind, key = CHANNEL, target
+        else:
+            kind, key = DIRECT, target
+        messages = self.history.last(kind, key, count)
+        if not messages:
+            error_msg(f"[!] No history for {key}.")
+            return
+        for m in messages:
+            self.render_stored(m)
+
+    def search_history(self, query: str, key: str = None, sender: str = None, since: float = None, limit: int = 20):
+        if self.search is None:
+            error_msg("[!] Search is disabled.")
+            return []
+        results = self.search.search(query, key=key, sender=sender, since=since, limit=limit)
+        if not results:
+            error_msg("[!] No matching messages.")
+        else:
+            server_msg(f"[Server] {len(results)} match{'es' if len(results) != 1 else ''}")
+            for m in reversed(results): #oldest first, like the chat itself
+                self.render_stored(m)
+        return results
+
+    def render_stored(self, m):
+        stamp = datetime.fromtimestamp(m.timestamp).strftime("%m-%d %H:%M:%S")
+        sender = "You" if m.direction == OUTGOING else m.sender
+        if m.kind == CHANNEL:
+            mod_print(f"{GREY}[{stamp}] [{WHITE}Channel | {m.key}{GREY}] {sender} {BRIGHT_RED}➜ {BRIGHT_YELLOW} {m.text}")
+        elif m.direction == OUTGOING:
+            mod_print(f"{GREY}[{stamp}] [{CYAN}Direct Message{GREY}] You {BRIGHT_RED}➜ {GREY}{m.key}{BRIGHT_YELLOW} {m.text}")
+        else:
+            mod_print(f"{GREY}[{stamp}] [{CYAN}Direct Message{GREY}] {sender} {BRIGHT_RED}➜ {BRIGHT_YELLOW} {m.text}")
+
+    #chunked messages
+    def reassemble(self, source: tuple, text: str):
+        #the text to show, None while a chunked message is still missing parts
+        chunk = parse_chunk(text)
+        if chunk is None:
+            return text
+        if not self.reassembly.pending:
+            asyncio.get_running_loop().call_later(self.reassembly.timeout, self.expire_chunks)
+        return self.reassembly.add(source, *chunk, context=source)
+
+    def expire_chunks(self):
+        for (kind, channel, sender), text in self.reassembly.expire():
+            self.metrics.inc("chunks_incomplete")
+            if kind == CHANNEL:
+                self.render_channel_message(channel, sender, text)
+            else:
+                self.render_user_message(sender, text)
+        if self.reassembly.pending: #the oldest left decides when to look again
+            oldest = next(iter(self.reassembly.pending.values()))
+            delay = max(0.1, oldest.first_seen + self.reassembly.timeout - time.monotonic())
+            asyncio.get_running_loop().call_later(delay, self.expire_chunks)
+
+    async def send_chunked(self, request_type: int, field: str, target: str, message: str):
+        #parts go out in order, at most CHUNK_WINDOW awaiting their answer, paced by the scheduler behind
+        #interactive traffic; the first part that fails stops the rest, including any still queued
+        parts = split_message(message)
+        if len(parts) > MAX_PARTS:
+            error_msg(f"[!] Message too long to send, even in {MAX_PARTS} parts.")
+            return None
+        limit = self.scheduler.limits[BULK]
+        if limit is not None and len(self.scheduler.queues[BULK]) + min(CHUNK_WINDOW, len(parts)) > limit:
+            error_msg("[!] The send queue is full, try the message again shortly.")
+            return None
+        self.metrics.inc("chunked_sent")
+        window = {} #task -> request_handle
+        failed, response = False, None
+        started = 0
+        for part in parts:
+            if len(window) >= CHUNK_WINDOW:
+                failed, response = await self._await_parts(window, asyncio.FIRST_COMPLETED)
+                if failed:
+                    break
+            request_handle = random.getrandbits(32)
+            packet = {
+                "request_type": request_type,
+                "session": self.session,
+                "request_handle": request_handle,
+                field: target,
+                "message": part
+            }
+            last = asyncio.ensure_future(self.request(packet, priority=BULK))
+            window[last] = request_handle
+            started += 1
+            self.metrics.inc("chunks_sent")
+        if not failed:
+            failed, response = await self._await_parts(window, asyncio.ALL_COMPLETED)
+        if not failed:
+            return last.result()
+        for task in window:
+            task.cancel()
+        unsent = len(parts) - started + self.scheduler.drop(window.values())
+        error_msg(f"[!] A part of the long message failed, {unsent} of {len(parts)} parts were not sent.")
+        return response
+
+    async def _await_parts(self, window: dict, return_when) -> tuple:
+        #waits on the parts in flight and forgets the finished ones; (True, its response) if one failed
+        if not window:
+            return False, None
+        done, _ = await asyncio.wait(window, return_when=return_when)
+        failed, response = False, None
+        for task in done:
+            del window[task]
+            result = task.result()
+            if not failed and (result is None or result.get("response_type") == 20):
+                failed, response = True, result
+        return failed, response
+
+    #rules
+    def apply_verdict(self, verdict, head: str, text: str):
+        #a message some rule matched: dropped, highlighted and/or shown in views instead of the main stream
+        if verdict.muted:
+            self.metrics.inc("rules_muted")
+            return
+        if verdict.highlight:
+            self.metrics.inc("rules_highlighted")
+            for start, end in reversed(verdict.spans):
+                text = f"{text[:start]}{BOLD}{BRIGHT_MAGENTA}{text[start:end]}{RESET}{BRIGHT_YELLOW}{text[end:]}"
+            head = f"{BRIGHT_MAGENTA}★ {head}"
+        line = head + text
+        if not verdict.views:
+            mod_print(line)
+            return
+        for view in verdict.views:
+            self.metrics.inc("rules_routed", view)
+            lines = self.views.get(view)
+            if lines is None:
+                lines = self.views[view] = deque(maxlen=VIEW_LIMIT)
+            lines.append(line)
+
+    def show_view(self, name: str = None, count: int = 20):
+        if name is None:
+            if not self.views:
+                progress_msg("[=] Nothing has been routed to a view yet.")
+            for view, lines in sorted(self.views.items()):
+                server_msg(f"[View] {view} ({len(lines)} messages)")
+            return
+        lines = self.views.get(name)
+        if not lines:
+            error_msg(f"[!] No messages in view {name}.")
+            return
+        server_msg(f"[View] {name}")
+        for line in list(lines)[-count:]:
+            mod_print(line)
+
+    def show_rules(self):
+        stats = self.rules.stats()
+        server_msg(f"[Filter] {stats['rules']} rules, {stats['matched']} messages matched, "
+                   f"mentions {'on' if self.rules.mentions else 'off'}" + (f", file {self.rules.path}" if self.rules.path else ""))
+        for index, rule in enumerate(self.rules.rules, 1):
+            mod_print(f"{GREY}  {index:>3}. {WHITE}{rule}")
+
+    #rendering helpers
+    def mark_quiet(self, request_handle: int):
+        self.quiet_handles[request_handle] = True
+        if len(self.quiet_handles) > 1024:
+            self.quiet_handles.popitem(last=False)
+
+    def is_quiet(self, response: dict) -> bool:
+        return self.quiet_handles.pop(response.get("response_handle"), False)
+
+    def show_stats(self):
+        m = self.metrics
+        uptime = max(1e-9, time.time() - m.started)
+        server_msg(f"[Stats] over {uptime:.0f}s")
+        mod_print(f"{WHITE}  packets  {GREY}rx {m.count('rx_packets')} ({m.count('rx_packets') / uptime:.1f}/s, {m.count('rx_bytes')} B)"
+                  f" | tx {m.count('tx_packets')} ({m.count('tx_packets') / uptime:.1f}/s, {m.count('tx_bytes')} B)")
+        mod_print(f"{WHITE}  errors   {GREY}decode {m.count('decode_errors')} | handler {m.total('handler_errors')}"
+                  f" | timeouts {m.total('timeouts')} | retransmits {m.total('retransmits')} | duplicates {m.count('duplicates')}")
+        mod_print(f"{WHITE}  ping     {GREY}sent {m.count('pings')} | pongs {m.count('pongs')} | missed {m.count('pings_missed')}"
+                  f" | skipped {self.keepalive.skipped}"
+                  + (f" | srtt {self.rtt.srtt * 1000:.1f} ms rttvar {self.rtt.rttvar * 1000:.1f} ms" if self.rtt.srtt is not None else "")
+                  + f" | rto {self.rtt.rto * 1000:.0f} ms")
+        gauges = self.collect_metrics()
+        mod_print(f"{WHITE}  queues   {GREY}ingest {gauges[('ingest_depth', None)]} (max {gauges[('ingest_high_water', None)]}, dropped {gauges[('ingest_dropped', None)]})"
+                  f" | inflight {gauges[('inflight', None)]}"
+                  f" | send {sum(gauges[('send_queue', name)] for name in CLASS_NAMES)} (shed {sum(gauges[('send_shed', name)] for name in CLASS_NAMES)})")
+        mod_print(f"{WHITE}  caches   {GREY}" + " | ".join(
+            f"{name} {stats['size']}/{stats['capacity']} hit {stats['hits']} miss {stats['misses']} evicted {stats['evictions']}"
+            f" invalidated {stats['invalidations']}" for name, stats in self.membership.stats().items()))
+        chunks = self.reassembly.stats()
+        mod_print(f"{WHITE}  chunks   {GREY}sent {m.count('chunked_sent')} ({m.count('chunks_sent')} parts) | rebuilt {chunks['completed']}"
+                  f" | with gaps {chunks['incomplete']} | waiting {chunks['pending']} | dropped {chunks['dropped']}")
+        rows = sorted(key for name, key in m.histograms if name == "latency")
+        if rows:
+            mod_print(f"{WHITE}  {'request':16} {'count':>6} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'max ms':>8} {'rtt p50':>8}")
+            for request_type in rows:
+                latency = m.histograms[("latency", request_type)].summary()
+                rtt = m.histograms.get(("rtt", request_type))
+                rtt_p50 = f"{rtt.quantile(0.5) / 1000:.1f}" if rtt is not None else "-"
+                mod_print(f"{GREY}  {TYPE_NAMES.get(request_type, str(request_type)):16} {latency['count']:>6} {latency['p50']:>8.1f}"
+                          f" {latency['p90']:>8.1f} {latency['p99']:>8.1f} {latency['max']:>8.1f} {rtt_p50:>8}")
+
+    def show_listing(self, title: str, items, empty: str):
+        if not items:
+            error_msg(empty)
+        else:
+            server_msg(f"[Server] {title} ({len(items)})")
+            for item in items:
+                server_msg(f"[Server]  {BRIGHT_MAGENTA}•  {GREY} {item}")
+
+    #built-in handlers, one per response_type
+    def on_error(self, response: dict):  # ERROR_response
+        error_mesg = response.get("error")
+        error_msg(f"[Server] {error_mesg}")
+
+    def on_ok(self, response: dict):  # OK_response
+        server_msg("[Server] OK",self.minimal_mode)
+
+    def on_connect(self, response: dict):  # CONNECT_response
+        if response.get("username"):
             self.session = response["session"]
             self.username = response["username"]
             self.connected = True
-            server_msg(f"[Server] {response['message']}",self.minimal_mode)  
-        elif response_type == 23 and not response.get("username"):  # DISCONNECT_response
-            self.session = None
-            self.connected = False
-            server_msg(f"[Server] {response['message']}",self.minimal_mode)  
-        elif response_type == 24:  # PING_response
-            server_msg("[Server] Pong received.",self.minimal_mode)
-        elif response_type == 21:  # OK_response
-            server_msg("[Server] OK",self.minimal_mode)
-        elif response_type == 20:  # ERROR_response
-            error_mesg = response.get("error")
-            error_msg(f"[Server] {error_mesg}")
-        elif response_type == 36:  # SERVER_MESSAGE
-            text = response.get("message")
-            server_msg(f"[Server] {text}",self.minimal_mode)
-        elif response_type == 37:  # SERVER_SHUTDOWN
-            server_msg("[Server] Shutdown notice received. You may reconnect shortly.")
-            self.session = None
-            self.connected = False
-        elif response_type == 32:  # WHOAMI
-            server_msg(f"[Server] You are {response.get('username')}.")
-        elif response_type == 31:  # WHOIS_response
-            username = response.get("username")
-            status = response.get("status", "unknown")
-            transport = response.get("transport", "unknown")
-            channels = response.get("channels", [])
-            pubkey = response.get("wireguard_public_key", "")
-
-            server_msg(f"[Server] Username")
-            server_msg(f"[Server]  {BRIGHT_MAGENTA}•  {GREY} {username}")
-            server_msg(f"[Server] Status")
-            if status == "active":
-                server_msg(f"[Server]  {BRIGHT_MAGENTA}•  {BRIGHT_GREEN} {status}")
+            self.encoder.set_session(self.session)
+            self.rules.set_username(self.username)
+            self.membership.username = self.username
+            server_msg(f"[Server] {response['message']}",self.minimal_mode)
+
+    def drop_session(self, reason: str = "session closed", reconnect: bool = False):
+        username, channels = self.username, set(self.joined_channels)
+        self.session = None
+        self.connected = False
+        self.encoder.set_session(None)
+        self.membership.clear()
+        self.joined_channels.clear() #memberships belonged to the old session
+        self.inflight.cancel_all(reason)
+        self.stop_background()
+        if reconnect and self.auto_reconnect and not self.leaving:
+            self.supervisor.trigger(username, channels)
+
+    @property
+    def reconnecting(self) -> bool:
+        return self.supervisor.active
+
+    #background tasks
+    def add_background(self, coroutine_function):
+        self.background.append(coroutine_function)
+
+    def start_background(self):
+        self.stop_background()
+        for coroutine_function in self.background:
+            task = asyncio.create_task(coroutine_function())
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    def stop_background(self):
+        current = asyncio.current_task()
+        for task in list(self.tasks):
+            if task is not current: #a task may end the session it is running in
+                task.cancel()
+        self.tasks.clear()
+
+    def queue_offline(self, kind: int, target: str, message: str):
+        if self.offline.put(kind, target, message):
+            progress_msg(f"[*] Offline, message queued ({len(self.offline)} waiting).")
+        else:
+            error_msg(f"[!] Offline queue is full ({self.offline.limit}), message not queued.")
+
+    async def flush_offline(self):
+        messages, expired = self.offline.take()
+        if expired:
+            error_msg(f"[!] {expired} queued message(s) expired before the connection came back.")
+        for queued in messages:
+            if queued.kind == CHANNEL:
+                await self.send_channel_msg(queued.target, queued.text)
             else:
-                server_msg(f"[Server]  {BRIGHT_MAGENTA}•  {BRIGHT_RED} {status}")
-            server_msg(f"[Server] Transport")
-            server_msg(f"[Server]  {BRIGHT_MAGENTA}•  {GREY} {transport}")
-            if channels:
-                server_msg(f"[Server] Channels")
-                for ch in channels:
-                        server_msg(f"[Server]  {BRIGHT_MAGENTA}•  {GREY} {ch}")
-            if transport == "wireguard":
-                server_msg(f"[Server] Public Key")
-                server_msg(f"[Server]  {BRIGHT_MAGENTA}•  {GREY} {pubkey}")
-        elif response_type == 34:  # SETUSERNAME
-            old = response.get("old_username")
-            new = response.get("new_username")
-            self.username = new
-            server_msg(f"[Server] Username changed: {old} {BRIGHT_MAGENTA}→{GREY} {new}")
-        elif response_type == 25:  # CHANNEL_CREATE_response
-            channel = response.get("channel")
+                await self.send_dm(queued.target, queued.text)
+
+    def on_session_lost(self, reason: str):
+        #the keepalive gave up on the server
+        error_msg(f"[!] Connection lost: {reason}.")
+        self.metrics.inc("sessions_lost")
+        self.drop_session(reason, reconnect=True)
+
+    def on_disconnect(self, response: dict):  # DISCONNECT_response
+        if not response.get("username"):
+            self.drop_session(reconnect=not self.leaving)
+            server_msg(f"[Server] {response['message']}",self.minimal_mode)
+
+    def on_pong(self, response: dict):  # PING_response
+        server_msg("[Server] Pong received.",self.minimal_mode)
+
+    def on_channel_create(self, response: dict):  # CHANNEL_CREATE_response
+        channel = response.get("channel")
+        desc = response.get("description")
+        self.joined_channels.add(response.get("channel"))
+        self.directory.add("channels", "", channel)
+        self.membership.seed_channel(channel, desc, [self.username], True)
+        server_msg(f"[Server] Channel created {BRIGHT_MAGENTA}|{GREY} {channel}: {desc}")
+
+    def on_channel_list(self, response: dict):  # CHANNEL_LIST_response
+        channels = response.get("channels", [])
+        next_page = response.get("next_page", False)
+
+        if not self.is_quiet(response):
+            self.show_listing("Channel List", channels, "[!] No channels found.")
+            if channels and next_page:
+                progress_msg("[*] More channels available. Use: /channels <offset>")
+
+    def on_channel_info(self, response: dict):  # CHANNEL_INFO_response
+        channel = response.get("channel")
+        self.membership.seed_channel(channel, response.get("description", ""), response.get("members", []),
+                                     channel in self.joined_channels)
+        if not self.is_quiet(response):
+            self.render_channel_info(response)
+
+    def render_channel_info(self, response: dict):
+        channel = response.get("channel")
+        description = response.get("description", "")
+        members = response.get("members", [])
+
+        server_msg(f"[Server] Channel Name")
+        server_msg(f"[Server]  {BRIGHT_MAGENTA}•  {GREY}{channel}")
+        server_msg(f"[Server] Description")
+        server_msg(f"[Server]  {BRIGHT_MAGENTA}•  {GREY}{description}")
+        server_msg(f"[Server] Members ({len(members)})")
+        for user in members:
+            server_msg(f"[Server]  {BRIGHT_MAGENTA}•  {GREY}{user}")
+
+    def on_channel_join(self, response: dict):  # CHANNEL_JOIN_response
+        username = response.get("username")
+        channel = response.get("channel")
+        self.directory.add("users", channel, username)
+        if response.get("response_handle"): #our own join, broadcasts for it start now
+            self.membership.set_live(channel, True)
+        self.membership.joined(channel, username)
+        if not response.get("response_handle"):
+            server_msg(f"[Server] {username} joined {channel}")
+        else:
             desc = response.get("description")
+            server_msg(f"[Server] You joined {BRIGHT_MAGENTA}|{GREY} {channel}: {desc}")
             self.joined_channels.add(response.get("channel"))
-            server_msg(f"[Server] Channel created {BRIGHT_MAGENTA}|{GREY} {channel}: {desc}")
-        elif response_type == 28:  # CHANNEL_JOIN_response
-            username = response.get("username")
-            channel = response.get("channel")
-            if not response.get("response_handle"):
-                server_msg(f"[Server] {username} joined {channel}")
-            else:
-                desc = response.get("description")
-                server_msg(f"[Server] You joined {BRIGHT_MAGENTA}|{GREY} {channel}: {desc}")
-                self.joined_channels.add(response.get("channel"))
-        elif response_type == 26:  # CHANNEL_LIST_response
-            channels = response.get("channels", [])
-            next_page = response.get("next_page", False)
-
-            if not channels:
-                error_msg("[!] No channels found.")
-            else:
-                server_msg(f"[Server] Channel List ({len(channels)})")
-                for ch in channels:
+
+    def on_channel_left(self, response: dict):  # CHANNEL_LEFT_response
+        username = response.get("username")
+        channel = response.get("channel")
+        self.directory.remove("users", channel, username)
+        self.membership.left(channel, username)
+        if response.get("response_handle"):
+            self.membership.set_live(channel, False)
+        if not response.get("response_handle"):
+            server_msg(f"[Server] {username} left {channel}")
+        else:
+            server_msg(f"[Server] You left {channel}")
+            self.joined_channels.discard(response.get("channel"))
+
+    def on_channel_message(self, response: dict):  # CHANNEL_MESSAGE_response
+        sender = response.get("username", "unknown")
+        channel = response.get("channel", "?")
+        text = self.reassemble((CHANNEL, channel, sender), response.get("message", ""))
+        if text is not None:
+            self.render_channel_message(channel, sender, text)
+
+    def render_channel_message(self, channel: str, sender: str, text: str):
+        verdict = None
+        if sender == self.username:
+            sender = "You" #our own messages are recorded when the send is acknowledged
+        else:
+            if self.history is not None:
+                self.history.append(CHANNEL, channel, sender, text)
+            verdict = self.rules.evaluate(channel, sender, text)
+        if verdict is None:
+            mod_print(f"{GREY}[{current_time()}] [{WHITE}Channel | {channel}{GREY}] {sender} {BRIGHT_RED}➜ {BRIGHT_YELLOW} {text}")
+        else:
+            self.apply_verdict(verdict, f"{GREY}[{current_time()}] [{WHITE}Channel | {channel}{GREY}] {sender} {BRIGHT_RED}➜ {BRIGHT_YELLOW} ", text)
+
+    def on_whois(self, response: dict):  # WHOIS_response
+        self.membership.seed_user(response.get("username"), response.get("status", "unknown"),
+                                  response.get("transport", "unknown"), response.get("wireguard_public_key", ""),
+                                  response.get("channels", []))
+        self.render_whois(response)
+
+    def render_whois(self, response: dict):
+        username = response.get("username")
+        status = response.get("status", "unknown")
+        transport = response.get("transport", "unknown")
+        channels = response.get("channels", [])
+        pubkey = response.get("wireguard_public_key", "")
+
+        server_msg(f"[Server] Username")
+        server_msg(f"[Server]  {BRIGHT_MAGENTA}•  {GREY} {username}")
+        server_msg(f"[Server] Status")
+        if status == "active":
+            server_msg(f"[Server]  {BRIGHT_MAGENTA}•  {BRIGHT_GREEN} {status}")
+        else:
+            server_msg(f"[Server]  {BRIGHT_MAGENTA}•  {BRIGHT_RED} {status}")
+        server_msg(f"[Server] Transport")
+        server_msg(f"[Server]  {BRIGHT_MAGENTA}•  {GREY} {transport}")
+        if channels:
+            server_msg(f"[Server] Channels")
+            for ch in channels:
                     server_msg(f"[Server]  {BRIGHT_MAGENTA}•  {GREY} {ch}")
-                if next_page:
-                    progress_msg("[*] More channels available. Use: /channels <offset>")
-        elif response_type == 29:  # CHANNEL_LEFT_response
-            username = response.get("username")
-            channel = response.get("channel")
-            if not response.get("response_handle"):
-                server_msg(f"[Server] {username} left {channel}")
-            else:
-                server_msg(f"[Server] You left {channel}")
-                self.joined_channels.discard(response.get("channel"))
-        elif response_type == 27:  # CHANNEL_INFO_response
-            channel = response.get("channel")
-            description = response.get("description", "")
-            members = response.get("members", [])
-
-            server_msg(f"[Server] Channel Name")
-            server_msg(f"[Server]  {BRIGHT_MAGENTA}•  {GREY}{channel}")
-            server_msg(f"[Server] Description")
-            server_msg(f"[Server]  {BRIGHT_MAGENTA}•  {GREY}{description}")
-            server_msg(f"[Server] Members ({len(members)})")
-            for user in members:
-                server_msg(f"[Server]  {BRIGHT_MAGENTA}•  {GREY}{user}")
-        elif response_type == 35:  # USER_LIST_response
-            users = response.get("users", [])
-            self.user_count = len(response.get("users", []))
-            next_page = response.get("next_page", False)
-
-            if not self.silent_update:
-                if not users:
-                    error_msg("[!] No users found.")
-                else:
-                    server_msg(f"[Server] User List ({len(users)})")
-                    for u in users:
-                        server_msg(f"[Server]  {BRIGHT_MAGENTA}•  {GREY} {u}")
-
-                    if next_page:
-                        progress_msg("[*] More users exist. Try: /users <offset>")
-            self.silent_update = False
-        elif response_type == 33:  # USER_MESSAGE_response
-            self.dm_count += 1
-            sender = response.get("from_username", "unknown")
-            text = response.get("message", "")
-            if sender == self.username:
-                sender = "You"
+        if transport == "wireguard":
+            server_msg(f"[Server] Public Key")
+            server_msg(f"[Server]  {BRIGHT_MAGENTA}•  {GREY} {pubkey}")
+
+    def on_whoami(self, response: dict):  # WHOAMI
+        server_msg(f"[Server] You are {response.get('username')}.")
+
+    def on_user_message(self, response: dict):  # USER_MESSAGE_response
+        sender = response.get("from_username", "unknown")
+        text = self.reassemble((DIRECT, None, sender), response.get("message", ""))
+        if text is not None:
+            self.render_user_message(sender, text)
+
+    def render_user_message(self, sender: str, text: str):
+        self.dm_count += 1
+        verdict = None
+        if sender == self.username:
+            sender = "You"
+        else:
+            if self.history is not None:
+                self.history.append(DIRECT, sender, sender, text)
+            verdict = self.rules.evaluate(None, sender, text)
+        if verdict is None:
             mod_print(f"{GREY}[{current_time()}] [{CYAN}Direct Message{GREY}] {sender} {BRIGHT_RED}➜ {BRIGHT_YELLOW} {text}")
-        elif response_type == 30:  # CHANNEL_MESSAGE_response
-                sender = response.get("username", "unknown")
-                if sender == self.username:
-                    sender = "You"
-                channel = response.get("channel", "?")
-                text = response.get("message", "")
-                mod_print(f"{GREY}[{current_time()}] [{WHITE}Channel | {channel}{GREY}] {sender} {BRIGHT_RED}➜ {BRIGHT_YELLOW} {text}")
+        else:
+            self.apply_verdict(verdict, f"{GREY}[{current_time()}] [{CYAN}Direct Message{GREY}] {sender} {BRIGHT_RED}➜ {BRIGHT_YELLOW} ", text)
+
+    def on_set_username(self, response: dict):  # SETUSERNAME
+        old = response.get("old_username")
+        new = response.get("new_username")
+        self.username = new
+        self.rules.set_username(new)
+        self.membership.username = new
+        self.directory.rename("users", old, new)
+        self.membership.renamed(old, new)
+        server_msg(f"[Server] Username changed: {old} {BRIGHT_MAGENTA}→{GREY} {new}")
+
+    def on_user_list(self, response: dict):  # USER_LIST_response
+        users = response.get("users", [])
+        next_page = response.get("next_page", False)
+
+        if not self.is_quiet(response):
+            self.show_listing("User List", users, "[!] No users found.")
+            if users and next_page:
+                progress_msg("[*] More users exist. Try: /users <offset>")
+
+    def on_server_message(self, response: dict):  # SERVER_MESSAGE
+        text = response.get("message")
+        server_msg(f"[Server] {text}",self.minimal_mode)
+
+    def on_server_shutdown(self, response: dict):  # SERVER_SHUTDOWN
+        server_msg("[Server] Shutdown notice received. You may reconnect shortly.")
+        self.drop_session("server shutdown", reconnect=True)
     #protocol functions
     async def connect(self):
+        self.leaving = False
         progress_msg("[*] Sending CONNECT request...",self.minimal_mode)
-        request_handle = random.getrandbits(32)
-        packet = {
-            "request_type": 1,
-            "request_handle": request_handle
-        }
-        self.send(packet)
-        try:
-            data, _ = await asyncio.get_event_loop().sock_recvfrom(self.sock, self.byte_limit)
-            response = msgpack.unpackb(data)        
-            await self.handle_message(response)
-        except Exception as e:
-            error_msg(f"[!] Failed to connect: {e}")
+        candidates = await self.endpoints.candidates()
+        if not candidates:
+            error_msg("[!] Failed to connect: could not resolve any server address")
+            return None
+        #fail over down the ranked endpoints until one accepts the session
+        for endpoint in candidates:
+            await self.open_transport(endpoint)
+            request_handle = random.getrandbits(32)
+            packet = {
+                "request_type": 1,
+                "request_handle": request_handle
+            }
+            started = time.monotonic()
+            try:
+                response = await self.inflight.request(packet)
+            except RequestTimeout as e:
+                error_msg(f"[!] Failed to connect to {endpoint}: {e}")
+                response = None
+            if self.connected:
+                self.endpoints.mark_ok(endpoint)
+                #this CONNECT's own round trip; it is never retransmitted, so the sample is unambiguous
+                endpoint.observe_rtt(time.monotonic() - started)
+                return response
+            self.endpoints.mark_failed(endpoint)
+            self.close()
+        return None
 
     async def disconnect(self):
+        self.leaving = True
+        self.supervisor.cancel()
+        self.offline.clear()
         if self.connected:
             progress_msg("[*] Sending DISCONNECT request...",self.minimal_mode)
             request_handle = random.getrandbits(32)
@@ -192,18 +791,28 @@ class ChatClient:
                 "session":self.session,
                 "request_handle": request_handle
             }
-            self.send(packet)
+            return await self.request(packet)
 
     async def ping(self):
-        while self.connected:
-            request_handle = random.getrandbits(32)
-            packet = {
-                "request_type": 3,
-                "session":self.session,
-                "request_handle": request_handle
-            }
-            self.send(packet)
-            await asyncio.sleep(20)
+        #keepalive for as long as the session lasts, see keepalive.Keepalive
+        await self.keepalive.run(lambda: self.connected)
+
+    async def ping_once(self) -> bool:
+        request_handle = random.getrandbits(32)
+        packet = {
+            "request_type": 3,
+            "session":self.session,
+            "request_handle": request_handle
+        }
+        self.metrics.inc("pings")
+        try:
+            await self.inflight.request(packet)
+        except RequestTimeout:
+            self.metrics.inc("pings_missed")
+            return False
+        self.metrics.inc("pongs")
+        self.metrics.set("last_pong", round(time.time(), 3))
+        return True
 
     async def whoami(self):
         if self.connected:
@@ -213,13 +822,25 @@ class ChatClient:
                 "session": self.session,
                 "request_handle": request_handle
             }
-            self.send(packet)
+            return await self.request(packet)
 
-    async def whois(self, username: str):
+    async def whois(self, username: str, force: bool = False):
         if self.connected:
             if not username or len(username) > 20:
                 error_msg("[!] Invalid username.")
             else:
+                state = None if force else self.membership.user(username)
+                if state is not None: #answered from memory
+                    response = {
+                        "response_type": 31,
+                        "username": state.username,
+                        "status": state.status,
+                        "transport": state.transport,
+                        "channels": sorted(state.channels),
+                        "wireguard_public_key": state.pubkey
+                    }
+                    self.render_whois(response)
+                    return response
                 request_handle = random.getrandbits(32)
                 packet = {
                     "request_type": 10, 
@@ -227,15 +848,16 @@ class ChatClient:
                     "request_handle": request_handle,
                     "username": username
                 }
-                self.send(packet)
+                return await self.request(packet)
 
-    async def set_username(self,username):
+    async def set_username(self,username, raw: bool = False):
+        #raw sends the name as given, e.g. one the server assigned earlier
         if self.connected:
             if ":" in username:
                 error_msg("[!] Invalid username. It must not contain ':'.")
             else:
                 request_handle = random.getrandbits(32)
-                if  SERVER_PORT== 51825: #clear-text port
+                if not raw and self.endpoints.current and self.endpoints.current.port == SERVER_PORT: #clear-text port
                     username = f"clear-{username}"
                 packet = {
                     "request_type": 13,
@@ -243,7 +865,7 @@ class ChatClient:
                     "request_handle": request_handle,
                     "username":username
                 }
-                self.send(packet)
+                return await self.request(packet)
 
     async def create_channel(self,name:str,description:str):
         if self.connected:
@@ -260,7 +882,7 @@ class ChatClient:
                     "channel":name,
                     "description":description
                 }
-                self.send(packet)
+                return await self.request(packet)
 
     async def join_channel(self, channel: str):
         if self.connected:
@@ -274,7 +896,107 @@ class ChatClient:
                     "request_handle": request_handle,
                     "channel": channel
                 }
-                self.send(packet)
+                return await self.request(packet)
+
+    #quiet CHANNEL_INFO after the membership model lost track of a channel we are in
+    def schedule_resync(self, channel: str):
+        if self.connected:
+            asyncio.ensure_future(self._resync(channel))
+
+    async def _resync(self, channel: str):
+        request_handle = random.getrandbits(32)
+        packet = {
+            "request_type": 6,
+            "session": self.session,
+            "request_handle": request_handle,
+            "channel": channel
+        }
+        self.mark_quiet(request_handle)
+        try:
+            await self.inflight.request(packet, priority=BULK, coalesce=True)
+        except RequestTimeout:
+            pass #stays stale, the next lookup goes to the server
+
+    #full listings: every page streamed in, prefetching the next offsets concurrently
+    async def iter_pages(self, request_type: int, field: str, channel: str = "", prefetch: int = 2, priority: int = INTERACTIVE):
+        response = await self._fetch_page(request_type, channel, 0, priority)
+        items = response.get(field, ())
+        yield items
+        size = len(items)
+        if not size or not response.get("next_page"):
+            return
+        pending = deque()
+        offset = size
+        try:
+            for _ in range(max(1, prefetch)):
+                pending.append(asyncio.ensure_future(self._fetch_page(request_type, channel, offset, priority)))
+                offset += size
+            while pending:
+                response = await pending.popleft()
+                items = response.get(field, ())
+                yield items
+                if not items or not response.get("next_page"):
+                    return
+                pending.append(asyncio.ensure_future(self._fetch_page(request_type, channel, offset, priority)))
+                offset += size
+        finally:
+            for task in pending: #pages past the end
+                task.cancel()
+                if task.done() and not task.cancelled():
+                    task.exception()
+
+    async def _fetch_page(self, request_type: int, channel: str, offset: int, priority: int):
+        request_handle = random.getrandbits(32)
+        packet = {
+            "request_type": request_type,
+            "session": self.session,
+            "request_handle": request_handle,
+            "offset": offset
+        }
+        if channel:
+            packet["channel"] = channel
+        self.mark_quiet(request_handle)
+        return await self.inflight.request(packet, priority=priority)
+
+    def iter_users(self, channel: str = "", prefetch: int = 2, priority: int = INTERACTIVE):
+        return self.iter_pages(14, "users", channel, prefetch, priority)
+
+    def iter_channels(self, prefetch: int = 2, priority: int = INTERACTIVE):
+        return self.iter_pages(5, "channels", "", prefetch, priority)
+
+    async def _fetch_listing(self, kind: str, pages, channel: str, force: bool, background: bool):
+        if not force:
+            items = self.directory.get(kind, channel)
+            if items is not None:
+                return items
+        items = []
+        try:
+            async for page in pages:
+                items.extend(page)
+        except RequestTimeout as e:
+            if not background:
+                error_msg(f"[!] Request failed: {e}")
+            return None
+        return self.directory.store(kind, channel, items)
+
+    async def fetch_users(self, channel: str = "", force: bool = False, background: bool = False):
+        if self.connected:
+            if channel and len(channel) > 20:
+                error_msg("[!] Invalid channel name.")
+                return None
+            state = None if force or not channel else self.membership.channel(channel)
+            if state is not None:
+                return sorted(state.members)
+            priority = BULK if background else INTERACTIVE
+            users = await self._fetch_listing("users", self.iter_users(channel, priority=priority), channel, force, background)
+            if users is not None and not channel:
+                self.user_count = len(users)
+            return users
+
+    async def fetch_channels(self, force: bool = False, background: bool = False):
+        if self.connected:
+            priority = BULK if background else INTERACTIVE
+            return await self._fetch_listing("channels", self.iter_channels(priority=priority), "", force, background)
 
     async def list_channels(self, offset: int = 0):
         if self.connected:
@@ -285,7 +1007,7 @@ class ChatClient:
                 "request_handle": request_handle,
                 "offset": offset  # Optional
            }
-           self.send(packet)
+           return await self.request(packet)
 
     async def leave_channel(self, channel: str):
         if self.connected:
@@ -299,13 +1021,23 @@ class ChatClient:
                     "request_handle": request_handle,
                     "channel": channel
                 }
-                self.send(packet)
+                return await self.request(packet)
 
-    async def channel_info(self, channel: str):
+    async def channel_info(self, channel: str, force: bool = False):
         if self.connected:
             if not channel or len(channel) > 20:
                 error_msg("[!] Invalid channel name.")
             else:
+                state = None if force else self.membership.channel(channel)
+                if state is not None: #answered from memory
+                    response = {
+                        "response_type": 27,
+                        "channel": state.name,
+                        "description": state.description,
+                        "members": sorted(state.members)
+                    }
+                    self.render_channel_info(response)
+                    return response
                 request_handle = random.getrandbits(32)
                 packet = {
                     "request_type": 6,  
@@ -313,7 +1045,7 @@ class ChatClient:
                     "request_handle": request_handle,
                     "channel": channel
                 }
-                self.send(packet)
+                return await self.request(packet)
 
     async def list_users(self, channel: str = "", offset: int = 0):
         if self.connected:
@@ -330,16 +1062,23 @@ class ChatClient:
                 else:
                     packet["channel"] = channel
 
-            self.send(packet)
+            return await self.request(packet)
 
     async def send_dm(self, to_username: str, message: str):
-        if self.connected:
+        if not self.connected and self.reconnecting:
+            self.queue_offline(DIRECT, to_username, message)
+        elif self.connected:
             if len(to_username) > 20:
                 error_msg("[!] Username must be 20 characters or fewer.")
                 return
-            if len(message) > 500:
-                error_msg("[!] Message must be 500 characters or fewer.")
-                return
+            if len(message) > MESSAGE_LIMIT:
+                if not self.chunking:
+                    error_msg(f"[!] Message must be {MESSAGE_LIMIT} characters or fewer (/chunk on to send it in parts).")
+                    return
+                response = await self.send_chunked(12, "to_username", to_username, message)
+                if response is not None and response.get("response_type") != 20:
+                    self.record_sent(DIRECT, to_username, message)
+                return response
 
             request_handle = random.getrandbits(32)
             packet = {
@@ -349,16 +1088,26 @@ class ChatClient:
                 "to_username": to_username,
                 "message": message
             }
-            self.send(packet)
+            response = await self.request(packet)
+            if response is not None and response.get("response_type") != 20:
+                self.record_sent(DIRECT, to_username, message)
+            return response
 
     async def send_channel_msg(self, channel: str, message: str):
-        if self.connected:
+        if not self.connected and self.reconnecting:
+            self.queue_offline(CHANNEL, channel, message)
+        elif self.connected:
             if len(channel) > 20:
                 error_msg("[!] Channel name must be 20 characters or fewer.")
                 return
-            if len(message) > 500:
-                error_msg("[!] Message must be 500 characters or fewer.")
-                return
+            if len(message) > MESSAGE_LIMIT:
+                if not self.chunking:
+                    error_msg(f"[!] Message must be {MESSAGE_LIMIT} characters or fewer (/chunk on to send it in parts).")
+                    return
+                response = await self.send_chunked(9, "channel", channel, message)
+                if response is not None and response.get("response_type") != 20:
+                    self.record_sent(CHANNEL, channel, message)
+                return response
 
             request_handle = random.getrandbits(32)
             packet = {
@@ -368,4 +1117,7 @@ class ChatClient:
                 "channel": channel,
                 "message": message
             }
-            self.send(packet)
\ No newline at end of file
+            response = await self.request(packet)
+            if response is not None and response.get("response_type") != 20:
+                self.record_sent(CHANNEL, channel, message)
+            return response
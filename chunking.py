@@ -0,0 +1,120 @@
+import random
+import re
+import time
+from collections import OrderedDict
+
+MESSAGE_LIMIT = 500 #characters the server accepts in one message
+MAX_PARTS = 64 #longest message that is chunked, and the most parts a reassembly will wait for
+REASSEMBLY_TIMEOUT = 15.0 #seconds after the first part before an incomplete message is shown with gaps
+MAX_PENDING = 256 #incomplete messages held at once
+CHUNK_WINDOW = 4 #parts of one message awaiting their answer at once, the rest wait their turn here
+SPLIT_WINDOW = 0.2 #look this far back from a cut for whitespace to split at
+
+#"~<id>:<part>/<total>~ " in front of every part: readable by clients that do not reassemble, and cheap to
+#recognise for those that do
+HEADER = re.compile(r"~([0-9a-z]{4}):(\d{1,2})/(\d{1,2})~ ")
+
+def _message_id() -> str:
+    return format(random.getrandbits(16), "04x")
+
+def split_message(text: str, limit: int = MESSAGE_LIMIT) -> list:
+    #parts that concatenate (headers stripped) back to exactly text, cut after whitespace where possible
+    ident = _message_id()
+    header_size = len(f"~{ident}:{MAX_PARTS}/{MAX_PARTS}~ ")
+    body = limit - header_size
+    pieces = []
+    start = 0
+    while start < len(text):
+        end = min(len(text), start + body)
+        if end < len(text):
+            floor = end - int(body * SPLIT_WINDOW)
+            cut = max(text.rfind(" ", floor, end), text.rfind("\n", floor, end))
+            if cut >= floor:
+                end = cut + 1
+        pieces.append(text[start:end])
+        start = end
+    total = len(pieces)
+    return [f"~{ident}:{index}/{total}~ {piece}" for index, piece in enumerate(pieces, 1)]
+
+def parse_chunk(text: str):
+    #(id, part, total, body) for a part of a chunked message, otherwise None
+    match = HEADER.match(text)
+    if match is None:
+        return None
+    part, total = int(match.group(2)), int(match.group(3))
+    if not 1 <= part <= total <= MAX_PARTS:
+        return None
+    return match.group(1), part, total, text[match.end():]
+
+class Partial:
+    __slots__ = ("context", "total", "parts", "first_seen")
+
+    def __init__(self, context, total):
+        self.context = context #whatever the caller needs to render it later
+        self.total = total
+        self.parts = {}
+        self.first_seen = time.monotonic()
+
+    def text(self) -> str:
+        return "".join(self.parts.get(i, f"[… part {i}/{self.total} missing …]") for i in range(1, self.total + 1))
+
+#rebuilds chunked messages whatever order their parts arrive in; parts that never arrive are given up
+#on after timeout seconds and the message is shown with the gaps marked
+class Reassembler:
+    def __init__(self, timeout: float = REASSEMBLY_TIMEOUT, max_pending: int = MAX_PENDING):
+        self.timeout = timeout
+        self.max_pending = max_pending
+        self.pending = {} #(source, id) -> Partial, oldest first
+        self.finished = OrderedDict() #recently rebuilt keys, so a late duplicate part does not start a new message
+        self.completed = 0
+        self.incomplete = 0
+        self.dropped = 0
+        self.duplicates = 0
+
+    def __len__(self):
+        return len(self.pending)
+
+    def add(self, source, ident: str, part: int, total: int, body: str, context=None):
+        #source tells senders apart (e.g. (channel, sender)); returns the whole text once every part is in
+        key = (source, ident)
+        if key in self.finished:
+            self.duplicates += 1
+            return None
+        partial = self.pending.get(key)
+        if partial is None:
+            if len(self.pending) >= self.max_pending:
+                del self.pending[next(iter(self.pending))]
+                self.dropped += 1
+            partial = self.pending[key] = Partial(context, total)
+        if part in partial.parts or total != partial.total:
+            self.duplicates += 1
+            return None
+        partial.parts[part] = body
+        if len(partial.parts) < partial.total:
+            return None
+        del self.pending[key]
+        self._finish(key)
+        self.completed += 1
+        return partial.text()
+
+    def _finish(self, key):
+        self.finished[key] = True
+        if len(self.finished) > self.max_pending * 4:
+            self.finished.popitem(last=False)
+
+    def expire(self) -> list:
+        #(context, text with gaps) for every message that waited too long
+        cutoff = time.monotonic() - self.timeout
+        expired = []
+        for key, partial in list(self.pending.items()):
+            if partial.first_seen > cutoff:
+                break #insertion order is age order
+            del self.pending[key]
+            self._finish(key)
+            self.incomplete += 1
+            expired.append((partial.context, partial.text()))
+        return expired
+
+    def stats(self) -> dict:
+        return {"pending": len(self.pending), "completed": self.completed, "incomplete": self.incomplete,
+                "dropped": self.dropped, "duplicates": self.duplicates}
@@ -1,11 +1,22 @@
 import asyncio
+import os
+import random
+import time
 from prompt_toolkit import PromptSession
 from prompt_toolkit.patch_stdout import patch_stdout
 from prompt_toolkit.styles import Style
-from chat_client import ChatClient
+from prompt_toolkit.formatted_text import ANSI
+from chat_client import ChatClient, SERVER_PORT
+from endpoints import parse_endpoints
+from history import HistoryStore, DEFAULT_DIR as HISTORY_DIR
+from search import SearchIndex
+from loopmon import LoopMonitor
+from rules import parse_rule, RuleError, DEFAULT_PATH as RULES_PATH
 from utility import *
 from shutil import get_terminal_size
 from prompt_toolkit.auto_suggest import AutoSuggestFromHistory
+from prompt_toolkit.completion import Completer, Completion
+from completion import NameIndex, PrefixIndex
 
 custom_style = Style.from_dict({
     "prompt": "ansiyellow",
@@ -14,7 +25,7 @@ custom_style = Style.from_dict({
     "bottom-toolbar.text": "bg:#000000 fg:#aaaaaa",
 })   
 
-def print_menu(connected):
+async def print_menu(connected):
     status = ""
     if connected:
         status = f"{BRIGHT_GREEN}•{RESET}"
@@ -32,162 +43,475 @@ def print_menu(connected):
         mod_print(f"  /join <channel>               {BRIGHT_YELLOW}- Join a channel{RESET}")
         mod_print(f"  /leave <channel>              {BRIGHT_YELLOW}- Leave a channel{RESET}")
         mod_print(f"  /create <channel> <desc>      {BRIGHT_YELLOW}- Create a new channel with description{RESET}")
-        mod_print(f"  /info <channel>               {BRIGHT_YELLOW}- Show info about a channel (desc, members){RESET}")
+        mod_print(f"  /info <channel> [refresh]     {BRIGHT_YELLOW}- Show info about a channel (desc, members){RESET}")
         mod_print(f"  /msg <channel> <message>     {BRIGHT_YELLOW} - Send a message to a channel{RESET}")
         mod_print("\n[User Commands]")
         mod_print(f"  /users                        {BRIGHT_YELLOW}- List all users{RESET}")
         mod_print(f"  /users <channel>             {BRIGHT_YELLOW} - List users in a specific channel{RESET}")
-        mod_print(f"  /whois <username>            {BRIGHT_YELLOW} - Get details about a user{RESET}")
+        mod_print(f"  /whois <username> [refresh]  {BRIGHT_YELLOW} - Get details about a user{RESET}")
         mod_print(f"  /dm <username> <message>     {BRIGHT_YELLOW} - Send a private message (DM) to a user{RESET}")   
     else:
         mod_print(f"  /connect                     {BRIGHT_YELLOW} - Connect to the chat server{RESET}")
         mod_print(f"  /quit                        {BRIGHT_YELLOW} - exit{RESET}")
     mod_print("\n[Other]")
     mod_print(f"  /minimal <ON/OFF>            {BRIGHT_YELLOW} - Suppress non-essential server messages{RESET}")
+    mod_print(f"  /history <channel|user> [n]  {BRIGHT_YELLOW} - Show the last n stored messages (#channel, @user){RESET}")
+    mod_print(f"  /search <terms> [filters]    {BRIGHT_YELLOW} - Search stored messages (in:<chan|user> from:<user> since:2h){RESET}")
+    mod_print(f"  /stats [reset|toolbar on/off]{BRIGHT_YELLOW} - Packet rates, errors and latency per request type{RESET}")
+    mod_print(f"  /capture <file|off>          {BRIGHT_YELLOW} - Record raw datagrams for benchmarks/replay.py{RESET}")
+    mod_print(f"  /filter [rule|remove <n>]    {BRIGHT_YELLOW} - Mute/highlight/route messages, e.g. /filter route word deploy ops{RESET}")
+    mod_print(f"  /view [name] [n]             {BRIGHT_YELLOW} - Messages routed to a view by the rules{RESET}")
+    mod_print(f"  /chunk <ON/OFF>              {BRIGHT_YELLOW} - Send messages over 500 characters in parts{RESET}")
+    mod_print(f"  /loopmon [on [ms] | off]     {BRIGHT_YELLOW} - Event loop lag and the calls that stalled it{RESET}")
+    mod_print(f"  /effects <ON/OFF>            {BRIGHT_YELLOW} - Typewriter animations{RESET}")
+    mod_print(f"  /render <fps> [mode]         {BRIGHT_YELLOW} - Output frame rate (0 = per line) and exact/cached/plain{RESET}")
     mod_print(f"  /clear                       {BRIGHT_YELLOW} - clear interface{RESET}\n")
     if connected:
-        typewriter_effect("Listening for messages ...")
+        await typewriter_effect("Listening for messages ...")
         mod_print(" ")
 
+#command registry: one entry per command drives both dispatch and tab completion
+ANY, ONLINE, OFFLINE = "any", "online", "offline"
+QUIT = "quit" #returned by a handler to leave the prompt loop
+
+class Command:
+    __slots__ = ("name", "handler", "when", "args", "queueable")
+
+    def __init__(self, name, handler, when, args, queueable):
+        self.name = name
+        self.handler = handler #async handler(client, rest of the line)
+        self.when = when #ANY, ONLINE or OFFLINE
+        self.args = args #completion per argument: "user", "channel", or a tuple of literal words
+        self.queueable = queueable #accepted while reconnecting, it lands in the offline queue
+
+    def available(self, client) -> bool:
+        if self.when == ONLINE:
+            return client.connected or (self.queueable and client.reconnecting)
+        if self.when == OFFLINE:
+            return not client.connected
+        return True
+
+COMMANDS = {}
+
+def command(name: str, when: str = ANY, args: tuple = (), queueable: bool = False):
+    def register(handler):
+        COMMANDS[name] = Command(name, handler, when, args, queueable)
+        return handler
+    return register
+
+async def dispatch(client: ChatClient, user_input: str):
+    name, _, rest = user_input.partition(" ")
+    entry = COMMANDS.get(name)
+    if entry is None or not entry.available(client):
+        error_msg("[!] Unknown command.")
+        return None
+    return await entry.handler(client, rest.strip())
+
+#other
+@command("/clear")
+async def cmd_clear(client, rest):
+    clear_terminal()
+    await print_menu(client.connected)
+
+@command("/minimal", args=(("on", "off"),))
+async def cmd_minimal(client, rest):
+    parts = rest.split()
+    if len(parts) == 1 and parts[0].lower() in ("on", "off"):
+        new_state = parts[0].lower() == "on"
+        if client.minimal_mode == new_state:
+            progress_msg(f"[=] Minimal mode already {'enabled' if new_state else 'disabled'}.")
+        else:
+            client.minimal_mode = new_state
+            progress_msg(f"[+] Minimal mode {'enabled' if new_state else 'disabled'}.")
+    else:
+        error_msg("[!] Usage: /minimal <ON/OFF>")
+
+@command("/history", args=("channel",))
+async def cmd_history(client, rest):
+    parts = rest.split()
+    if len(parts) == 1:
+        client.show_history(parts[0])
+    elif len(parts) == 2 and parts[1].isdigit():
+        client.show_history(parts[0], int(parts[1]))
+    else:
+        error_msg("[!] Usage: /history <channel|user> [n]")
+
+@command("/search")
+async def cmd_search(client, rest):
+    #filters: in:<channel|user> from:<user> since:<n>[m|h|d]
+    terms = []
+    filters = {}
+    for part in rest.split():
+        name, _, value = part.partition(":")
+        if name in ("in", "from", "since") and value:
+            filters[name] = value
+        else:
+            terms.append(part)
+    since = parse_age(filters.get("since"))
+    if not terms or ("since" in filters and since is None):
+        error_msg("[!] Usage: /search <terms> [in:<channel|user>] [from:<user>] [since:<n>m|h|d]")
+    else:
+        client.search_history(" ".join(terms), key=filters.get("in"), sender=filters.get("from"), since=since)
+
+@command("/capture", args=(("off",),))
+async def cmd_capture(client, rest):
+    if not rest:
+        error_msg("[!] Usage: /capture <file|off>")
+    elif rest.lower() == "off":
+        capture = client.stop_capture()
+        if capture is None:
+            progress_msg("[=] Not capturing.")
+        else:
+            progress_msg(f"[+] Captured {capture.records} datagrams ({capture.bytes} bytes) to {capture.path}.")
+    else:
+        try:
+            client.start_capture(rest)
+            progress_msg(f"[+] Capturing raw traffic to {rest}.")
+        except OSError as e:
+            error_msg(f"[!] Cannot capture to {rest}: {e}")
+
+@command("/stats", args=(("reset", "toolbar"), ("on", "off")))
+async def cmd_stats(client, rest):
+    global stats_toolbar
+    parts = rest.split()
+    if not parts:
+        client.show_stats()
+    elif len(parts) == 1 and parts[0].lower() == "reset":
+        client.metrics.reset()
+        progress_msg("[+] Metrics reset.")
+    elif len(parts) == 2 and parts[0].lower() == "toolbar" and parts[1].lower() in ("on", "off"):
+        stats_toolbar = parts[1].lower() == "on"
+        progress_msg(f"[+] Toolbar stats {'enabled' if stats_toolbar else 'disabled'}.")
+    else:
+        error_msg("[!] Usage: /stats [reset | toolbar <ON/OFF>]")
+
+@command("/filter", args=(("mute", "highlight", "route", "remove", "clear", "mentions", "load", "save"),
+                          ("sender", "channel", "word", "on", "off")))
+async def cmd_filter(client, rest):
+    #/filter lists; /filter <mute|highlight> <sender|channel|word> <value>; /filter route <field> <value> <view>;
+    #/filter remove <n> | clear | mentions <on/off> | load [file] | save [file]
+    parts = rest.split()
+    rules = client.rules
+    if not parts:
+        client.show_rules()
+    elif parts[0].lower() in ("mute", "highlight", "route"):
+        try:
+            rule = parse_rule(rest)
+        except RuleError as e:
+            error_msg(f"[!] {e}")
+            return
+        if rules.add(rule):
+            progress_msg(f"[+] Rule {len(rules.rules)}: {rule}")
+        else:
+            progress_msg(f"[=] Already a rule: {rule}")
+    elif parts[0].lower() == "remove" and len(parts) == 2 and parts[1].isdigit() and 1 <= int(parts[1]) <= len(rules.rules):
+        progress_msg(f"[+] Removed: {rules.remove(int(parts[1]) - 1)}")
+    elif parts[0].lower() == "clear" and len(parts) == 1:
+        rules.clear()
+        progress_msg("[+] Rules cleared.")
+    elif parts[0].lower() == "mentions" and len(parts) == 2 and parts[1].lower() in ("on", "off"):
+        rules.set_mentions(parts[1].lower() == "on")
+        progress_msg(f"[+] Mention highlighting {'enabled' if rules.mentions else 'disabled'}.")
+    elif parts[0].lower() in ("load", "save") and len(parts) <= 2:
+        path = parts[1] if len(parts) == 2 else rules.path or RULES_PATH
+        try:
+            if parts[0].lower() == "load":
+                progress_msg(f"[+] Loaded {rules.load(path)} rules from {path}.")
+            else:
+                rules.save(path)
+                progress_msg(f"[+] Saved {len(rules.rules)} rules to {path}.")
+        except (OSError, RuleError) as e:
+            error_msg(f"[!] {e}")
+    else:
+        error_msg("[!] Usage: /filter [<mute|highlight> <sender|channel|word> <value> | route <sender|channel|word> <value> <view>"
+                  " | remove <n> | clear | mentions <ON/OFF> | load [file] | save [file]]")
+
+@command("/view")
+async def cmd_view(client, rest):
+    parts = rest.split()
+    if not parts:
+        client.show_view()
+    elif len(parts) == 1:
+        client.show_view(parts[0])
+    elif len(parts) == 2 and parts[1].isdigit():
+        client.show_view(parts[0], int(parts[1]))
+    else:
+        error_msg("[!] Usage: /view [name] [n]")
+
+@command("/chunk", args=(("on", "off"),))
+async def cmd_chunk(client, rest):
+    parts = rest.split()
+    if len(parts) == 1 and parts[0].lower() in ("on", "off"):
+        client.chunking = parts[0].lower() == "on"
+        progress_msg(f"[+] Long messages {'are sent in parts' if client.chunking else 'are refused'}.")
+    elif not parts:
+        progress_msg(f"[+] Chunking is {'on' if client.chunking else 'off'}.")
+    else:
+        error_msg("[!] Usage: /chunk <ON/OFF>")
+
+@command("/effects", args=(("on", "off"),))
+async def cmd_effects(client, rest):
+    parts = rest.split()
+    if len(parts) == 1 and parts[0].lower() in ("on", "off"):
+        RENDERER.effects = parts[0].lower() == "on"
+        progress_msg(f"[+] Effects {'enabled' if RENDERER.effects else 'disabled'}.")
+    else:
+        error_msg("[!] Usage: /effects <ON/OFF>")
+
+@command("/loopmon", args=(("on", "off"),))
+async def cmd_loopmon(client, rest):
+    parts = rest.split()
+    if len(parts) in (1, 2) and parts[0].lower() == "on" and (len(parts) == 1 or parts[1].isdigit()):
+        if len(parts) == 2:
+            monitor.threshold = int(parts[1]) / 1000
+        monitor.start()
+        progress_msg(f"[+] Loop monitor on, stalls over {monitor.threshold * 1000:.0f} ms are sampled.")
+    elif len(parts) == 1 and parts[0].lower() == "off":
+        monitor.stop()
+        progress_msg("[+] Loop monitor off.")
+    elif not parts:
+        show_loop_report()
+    else:
+        error_msg("[!] Usage: /loopmon [on [threshold_ms] | off]")
+
+@command("/render", args=((), (EXACT, CACHED, PLAIN)))
+async def cmd_render(client, rest):
+    parts = rest.split()
+    modes = (EXACT, CACHED, PLAIN)
+    if len(parts) in (1, 2) and parts[0].isdigit() and (len(parts) == 1 or parts[1].lower() in modes):
+        configure_renderer(max_fps=int(parts[0]), fidelity=parts[1].lower() if len(parts) == 2 else None)
+        progress_msg(f"[+] Rendering at {RENDERER.max_fps or 'unlimited'} fps, {RENDERER.fidelity} fidelity.")
+    else:
+        error_msg("[!] Usage: /render <fps> [exact/cached/plain]")
+
+@command("/quit")
+async def cmd_quit(client, rest):
+    if client.connected:
+        await client.disconnect()
+        await asyncio.sleep(1)
+    else:
+        client.supervisor.cancel()
+        mod_print(RESET)
+    return QUIT
+
+#session management
+@command("/connect", when=OFFLINE)
+async def cmd_connect(client, rest):
+    if client.reconnecting:
+        client.supervisor.retry_now()
+        return
+    await client.connect()
+    if client.connected:
+        client.start_background()
+        await print_menu(client.connected)
+
+@command("/whoami", when=ONLINE)
+async def cmd_whoami(client, rest):
+    await client.whoami()
+
+@command("/setname", when=ONLINE)
+async def cmd_setname(client, rest):
+    if not rest or " " in rest:
+        error_msg("[!] Usage: /setname <new_username>")
+    else:
+        await client.set_username(rest)
+
+#channel commands
+@command("/create", when=ONLINE)
+async def cmd_create(client, rest):
+    parts = rest.split(" ", 1)
+    if len(parts) < 2:
+        error_msg("[!] Usage: /create <channel_name> <description>")
+    else:
+        await client.create_channel(parts[0].strip(), parts[1].strip())
+
+@command("/join", when=ONLINE, args=("channel",))
+async def cmd_join(client, rest):
+    if not rest:
+        error_msg("[!] Usage: /join <channel>")
+    else:
+        await client.join_channel(rest)
+
+@command("/channels", when=ONLINE)
+async def cmd_channels(client, rest):
+    if rest.isdigit():
+        await client.list_channels(int(rest))
+    else:
+        channels = await client.fetch_channels()
+        if channels is not None:
+            client.show_listing("Channel List", channels, "[!] No channels found.")
+
+@command("/leave", when=ONLINE, args=("joined",))
+async def cmd_leave(client, rest):
+    if not rest:
+        error_msg("[!] Usage: /leave <channel>")
+    else:
+        await client.leave_channel(rest)
+
+@command("/info", when=ONLINE, args=("channel", ("refresh",)))
+async def cmd_info(client, rest):
+    parts = rest.split()
+    if len(parts) not in (1, 2) or (len(parts) == 2 and parts[1] != "refresh"):
+        error_msg("[!] Usage: /info <channel> [refresh]")
+    else:
+        await client.channel_info(parts[0], force=len(parts) == 2) #refresh skips the cache
+
+@command("/msg", when=ONLINE, args=("joined",), queueable=True)
+async def cmd_msg(client, rest):
+    parts = rest.split(" ", 1)
+    if len(parts) != 2:
+        error_msg("[!] Usage: /msg <channel> <message>")
+    else:
+        await client.send_channel_msg(parts[0].strip(), parts[1].strip())
+
+#user commands
+@command("/users", when=ONLINE, args=("channel",))
+async def cmd_users(client, rest):
+    parts = rest.split()
+    if not parts:
+        users = await client.fetch_users()
+        if users is not None:
+            client.show_listing("User List", users, "[!] No users found.")
+    elif len(parts) == 1:
+        if parts[0].isdigit():
+            await client.list_users(offset=int(parts[0]))
+        else:
+            users = await client.fetch_users(parts[0])
+            if users is not None:
+                client.show_listing("User List", users, "[!] No users found.")
+    elif len(parts) == 2 and parts[1].isdigit():
+        await client.list_users(channel=parts[0], offset=int(parts[1]))
+    else:
+        error_msg("[!] Usage: /users [channel] [offset]")
+
+@command("/whois", when=ONLINE, args=("user", ("refresh",)))
+async def cmd_whois(client, rest):
+    parts = rest.split()
+    if len(parts) not in (1, 2) or (len(parts) == 2 and parts[1] != "refresh"):
+        error_msg("[!] Usage: /whois <username> [refresh]")
+    else:
+        await client.whois(parts[0], force=len(parts) == 2)
+
+@command("/dm", when=ONLINE, args=("user",), queueable=True)
+async def cmd_dm(client, rest):
+    parts = rest.split(" ", 1)
+    if len(parts) != 2:
+        error_msg("[!] Usage: /dm <username> <message>")
+    else:
+        await client.send_dm(parts[0].strip(), parts[1].strip())
+
+COMPLETION_LIMIT = 50
+
+#completes command names, then each argument from what the command declares: usernames and
+#channel names come from the client's NameIndex, the rest are fixed words
+class CommandCompleter(Completer):
+    def __init__(self, client: ChatClient, names: NameIndex):
+        self.client = client
+        self.names = names
+        self.commands = PrefixIndex(COMMANDS)
+
+    def candidates(self, text: str):
+        #(words, length of the word being completed)
+        if " " not in text:
+            return [n for n in self.commands.complete(text) if COMMANDS[n].available(self.client)], len(text)
+        name, _, rest = text.partition(" ")
+        entry = COMMANDS.get(name)
+        if entry is None or not entry.available(self.client):
+            return [], 0
+        words = rest.split(" ")
+        position = len(words) - 1 #the last word is the one being typed
+        if position >= len(entry.args):
+            return [], 0
+        word = words[-1]
+        kind = entry.args[position]
+        if kind == "user":
+            found = self.names.users.complete(word, COMPLETION_LIMIT)
+        elif kind == "channel":
+            found = self.names.channels.complete(word, COMPLETION_LIMIT)
+        elif kind == "joined":
+            found = sorted(c for c in self.client.joined_channels if c.startswith(word))
+        else:
+            found = [w for w in kind if w.startswith(word.lower())]
+        return found, len(word)
+
+    def get_completions(self, document, complete_event):
+        found, length = self.candidates(document.text_before_cursor)
+        for word in found:
+            yield Completion(word, start_position=-length)
+
 async def prompt_loop(client: ChatClient):
-    session = PromptSession(bottom_toolbar=bottom_toolbar)
-    typewriter_effect(CHAT_HEADER, delay=0.05)
-    print_menu(client.connected)  # Show options on startup
+    session = PromptSession(bottom_toolbar=bottom_toolbar, completer=CommandCompleter(client, names),
+                            complete_while_typing=False)
+    await typewriter_effect(CHAT_HEADER, delay=0.05)
+    await print_menu(client.connected)  # Show options on startup
     with patch_stdout():
             while True:
                 try:
                     user_input = await session.prompt_async("> ",style=custom_style,auto_suggest=AutoSuggestFromHistory())
                     user_input = user_input.strip()
-                    #Other
-                    if user_input == "/clear":
-                            clear_terminal()
-                            print_menu(client.connected)
-                    elif user_input.startswith("/minimal"):
-                        parts = user_input.split()
-                        if len(parts) == 2 and parts[1].lower() in ("on", "off"):
-                            new_state = parts[1].lower() == "on"
-                            if client.minimal_mode == new_state:
-                                progress_msg(f"[=] Minimal mode already {'enabled' if new_state else 'disabled'}.")
-                            else:
-                                client.minimal_mode = new_state
-                                progress_msg(f"[+] Minimal mode {'enabled' if new_state else 'disabled'}.")
-                        else:
-                            error_msg("[!] Usage: /minimal <ON/OFF>")
-                    else: 
-                    #ONLINE
-                        if client.connected:
-                        #session management
-                            if user_input == "/whoami":
-                                await client.whoami()
-                            elif user_input == "/quit":
-                                await client.disconnect()
-                                await asyncio.sleep(1)
-                                break
-                            elif user_input.startswith("/setname ") and len(user_input.split(" "))==2:
-                                parts = user_input.split(" ", 1)
-                                if len(parts) < 2 or not parts[1].strip():
-                                    error_msg("[!] Usage: /setname <new_username>")
-                                else:
-                                    new_name = parts[1]
-                                    await client.set_username(new_name)
-                        #channel commands
-                            elif user_input.startswith("/create "):
-                                parts = user_input.split(" ", 2)
-                                if len(parts) < 3:
-                                    error_msg("[!] Usage: /create <channel_name> <description>")
-                                else:
-                                    channel_name = parts[1].strip()
-                                    description = parts[2].strip()
-                                    await client.create_channel(channel_name, description)
-                            elif user_input.startswith("/join "):
-                                parts = user_input.split(" ", 1)
-                                if len(parts) < 2 or not parts[1].strip():
-                                    error_msg("[!] Usage: /join <channel>")
-                                else:
-                                    await client.join_channel(parts[1].strip())
-                            elif user_input.startswith("/channels"):
-                                parts = user_input.split(" ",1)
-                                offset = 0
-                                if len(parts) == 2 and parts[1].isdigit():
-                                    offset = int(parts[1])
-                                await client.list_channels(offset)
-                            elif user_input.startswith("/leave "):
-                                parts = user_input.split(" ", 1)
-                                if len(parts) < 2 or not parts[1].strip():
-                                    error_msg("[!] Usage: /leave <channel>")
-                                else:
-                                    await client.leave_channel(parts[1].strip())
-                            elif user_input.startswith("/info "):
-                                parts = user_input.split(" ", 1)
-                                if len(parts) < 2 or not parts[1].strip():
-                                    error_msg("[!] Usage: /info <channel>")
-                                else:
-                                    await client.channel_info(parts[1].strip())
-                            elif user_input.startswith("/msg"):
-                                parts = user_input.split(" ", 2)
-                                if len(parts) != 3:
-                                    error_msg("[!] Usage: /msg <channel> <message>")
-                                else:
-                                    channel = parts[1].strip()
-                                    message = parts[2].strip()
-                                    await client.send_channel_msg(channel, message)
-                        #user commands
-                            elif user_input.startswith("/users"):
-                                parts = user_input.split(" ")
-                                if len(parts) == 1:
-                                    await client.list_users()
-                                elif len(parts) == 2:
-                                    if parts[1].isdigit():
-                                        await client.list_users(offset=int(parts[1]))
-                                    else:
-                                        await client.list_users(channel=parts[1])
-                                elif len(parts) == 3 and parts[2].isdigit():
-                                    await client.list_users(channel=parts[1], offset=int(parts[2]))
-                                else:
-                                    error_msg("[!] Usage: /users [channel] [offset]")
-                            elif user_input.startswith("/whois "):
-                                parts = user_input.split(" ", 1)
-                                if len(parts) < 2 or not parts[1].strip():
-                                    error_msg("[!] Usage: /whois <username>")
-                                else:
-                                    await client.whois(parts[1].strip())
-                            elif user_input.startswith("/dm"):
-                                parts = user_input.split(" ", 2)
-                                if len(parts) != 3:
-                                    error_msg("[!] Usage: /dm <username> <message>")
-                                else:
-                                    to_user = parts[1].strip()
-                                    message = parts[2].strip()
-                                    await client.send_dm(to_user, message)
-                            else:
-                                error_msg("[!] Unknown command.")
-                        else:
-                    #OFFLINE
-                        #session management
-                            if user_input == "/connect":
-                                await client.connect()
-                                if client.connected:
-                                    asyncio.create_task(client.receive_loop())
-                                    asyncio.create_task(client.ping())
-                                    asyncio.create_task(periodic_user_refresh(client))
-                                    print_menu(client.connected)
-                            elif user_input == "/quit":
-                                mod_print(RESET)
-                                break
-                            else:
-                                error_msg("[!] Unknown command.")
+                    if await dispatch(client, user_input) == QUIT:
+                        break
                 except KeyboardInterrupt:
                     # Handle Ctrl+C
                     break
                 except EOFError:
                     # Handle Ctrl+D
                     break
+            RENDERER.flush()
+
+
+def parse_age(value):
+    #"30m", "2h", "7d" -> unix time that long ago
+    units = {"m": 60, "h": 3600, "d": 86400}
+    if not value or value[-1] not in units or not value[:-1].isdigit():
+        return None
+    return time.time() - int(value[:-1]) * units[value[-1]]
+
+REFRESH_JITTER = 0.1 #of the ttl, so clients started together do not refresh in step
+MAX_REFRESH_BACKOFF = 4 #ttls to wait at most once refreshes keep finding the same count
 
 async def periodic_user_refresh(client):
+    #keeps the toolbar count current. Sleeps until the cached listing is due, so a /users fetched meanwhile
+    #pushes the refresh back, and waits longer each time a refresh finds the count unchanged
+    backoff = 1
     while client.connected:
-        client.silent_update = True
-        await client.list_users()
-        await asyncio.sleep(60)
+        age = client.directory.age("users")
+        wait = client.directory.ttl * backoff - (age or 0.0)
+        if age is None or wait <= 0:
+            before = client.user_count
+            users = await client.fetch_users(background=True)
+            changed = users is None or len(users) != before
+            backoff = 1 if changed else min(backoff * 2, MAX_REFRESH_BACKOFF)
+            wait = client.directory.ttl * backoff
+        await asyncio.sleep(wait + random.uniform(0, REFRESH_JITTER * client.directory.ttl))
+
+async def periodic_metrics_dump(client, path: str, interval: float):
+    #JSON lines, or a Prometheus text file when the path ends in .prom
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            client.metrics.dump(path)
+        except OSError as e:
+            error_msg(f"[!] Metrics dump to {path} failed: {e}")
+            return
+
+def show_loop_report():
+    if not monitor.running and not monitor.ticks:
+        progress_msg("[=] Loop monitor is off, /loopmon on to start it.")
+        return
+    stats = monitor.stats()
+    server_msg(f"[Loop] {stats['ticks']} ticks | avg lag {stats['avg_lag_ms']} ms | max {stats['max_lag_ms']} ms | "
+               f"{stats['stalls']} stalls over {monitor.threshold * 1000:.0f} ms")
+    for site in monitor.report():
+        mod_print(f"{WHITE}  {site.where}{GREY} x{site.count}, {site.total * 1000:.0f} ms total, worst {site.worst * 1000:.0f} ms")
+        for frame in site.stack[:-1]:
+            mod_print(f"{GREY}      {frame}")
+
+def stats_segment():
+    rtt = client.metrics.histogram("rtt")
+    errors = client.metrics.total("timeouts") + client.metrics.count("decode_errors")
+    return (f"⏱ {rtt.quantile(0.5) / 1000:.0f}/{rtt.quantile(0.99) / 1000:.0f} ms | " if rtt is not None else "⏱ - | ") + \
+           (f"⚠ {errors} | " if errors else "")
 
 def bottom_toolbar():
     content = ""
@@ -198,9 +522,11 @@ def bottom_toolbar():
                 f"{len(client.joined_channels)} channels | "
                 f"💬 {client.dm_count} DMs | "
                 f"🧑‍🤝‍🧑 {client.user_count} users | "
+                f"{stats_segment() if stats_toolbar else ''}"
                 f"🕒 {time_now}")
     else:
-        content = (f"📡 disconnected | "
+        content = (f"📡 {'reconnecting' if client.reconnecting else 'disconnected'} | "
+                f"{f'📨 {len(client.offline)} queued | ' if len(client.offline) else ''}"
                 f"{'🔇 Minimal | ' if client.minimal_mode else ''}"
                 f"🕒 {time_now}")
 
@@ -210,10 +536,56 @@ def bottom_toolbar():
         f"{padded}"
     )
 
+stats_toolbar = False #rtt p50/p99 and error count in the toolbar
+
 async def main():
     global client 
-    client = ChatClient()
-    await prompt_loop(client) #cli options
+    #CHAT_SERVERS="host:port,host:port" lists failover endpoints, best RTT is tried first
+    endpoints = parse_endpoints(os.environ.get("CHAT_SERVERS", ""), SERVER_PORT)
+    client = ChatClient(endpoints=endpoints)
+    global names
+    names = NameIndex() #usernames and channels for tab completion
+    names.attach(client)
+    client.history = HistoryStore(os.environ.get("CHAT_HISTORY_DIR", HISTORY_DIR))
+    client.search = SearchIndex(client.history)
+    #CHAT_RULES_FILE (default ~/.chat_rules) holds /filter rules, one per line
+    rules_path = os.environ.get("CHAT_RULES_FILE", RULES_PATH)
+    client.rules.path = rules_path
+    if os.path.exists(rules_path):
+        try:
+            client.rules.load(rules_path)
+        except (OSError, RuleError) as e:
+            error_msg(f"[!] Rules not loaded: {e}")
+    client.add_background(lambda: periodic_user_refresh(client))
+    #CHAT_CHUNKING=on sends messages over 500 characters in parts instead of refusing them
+    client.chunking = os.environ.get("CHAT_CHUNKING", "").lower() == "on"
+    #CHAT_RECONNECT=off leaves a lost session down until /connect
+    client.auto_reconnect = os.environ.get("CHAT_RECONNECT", "").lower() != "off"
+    global monitor
+    monitor = LoopMonitor(metrics=client.metrics)
+    #CHAT_LOOPMON=<threshold ms> starts the loop monitor, CHAT_EFFECTS=off skips the animations
+    if os.environ.get("CHAT_LOOPMON", "").isdigit():
+        monitor.threshold = int(os.environ["CHAT_LOOPMON"]) / 1000
+        monitor.start()
+    #CHAT_KEEPALIVE="<idle seconds>,<missed pongs>", e.g. "20,3"
+    if os.environ.get("CHAT_KEEPALIVE"):
+        interval, _, missed = os.environ["CHAT_KEEPALIVE"].partition(",")
+        client.configure_keepalive(float(interval), int(missed) if missed else None)
+    if os.environ.get("CHAT_EFFECTS", "").lower() == "off":
+        RENDERER.effects = False
+    #CHAT_METRICS_FILE=metrics.jsonl (or metrics.prom) dumps a snapshot every CHAT_METRICS_INTERVAL seconds
+    if os.environ.get("CHAT_METRICS_FILE"):
+        asyncio.create_task(periodic_metrics_dump(client, os.environ["CHAT_METRICS_FILE"],
+                                                  float(os.environ.get("CHAT_METRICS_INTERVAL", "15"))))
+    try:
+        await prompt_loop(client) #cli options
+    finally:
+        client.supervisor.cancel()
+        client.stop_background()
+        monitor.stop()
+        client.stop_capture()
+        client.search.close()
+        client.history.close()
 
 if __name__ == "__main__":
     asyncio.run(main())
\ No newline at end of file
@@ -0,0 +1,40 @@
+import msgpack
+
+#encodes request dicts byte-for-byte like msgpack.packb, without a fresh Packer per packet.
+#header-only requests (PING, WHOAMI, DISCONNECT) are a pre-encoded head with the session
+#baked in plus the handle; anything with fields goes through the long-lived Packer, since
+#packing the fields one by one after the head costs about three times one C-level pack of
+#the whole dict (benchmarks/bench_codec.py, "head + fields")
+class PacketEncoder:
+    def __init__(self):
+        self.packer = msgpack.Packer()
+        self.session = None
+        self.prefixes = {} #(request_type, has session) -> pre-encoded map header, request_type, session and "request_handle"
+
+    def set_session(self, session):
+        #call after CONNECT and on disconnect, the prefixes carry the session
+        if session != self.session:
+            self.session = session
+            self.prefixes.clear()
+
+    def _prefix(self, request_type: int, has_session: bool) -> bytes:
+        pack = self.packer.pack
+        parts = [b"\x83" if has_session else b"\x82", pack("request_type"), pack(request_type)] #fixmap of 3 or 2 entries
+        if has_session:
+            parts.append(pack("session"))
+            parts.append(pack(self.session))
+        parts.append(pack("request_handle"))
+        prefix = self.prefixes[(request_type, has_session)] = b"".join(parts)
+        return prefix
+
+    def encode(self, message: dict) -> bytes:
+        if len(message) > 3: #has fields, checked first so these pay as little as possible on top of pack
+            return self.packer.pack(message)
+        session = message.get("session")
+        has_session = session is not None
+        if len(message) != (3 if has_session else 2) or session != self.session:
+            return self.packer.pack(message)
+        prefix = self.prefixes.get((message["request_type"], has_session))
+        if prefix is None:
+            prefix = self._prefix(message["request_type"], has_session)
+        return prefix + self.packer.pack(message["request_handle"])
@@ -0,0 +1,80 @@
+from bisect import bisect_left, insort
+
+REBUILD_FRACTION = 8 #a batch larger than 1/8 of the index is merged by re-sorting instead of inserting one by one
+
+#sorted list of names; everything starting with a prefix is one contiguous run found by bisection,
+#so a lookup costs O(log n + results) however many names there are
+class PrefixIndex:
+    def __init__(self, names=()):
+        self.names = sorted(set(names))
+        self.members = set(self.names)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self.members
+
+    def add(self, name: str):
+        if name and name not in self.members:
+            self.members.add(name)
+            insort(self.names, name)
+
+    def update(self, names):
+        new = {n for n in names if n and n not in self.members}
+        if len(new) * REBUILD_FRACTION > len(self.names):
+            self.members |= new
+            self.names = sorted(self.members)
+        else:
+            for name in new:
+                self.add(name)
+
+    def discard(self, name: str):
+        if name in self.members:
+            self.members.discard(name)
+            del self.names[bisect_left(self.names, name)]
+
+    def rename(self, old: str, new: str):
+        self.discard(old)
+        self.add(new)
+
+    def complete(self, prefix: str, limit: int = 50) -> list:
+        names = self.names
+        start = bisect_left(names, prefix)
+        end = start
+        stop = min(len(names), start + limit)
+        while end < stop and names[end].startswith(prefix):
+            end += 1
+        return names[start:end]
+
+    def clear(self):
+        self.names.clear()
+        self.members.clear()
+
+#usernames and channel names the client has seen, kept current from the responses that carry them
+class NameIndex:
+    def __init__(self):
+        self.users = PrefixIndex()
+        self.channels = PrefixIndex()
+
+    def attach(self, client):
+        client.subscribe(35, lambda r: self.users.update(r.get("users", [])))        #USER_LIST
+        client.subscribe(26, lambda r: self.channels.update(r.get("channels", [])))  #CHANNEL_LIST
+        client.subscribe(27, self.on_channel_info)
+        client.subscribe(25, lambda r: self.channels.add(r.get("channel")))          #CHANNEL_CREATE
+        client.subscribe(28, self.on_channel_join)
+        client.subscribe(31, self.on_whois)
+        client.subscribe(34, lambda r: self.users.rename(r.get("old_username"), r.get("new_username")))
+        client.subscribe(22, lambda r: self.users.add(r.get("username"))) #CONNECT, ourselves
+
+    def on_channel_info(self, response: dict):
+        self.channels.add(response.get("channel"))
+        self.users.update(response.get("members", []))
+
+    def on_channel_join(self, response: dict):
+        self.channels.add(response.get("channel"))
+        self.users.add(response.get("username"))
+
+    def on_whois(self, response: dict):
+        self.users.add(response.get("username"))
+        self.channels.update(response.get("channels", []))
@@ -0,0 +1,69 @@
+import time
+
+DEFAULT_TTL = 60.0 #seconds a full listing is trusted
+
+class Listing:
+    __slots__ = ("items", "fetched_at")
+
+    def __init__(self, items, fetched_at):
+        self.items = items
+        self.fetched_at = fetched_at
+
+#complete user/channel listings assembled from every page, kept for ttl seconds.
+#keys are ("users", channel) with "" for the whole server, and ("channels", "")
+class Directory:
+    def __init__(self, ttl: float = DEFAULT_TTL):
+        self.ttl = ttl
+        self.listings = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, kind: str, channel: str = ""):
+        listing = self.listings.get((kind, channel))
+        if listing is None or time.monotonic() - listing.fetched_at > self.ttl:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return listing.items
+
+    def peek(self, kind: str, channel: str = ""):
+        #last known listing regardless of age, None if never fetched
+        listing = self.listings.get((kind, channel))
+        return None if listing is None else listing.items
+
+    def age(self, kind: str, channel: str = ""):
+        #seconds since the listing was fetched, None if never fetched
+        listing = self.listings.get((kind, channel))
+        return None if listing is None else time.monotonic() - listing.fetched_at
+
+    def store(self, kind: str, channel: str, items):
+        items = list(dict.fromkeys(items)) #offsets can shift between pages, drop repeats
+        self.listings[(kind, channel)] = Listing(items, time.monotonic())
+        return items
+
+    def invalidate(self, kind: str = None, channel: str = None):
+        if kind is None:
+            self.listings.clear()
+            return
+        for key in [k for k in self.listings if k[0] == kind and (channel is None or k[1] == channel)]:
+            del self.listings[key]
+
+    #small patches from events so a fresh listing stays right until it expires
+    def rename(self, kind: str, old: str, new: str):
+        for (k, _), listing in self.listings.items():
+            if k == kind and old in listing.items:
+                listing.items[listing.items.index(old)] = new
+
+    def add(self, kind: str, channel: str, item: str):
+        listing = self.listings.get((kind, channel))
+        if listing is not None and item not in listing.items:
+            listing.items.append(item)
+
+    def remove(self, kind: str, channel: str, item: str):
+        listing = self.listings.get((kind, channel))
+        if listing is not None and item in listing.items:
+            listing.items.remove(item)
+
+    def user_count(self):
+        users = self.peek("users")
+        return None if users is None else len(users)
@@ -0,0 +1,120 @@
+import asyncio
+import math
+import random
+import socket
+import time
+import msgpack
+
+PROBE_TIMEOUT = 1.0
+RTT_ALPHA = 0.125 #smoothing for observed round-trip times
+
+def parse_endpoints(spec: str, default_port: int) -> list:
+    #"host[:port],host[:port]" -> [(host, port)], IPv6 literals go in brackets: [::1]:51825
+    endpoints = []
+    for item in (spec or "").split(","):
+        item = item.strip()
+        if not item:
+            continue
+        if item.startswith("["):
+            host, _, rest = item[1:].partition("]")
+            port = rest.lstrip(":")
+        elif item.count(":") == 1:
+            host, port = item.split(":")
+        else:
+            host, port = item, ""
+        endpoints.append((host, int(port) if port else default_port))
+    return endpoints
+
+class Endpoint:
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+        self.family = None
+        self.addr = None #resolved sockaddr, looked up once
+        self.srtt = math.inf #smoothed RTT in seconds, inf until measured
+        self.failures = 0
+
+    def __repr__(self):
+        return f"{self.host}:{self.port}"
+
+    def observe_rtt(self, sample: float):
+        if math.isinf(self.srtt):
+            self.srtt = sample
+        else:
+            self.srtt += RTT_ALPHA * (sample - self.srtt)
+
+class _ProbeProtocol(asyncio.DatagramProtocol):
+    def __init__(self, future):
+        self.future = future
+
+    def datagram_received(self, data, addr):
+        if not self.future.done():
+            self.future.set_result(time.perf_counter())
+
+    def error_received(self, exc):
+        if not self.future.done():
+            self.future.set_exception(exc)
+
+#the configured servers, resolved asynchronously once and ranked by failures then RTT
+class EndpointPool:
+    def __init__(self, endpoints):
+        self.endpoints = [Endpoint(host, port) for host, port in endpoints]
+        if not self.endpoints:
+            raise ValueError("at least one server endpoint is required")
+        self.current = None
+
+    async def resolve(self, force: bool = False):
+        loop = asyncio.get_running_loop()
+
+        async def lookup(endpoint):
+            if endpoint.addr is not None and not force:
+                return
+            try:
+                infos = await loop.getaddrinfo(endpoint.host, endpoint.port, type=socket.SOCK_DGRAM)
+            except socket.gaierror:
+                endpoint.addr = None
+                endpoint.failures += 1
+                return
+            endpoint.family, _, _, _, endpoint.addr = infos[0]
+
+        await asyncio.gather(*(lookup(e) for e in self.endpoints))
+
+    async def probe(self, timeout: float = PROBE_TIMEOUT):
+        #time one unauthenticated PING per endpoint, any reply (even an error) proves reachability
+        loop = asyncio.get_running_loop()
+
+        async def one(endpoint):
+            if endpoint.addr is None:
+                return
+            future = loop.create_future()
+            transport = None
+            try:
+                transport, _ = await loop.create_datagram_endpoint(
+                    lambda: _ProbeProtocol(future), remote_addr=endpoint.addr, family=endpoint.family)
+                sent = time.perf_counter()
+                transport.sendto(msgpack.packb({"request_type": 3, "request_handle": random.getrandbits(32)}))
+                endpoint.observe_rtt(await asyncio.wait_for(future, timeout) - sent)
+            except (OSError, asyncio.TimeoutError):
+                endpoint.failures += 1
+            finally:
+                if transport is not None:
+                    transport.close()
+
+        await asyncio.gather(*(one(e) for e in self.endpoints))
+
+    async def candidates(self) -> list:
+        await self.resolve()
+        if all(e.addr is None for e in self.endpoints):
+            await self.resolve(force=True) #DNS may have recovered
+        if len(self.endpoints) > 1:
+            await self.probe()
+        return sorted((e for e in self.endpoints if e.addr is not None), key=lambda e: (e.failures, e.srtt))
+
+    def mark_ok(self, endpoint: Endpoint):
+        endpoint.failures = 0
+        self.current = endpoint
+
+    def mark_failed(self, endpoint: Endpoint):
+        endpoint.failures += 1
+        if self.current is endpoint:
+            self.current = None
@@ -0,0 +1,355 @@
+import asyncio
+import socket
+import time
+import msgpack
+from collections import OrderedDict, deque
+from utility import *
+from chat_client import ChatClient, SERVER_HOST, SERVER_PORT
+from capture import INCOMING as CAPTURE_IN
+from endpoints import EndpointPool
+from ingest import IngestProtocol, set_rcvbuf, DEFAULT_BATCH_SIZE
+
+DEFAULT_SOCKETS = 8
+DEFAULT_TICK = 0.25 #timer wheel resolution, seconds
+DEFAULT_SLOTS = 512 #one lap of the wheel is slots * tick seconds
+ENGINE_RCVBUF = 4 << 20 #shared sockets see the traffic of many sessions
+HANDLE_LIMIT = 1 << 16 #request handles remembered for routing responses
+DRAIN_LIMIT = 256 #extra datagrams read per readiness event
+MAX_DATAGRAM = 65535
+COPY_WINDOW = 1.0 #seconds identical pushes on one socket are treated as copies of one broadcast
+
+class Timer:
+    __slots__ = ("rounds", "callback", "cancelled")
+
+    def __init__(self, rounds, callback):
+        self.rounds = rounds
+        self.callback = callback
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+#hashed timing wheel: any number of timers cost one loop callback per tick
+class TimerWheel:
+    def __init__(self, tick: float = DEFAULT_TICK, slots: int = DEFAULT_SLOTS):
+        self.tick = tick
+        self.slots = [[] for _ in range(slots)]
+        self.cursor = 0
+        self.handle = None
+        self.started = 0.0
+        self.ticks = 0 #ticks processed since start
+        self.timers = 0
+        self.fired = 0
+
+    def start(self):
+        loop = asyncio.get_running_loop()
+        self.started = loop.time()
+        self.handle = loop.call_at(self.started + self.tick, self._advance)
+
+    def stop(self):
+        if self.handle is not None:
+            self.handle.cancel()
+            self.handle = None
+
+    def schedule(self, delay: float, callback) -> Timer:
+        ticks = max(1, round(delay / self.tick))
+        #counted from the next tick, the first slot _advance visits: a timer of exactly one lap
+        #sits in the current slot with no rounds left, not a lap late
+        rounds, offset = divmod(ticks - 1, len(self.slots))
+        timer = Timer(rounds, callback)
+        self.slots[(self.cursor + 1 + offset) % len(self.slots)].append(timer)
+        self.timers += 1
+        return timer
+
+    def _advance(self):
+        loop = asyncio.get_running_loop()
+        #catch up on ticks a slow loop made us miss, so timers never drift late
+        due = int((loop.time() - self.started) / self.tick)
+        while self.ticks < due:
+            self.ticks += 1
+            self.cursor = (self.cursor + 1) % len(self.slots)
+            slot = self.slots[self.cursor]
+            if not slot:
+                continue
+            keep = []
+            for timer in slot:
+                if timer.cancelled:
+                    self.timers -= 1
+                elif timer.rounds:
+                    timer.rounds -= 1
+                    keep.append(timer)
+                else:
+                    self.timers -= 1
+                    self.fired += 1
+                    try:
+                        timer.callback()
+                    except Exception as e:
+                        error_msg(f"[!] Timer callback failed: {e}")
+            self.slots[self.cursor] = keep
+        self.handle = loop.call_at(self.started + (self.ticks + 1) * self.tick, self._advance)
+
+#asyncio reads one datagram per readiness event, which is one per loop pass for a socket; a shared
+#socket receives for many sessions, so it drains whatever else is already queued in the kernel too
+class DrainingIngest(IngestProtocol):
+    def __init__(self, drain: int = DRAIN_LIMIT):
+        super().__init__()
+        self.sock = None
+        self.drain = drain
+
+    def datagram_received(self, data, addr):
+        super().datagram_received(data, addr)
+        sock = self.sock
+        if sock is None:
+            return
+        for _ in range(self.drain):
+            try:
+                data = sock.recv(MAX_DATAGRAM)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as e:
+                self.error_received(e)
+                return
+            super().datagram_received(data, None)
+
+class EngineSocket:
+    def __init__(self, index: int, dedicated: bool):
+        self.index = index
+        self.dedicated = dedicated #holds exactly one session, pushes need no guessing
+        self.ingest = DrainingIngest()
+        self.transport = None
+        self.receive_task = None
+        self.sessions = []
+        self.copies = OrderedDict() #push datagram -> (expires, sessions still owed a copy)
+
+#a ChatClient that borrows a socket from the engine instead of opening its own, and whose
+#keepalive runs from the engine's timer wheel instead of a task per session
+class EngineSession(ChatClient):
+    def __init__(self, engine, sock: EngineSocket):
+        super().__init__(engine.host, engine.port)
+        self.engine = engine
+        self.engine_socket = sock
+        self.endpoints = engine.endpoints #resolved once for every session
+        self.background = [] #nothing per session, see SessionEngine.arm_keepalive
+        self.keepalive_timer = None
+        self.minimal_mode = True
+
+    def send(self, message: dict, priority: int = None):
+        if self.transport is not None:
+            self.engine.route_handle(message["request_handle"], self)
+        return super().send(message, priority)
+
+    async def open_transport(self, endpoint):
+        self.close()
+        self.rtt.reset()
+        self.server_addr = endpoint.addr
+        self.transport = self.engine_socket.transport #shared, never closed by the session
+
+    def close(self):
+        self.scheduler.clear()
+        self.engine.disarm_keepalive(self)
+        self.transport = None
+
+    def start_background(self):
+        super().start_background()
+        self.engine.arm_keepalive(self)
+
+    def stop_background(self):
+        super().stop_background()
+        self.engine.disarm_keepalive(self)
+
+    async def deliver(self, data: bytes, message: dict):
+        #the part of receive_loop that is per session, after the engine decoded and routed the datagram
+        self.keepalive.heard()
+        self.metrics.inc("rx_packets")
+        self.metrics.inc("rx_bytes", n=len(data))
+        if self.capture is not None:
+            self.capture.write(CAPTURE_IN, data)
+        try:
+            await self.handle_message(message)
+        except Exception as e:
+            self.metrics.inc("handler_errors", message.get("response_type"))
+            error_msg(f"[!] Error receiving message: {e}")
+
+#many chat identities in one event loop over a small pool of sockets. Responses are routed by
+#response_handle (and session when the server includes it); server pushes carry neither, so a push
+#is handed to the sessions on that socket it can be for (channel members for channel events), one
+#copy each since the server sends one per recipient. A DM names only its sender, so on a shared
+#socket it reaches one of the possible recipients: sessions that need DMs exactly should be added
+#with dedicated=True
+class SessionEngine:
+    def __init__(self, host: str = SERVER_HOST, port: int = SERVER_PORT, sockets: int = DEFAULT_SOCKETS,
+                 tick: float = DEFAULT_TICK, rcvbuf: int = ENGINE_RCVBUF):
+        self.host = host
+        self.port = port
+        self.pool_size = sockets
+        self.rcvbuf = rcvbuf
+        self.endpoints = EndpointPool([(host, port)])
+        self.sockets = []
+        self.sessions = []
+        self.handles = OrderedDict() #request_handle -> session awaiting its response
+        self.wheel = TimerWheel(tick)
+        self.probes = set() #keepalive pings in flight
+        self.routed = 0
+        self.unroutable = 0
+        self.ambiguous = 0 #pushes delivered to more than one possible recipient
+        self.decode_errors = 0
+
+    async def start(self):
+        candidates = await self.endpoints.candidates()
+        if not candidates:
+            raise ConnectionError(f"could not resolve {self.host}:{self.port}")
+        self.endpoint = candidates[0]
+        for index in range(self.pool_size):
+            await self._open_socket(EngineSocket(index, False))
+        self.wheel.start()
+
+    async def _open_socket(self, sock: EngineSocket):
+        loop = asyncio.get_running_loop()
+        raw = socket.socket(self.endpoint.family, socket.SOCK_DGRAM)
+        raw.setblocking(False)
+        set_rcvbuf(raw, self.rcvbuf)
+        raw.connect(self.endpoint.addr)
+        sock.transport, _ = await loop.create_datagram_endpoint(lambda: sock.ingest, sock=raw)
+        sock.ingest.sock = raw
+        sock.receive_task = asyncio.create_task(self._receive(sock))
+        self.sockets.append(sock)
+        return sock
+
+    async def add_session(self, dedicated: bool = False) -> EngineSession:
+        if dedicated:
+            sock = await self._open_socket(EngineSocket(len(self.sockets), True))
+        else:
+            shared = [s for s in self.sockets if not s.dedicated]
+            sock = min(shared, key=lambda s: len(s.sessions))
+        session = EngineSession(self, sock)
+        sock.sessions.append(session)
+        self.sessions.append(session)
+        return session
+
+    async def connect_all(self, concurrency: int = 50) -> list:
+        gate = asyncio.Semaphore(concurrency)
+
+        async def one(session):
+            async with gate:
+                await session.connect()
+                if session.connected:
+                    session.start_background()
+
+        await asyncio.gather(*(one(s) for s in self.sessions if not s.connected))
+        return [s for s in self.sessions if s.connected]
+
+    async def close(self):
+        for session in self.sessions:
+            session.supervisor.cancel()
+        await asyncio.gather(*(s.disconnect() for s in self.sessions if s.connected), return_exceptions=True)
+        for session in self.sessions:
+            session.stop_background()
+            session.close()
+        for task in list(self.probes):
+            task.cancel()
+        self.wheel.stop()
+        for sock in self.sockets:
+            if sock.receive_task is not None:
+                sock.receive_task.cancel()
+            if sock.transport is not None:
+                sock.transport.close()
+
+    #routing
+    def route_handle(self, handle: int, session: EngineSession):
+        self.handles[handle] = session
+        if len(self.handles) > HANDLE_LIMIT:
+            self.handles.popitem(last=False)
+
+    def route(self, sock: EngineSocket, data: bytes, message: dict) -> list:
+        handle = message.get("response_handle")
+        if handle is not None:
+            session = self.handles.get(handle)
+            return [session] if session is not None else []
+        if sock.dedicated:
+            return sock.sessions
+        session_id = message.get("session")
+        if session_id is not None:
+            return [s for s in sock.sessions if s.session == session_id]
+        return self._route_push(sock, data, message)
+
+    def _route_push(self, sock: EngineSocket, data: bytes, message: dict) -> list:
+        now = time.monotonic()
+        while sock.copies and next(iter(sock.copies.values()))[0] < now:
+            sock.copies.popitem(last=False)
+        pending = sock.copies.get(data)
+        if pending is not None and pending[1]:
+            return [pending[1].popleft()] #another copy of a broadcast we are already handing out
+        channel = message.get("channel")
+        sender = message.get("username") or message.get("from_username")
+        candidates = [s for s in sock.sessions if s.connected and s.username != sender
+                      and (channel is None or channel in s.joined_channels)]
+        if not candidates:
+            return []
+        if channel is None and message.get("response_type") == 33 and len(candidates) > 1:
+            self.ambiguous += 1 #a DM names its sender, not its recipient: any of these could be it
+        #the server sends one copy per recipient, hand them out one each
+        sock.copies[data] = (now + COPY_WINDOW, deque(candidates[1:]))
+        return candidates[:1]
+
+    async def _receive(self, sock: EngineSocket):
+        while True:
+            batch = await sock.ingest.get_batch(DEFAULT_BATCH_SIZE)
+            for data in batch:
+                try:
+                    message = msgpack.unpackb(data)
+                except Exception:
+                    self.decode_errors += 1
+                    continue
+                sessions = self.route(sock, data, message) if isinstance(message, dict) else []
+                if not sessions:
+                    self.unroutable += 1
+                    continue
+                self.routed += 1
+                for session in sessions:
+                    await session.deliver(data, message)
+            await asyncio.sleep(0)
+
+    #keepalive from the timer wheel
+    def arm_keepalive(self, session: EngineSession):
+        self.disarm_keepalive(session)
+        session.keepalive.heard()
+        session.keepalive_timer = self.wheel.schedule(session.keepalive.interval, lambda: self._keepalive_due(session))
+
+    def disarm_keepalive(self, session: EngineSession):
+        if session.keepalive_timer is not None:
+            session.keepalive_timer.cancel()
+            session.keepalive_timer = None
+
+    def _keepalive_due(self, session: EngineSession):
+        session.keepalive_timer = None
+        if not session.connected:
+            return
+        wait = session.keepalive.due_in()
+        if wait > 0: #a request went out since the timer was set
+            session.keepalive.skipped += 1
+            session.keepalive_timer = self.wheel.schedule(wait, lambda: self._keepalive_due(session))
+            return
+        task = asyncio.create_task(self._probe(session))
+        self.probes.add(task)
+        task.add_done_callback(self.probes.discard)
+
+    async def _probe(self, session: EngineSession):
+        if await session.keepalive.probe(lambda: session.connected) and session.connected:
+            session.keepalive_timer = self.wheel.schedule(max(0.0, session.keepalive.due_in()),
+                                                          lambda: self._keepalive_due(session))
+
+    def stats(self) -> dict:
+        return {
+            "sessions": len(self.sessions),
+            "connected": sum(1 for s in self.sessions if s.connected),
+            "sockets": len(self.sockets),
+            "routed": self.routed,
+            "unroutable": self.unroutable,
+            "ambiguous_pushes": self.ambiguous,
+            "decode_errors": self.decode_errors,
+            "ingest_dropped": sum(s.ingest.dropped for s in self.sockets),
+            "timers": self.wheel.timers,
+            "timers_fired": self.wheel.fired,
+            "keepalive_pings": sum(s.keepalive.pings for s in self.sessions),
+            "keepalive_skipped": sum(s.keepalive.skipped for s in self.sessions),
+        }
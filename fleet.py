@@ -0,0 +1,381 @@
+#runs a fleet of chat sessions sharded across worker processes, each with its own event loop and
+#SessionEngine, so decoding and handling use every core instead of one. The supervisor talks to the
+#workers over queues: commands go down (to one worker or all of them), events and metrics come up.
+#
+#  fleet = Fleet(host, port, workers=4, sessions=1000)
+#  fleet.start()
+#  fleet.broadcast({"cmd": "join", "channel": "general"})
+#  fleet.pump(5)               #collect events for five seconds
+#  fleet.metrics().snapshot()  #merged over every session in every worker
+#  fleet.restart(2)            #drain worker 2 and start a fresh one on the same shard
+#  fleet.stop()
+#
+#commands are headless.COMMANDS run on each session of a worker (or on "sessions": [i, ...] of it),
+#plus "stats", "forward" ({"types": [30, 33]} sends those server messages up as events) and "drain".
+#usage: python fleet.py [--workers N] [--sessions N] [--host H --port P]   (JSON-line commands on stdin)
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import queue
+import sys
+import threading
+import time
+from metrics import Metrics
+
+DEFAULT_METRICS_INTERVAL = 5.0 #seconds between metric reports from each worker
+DEFAULT_CONCURRENCY = 50 #sessions of one worker running a command at once
+DRAIN_TIMEOUT = 10.0
+
+def default_context():
+    #never fork: the supervisor may have threads (main's stdin reader) holding locks that a forked
+    #worker would inherit held, and it would hang in multiprocessing's bootstrap
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+
+#worker process
+class FleetWorker:
+    def __init__(self, index, host, port, sessions, sockets, commands, events, metrics_interval):
+        self.index = index
+        self.host = host
+        self.port = port
+        self.count = sessions
+        self.sockets = sockets
+        self.commands = commands
+        self.events = events
+        self.metrics_interval = metrics_interval
+        self.forward = set() #response types sent up to the supervisor as they arrive
+        self.draining = False
+
+    def emit(self, event: str, **fields):
+        self.events.put({"event": event, "worker": self.index, "pid": os.getpid(), **fields})
+
+    def on_response(self, response: dict):
+        if response.get("response_type") in self.forward:
+            self.emit("message", **response)
+
+    def collect(self) -> Metrics:
+        #one registry for the whole worker, picklable: no collectors, engine state as gauges
+        merged = Metrics()
+        for session in self.engine.sessions:
+            merged.merge(session.metrics)
+        for name, value in self.engine.stats().items():
+            merged.set(name, value)
+        return merged
+
+    async def run(self):
+        from engine import SessionEngine
+        from utility import RENDERER
+        RENDERER.sink = lambda lines: None #nobody is watching a worker's terminal
+        RENDERER.effects = False
+        RENDERER.configure(max_fps=0)
+        self.engine = SessionEngine(self.host, self.port, sockets=self.sockets)
+        await self.engine.start()
+        for _ in range(self.count):
+            session = await self.engine.add_session()
+            session.subscribe(None, self.on_response)
+        connected = await self.engine.connect_all()
+        self.emit("ready", sessions=self.count, connected=len(connected))
+        reporter = asyncio.create_task(self.report())
+        loop = asyncio.get_running_loop()
+        while not self.draining:
+            command = await loop.run_in_executor(None, self.commands.get)
+            await self.execute(command) #in order, like headless.py
+        reporter.cancel()
+        await self.engine.close()
+        self.emit("drained", metrics=self.collect())
+
+    async def report(self):
+        while True:
+            await asyncio.sleep(self.metrics_interval)
+            self.emit("metrics", metrics=self.collect())
+
+    async def execute(self, command: dict):
+        from headless import COMMANDS
+        ident = command.pop("id", None)
+        name = command.pop("cmd", None)
+        indexes = command.pop("sessions", None)
+        result = {"id": ident, "cmd": name}
+        if name == "drain":
+            self.draining = True
+            self.emit("result", ok=True, **result)
+            return
+        if name == "stats":
+            self.emit("metrics", metrics=self.collect(), **result)
+            return
+        if name == "forward":
+            self.forward = set(command.get("types", []))
+            self.emit("result", ok=True, **result)
+            return
+        if name not in COMMANDS:
+            self.emit("result", ok=False, error=f"unknown command: {name}", **result)
+            return
+        sessions = self.engine.sessions if indexes is None else [self.engine.sessions[i] for i in indexes
+                                                                 if 0 <= i < len(self.engine.sessions)]
+        gate = asyncio.Semaphore(DEFAULT_CONCURRENCY)
+
+        async def one(session):
+            async with gate:
+                value = await getattr(session, COMMANDS[name])(**command)
+                if name == "connect" and session.connected:
+                    session.start_background()
+                return value is not None and not (isinstance(value, dict) and value.get("response_type") == 20)
+
+        outcomes = await asyncio.gather(*(one(s) for s in sessions), return_exceptions=True)
+        errors = [str(o) for o in outcomes if isinstance(o, Exception)]
+        succeeded = sum(1 for o in outcomes if o is True)
+        self.emit("result", ok=succeeded == len(sessions), succeeded=succeeded, failed=len(sessions) - succeeded,
+                  errors=errors[:5], **result)
+
+def worker_main(*args):
+    asyncio.run(FleetWorker(*args).run())
+
+#supervisor side
+class WorkerHandle:
+    def __init__(self, index: int, sessions: int):
+        self.index = index
+        self.sessions = sessions
+        self.process = None
+        self.commands = None
+        self.state = "stopped" #starting, ready, draining, stopped
+        self.metrics = Metrics() #latest report
+        self.connected = 0
+        self.restarts = 0
+
+class Fleet:
+    def __init__(self, host: str, port: int, workers: int = None, sessions: int = 100, sockets: int = 8,
+                 metrics_interval: float = DEFAULT_METRICS_INTERVAL, context=None):
+        self.host = host
+        self.port = port
+        self.context = context or default_context()
+        self.sockets = sockets
+        self.metrics_interval = metrics_interval
+        workers = workers or os.cpu_count() or 1
+        share, extra = divmod(sessions, workers)
+        self.workers = [WorkerHandle(i, share + (i < extra)) for i in range(workers)]
+        self.events = self.context.Queue()
+        self.retired = Metrics() #what drained workers reported last, so totals survive restarts
+        self.next_id = 0
+        self.dropped = 0 #commands for workers that were not ready to take them
+
+    def start(self, wait: bool = True, timeout: float = 60.0):
+        for worker in self.workers:
+            self._spawn(worker)
+        if wait:
+            self.wait_ready(timeout)
+
+    def _spawn(self, worker: WorkerHandle):
+        worker.commands = self.context.Queue()
+        #a crashed or terminated worker never sent "drained", so its last report is kept here
+        self.retired.merge(worker.metrics)
+        worker.metrics = Metrics()
+        worker.state = "starting"
+        worker.process = self.context.Process(
+            target=worker_main, name=f"fleet-worker-{worker.index}", daemon=True,
+            args=(worker.index, self.host, self.port, worker.sessions, self.sockets, worker.commands,
+                  self.events, self.metrics_interval))
+        worker.process.start()
+
+    def wait_ready(self, timeout: float = 60.0) -> bool:
+        deadline = time.monotonic() + timeout
+        while any(w.state == "starting" for w in self.workers) and time.monotonic() < deadline:
+            self.pump(0.1)
+        return all(w.state == "ready" for w in self.workers)
+
+    #control channel
+    def send(self, index: int, command: dict):
+        #returns the command id the worker answers with, None if it was not ready and the command was dropped
+        command = dict(command)
+        if command.get("id") is None:
+            self.next_id += 1
+            command["id"] = self.next_id
+        worker = self.workers[index]
+        if worker.state != "ready":
+            self.dropped += 1
+            return None
+        worker.commands.put(command)
+        return command["id"]
+
+    def broadcast(self, command: dict) -> tuple:
+        #returns the command id and the indexes of the workers that were not ready and did not get it
+        self.next_id += 1
+        command = dict(command, id=command.get("id", self.next_id))
+        skipped = [w.index for w in self.workers if self.send(w.index, command) is None]
+        return command["id"], skipped
+
+    def pump(self, timeout: float = 0.0) -> list:
+        #collects whatever the workers sent within timeout seconds, keeping the fleet state current
+        received = []
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                event = self.events.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                break
+            self._track(event)
+            received.append(event)
+            if time.monotonic() >= deadline:
+                break
+        for worker in self.workers:
+            if worker.state in ("starting", "ready") and not worker.process.is_alive():
+                worker.state = "stopped" #died without draining, its last report stands
+                received.append({"event": "exited", "worker": worker.index, "exitcode": worker.process.exitcode})
+        return received
+
+    def _track(self, event: dict):
+        worker = self.workers[event["worker"]]
+        kind = event["event"]
+        if kind == "ready":
+            worker.state = "ready"
+            worker.connected = event["connected"]
+        elif kind == "metrics":
+            worker.metrics = event["metrics"]
+        elif kind == "drained":
+            worker.metrics = Metrics()
+            self.retired.merge(event["metrics"])
+            worker.state = "stopped"
+
+    def metrics(self) -> Metrics:
+        #counters and histograms summed over every session the fleet has run, gauges over live workers
+        merged = Metrics()
+        merged.merge(self.retired)
+        for worker in self.workers:
+            merged.merge(worker.metrics)
+            for slot, value in worker.metrics.gauges.items():
+                merged.gauges[slot] = merged.gauges.get(slot, 0) + value
+        merged.set("workers_ready", sum(1 for w in self.workers if w.state == "ready"))
+        merged.set("worker_restarts", sum(w.restarts for w in self.workers))
+        merged.set("commands_dropped", self.dropped)
+        return merged
+
+    def status(self) -> list:
+        return [{"worker": w.index, "pid": w.process.pid if w.process else None, "state": w.state,
+                 "sessions": w.sessions, "connected": w.connected, "restarts": w.restarts} for w in self.workers]
+
+    #lifecycle
+    def drain(self, index: int, timeout: float = DRAIN_TIMEOUT) -> list:
+        #lets the worker finish its current command and disconnect every session, then reaps it;
+        #a worker that does not finish in time is terminated. Returns the events seen meanwhile
+        worker = self.workers[index]
+        received = []
+        deadline = time.monotonic() + timeout
+        while worker.state == "starting" and time.monotonic() < deadline:
+            received += self.pump(0.1) #it cannot take commands before it is ready
+        if worker.state == "ready":
+            worker.commands.put({"cmd": "drain"})
+            worker.state = "draining"
+        while worker.state == "draining" and time.monotonic() < deadline:
+            received += self.pump(0.1)
+        if worker.process is not None:
+            worker.process.join(max(0.0, deadline - time.monotonic()))
+            if worker.process.is_alive():
+                worker.process.terminate()
+                worker.process.join()
+        worker.state = "stopped"
+        return received
+
+    def restart(self, index: int, timeout: float = DRAIN_TIMEOUT) -> list:
+        received = self.drain(index, timeout)
+        worker = self.workers[index]
+        worker.restarts += 1
+        self._spawn(worker)
+        return received
+
+    def stop(self, timeout: float = DRAIN_TIMEOUT) -> list:
+        #ready workers start draining at once, workers still starting are drained if they come up in time;
+        #a stuck one only costs its own drain, never the others'
+        received = []
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            for worker in self.workers:
+                if worker.state == "ready":
+                    worker.commands.put({"cmd": "drain"})
+                    worker.state = "draining"
+            if not any(w.state in ("starting", "draining") for w in self.workers):
+                break
+            received += self.pump(0.1)
+        for worker in self.workers:
+            self.drain(worker.index, max(0.0, deadline - time.monotonic()))
+        return received
+
+def main():
+    from chat_client import SERVER_HOST, SERVER_PORT
+    parser = argparse.ArgumentParser(description="Run chat sessions across worker processes")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--sessions", type=int, default=100, help="sessions in the whole fleet")
+    parser.add_argument("--sockets", type=int, default=8, help="sockets per worker")
+    parser.add_argument("--host", default=SERVER_HOST)
+    parser.add_argument("--port", type=int, default=SERVER_PORT)
+    parser.add_argument("--interval", type=float, default=DEFAULT_METRICS_INTERVAL, help="metrics report interval")
+    args = parser.parse_args()
+
+    def emit(event: dict):
+        if isinstance(event.get("metrics"), Metrics):
+            event = dict(event, metrics=event["metrics"].snapshot())
+        print(json.dumps(event, default=str, separators=(",", ":")), flush=True)
+
+    #stdin: {"cmd": "join", "channel": "general"} goes to every worker, "worker": N to one;
+    #fleet-level commands are "status", "stats", "drain"/"restart" with "worker": N, and "stop"
+    lines = queue.Queue()
+
+    def read_stdin():
+        for line in sys.stdin:
+            lines.put(line)
+        lines.put(None)
+
+    fleet = Fleet(args.host, args.port, args.workers, args.sessions, args.sockets, args.interval)
+    fleet.start(wait=False)
+    threading.Thread(target=read_stdin, daemon=True).start()
+    try:
+        while True:
+            for event in fleet.pump(0.1):
+                emit(event)
+            try:
+                line = lines.get_nowait()
+            except queue.Empty:
+                continue
+            if line is None:
+                break
+            if not line.strip():
+                continue
+            try:
+                command = json.loads(line)
+                if not isinstance(command, dict):
+                    raise ValueError("a command is a JSON object")
+            except ValueError as e:
+                emit({"event": "result", "ok": False, "error": f"bad command: {e}"})
+                continue
+            name = command.get("cmd")
+            target = command.pop("worker", None)
+            if target is not None and (type(target) is not int or not 0 <= target < len(fleet.workers)):
+                emit({"event": "result", "id": command.get("id"), "ok": False,
+                      "error": f"bad command: no worker {target!r}, there are {len(fleet.workers)}"})
+                continue
+            if name == "stop":
+                break
+            elif name == "status":
+                emit({"event": "status", "workers": fleet.status()})
+            elif name == "stats":
+                emit({"event": "stats", "metrics": fleet.metrics()})
+            elif name in ("drain", "restart") and target is not None:
+                for event in (fleet.drain if name == "drain" else fleet.restart)(target):
+                    emit(event)
+            elif target is not None:
+                if fleet.send(target, command) is None:
+                    emit({"event": "result", "id": command.get("id"), "worker": target, "ok": False,
+                          "error": f"worker {target} is {fleet.workers[target].state}, command dropped"})
+            else:
+                ident, skipped = fleet.broadcast(command)
+                for index in skipped:
+                    emit({"event": "result", "id": ident, "worker": index, "ok": False,
+                          "error": f"worker {index} is {fleet.workers[index].state}, command dropped"})
+    except KeyboardInterrupt:
+        pass
+    finally: #whatever ended the loop, the workers are drained and their last report emitted
+        for event in fleet.stop():
+            emit(event)
+        emit({"event": "stats", "metrics": fleet.metrics()})
+
+if __name__ == "__main__":
+    main()
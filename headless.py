@@ -0,0 +1,152 @@
+#scriptable client without the terminal UI: commands are JSON lines on stdin, events JSON lines on stdout.
+#prompt_toolkit is never imported, so it starts about as fast as python itself.
+#
+#  {"id": 1, "cmd": "connect"}
+#  {"id": 2, "cmd": "join", "channel": "general"}
+#  {"id": 3, "cmd": "msg", "channel": "general", "message": "hello"}
+#
+#commands run one at a time, in order, and each is answered with {"event": "result", "id": ..., "ok": ...,
+#"result": ...}; everything the server sends arrives as {"event": "<response name>", ...fields}, and text
+#the client would have printed as {"event": "log", "text": ...}. Arguments are the ChatClient method's
+#parameters, see COMMANDS. Closing stdin finishes the queued commands and disconnects.
+#usage: python headless.py [--servers host:port,...] [--history DIR]
+import argparse
+import asyncio
+import json
+import os
+import sys
+from chat_client import ChatClient, SERVER_PORT
+from endpoints import parse_endpoints
+from metrics import TYPE_NAMES
+from utility import RENDERER, _SGR
+
+#cmd -> ChatClient coroutine method
+COMMANDS = {
+    "connect": "connect",
+    "disconnect": "disconnect",
+    "whoami": "whoami",
+    "whois": "whois",                #username, force
+    "setname": "set_username",       #username
+    "create": "create_channel",      #name, description
+    "join": "join_channel",          #channel
+    "leave": "leave_channel",        #channel
+    "info": "channel_info",          #channel, force
+    "channels": "fetch_channels",    #force
+    "users": "fetch_users",          #channel, force
+    "msg": "send_channel_msg",       #channel, message
+    "dm": "send_dm",                 #to_username, message
+}
+
+class Headless:
+    def __init__(self, client: ChatClient, out=sys.stdout):
+        self.client = client
+        self.out = out
+        self.done = asyncio.Event()
+        self.commands = asyncio.Queue()
+        client.subscribe(None, self.on_response)
+        RENDERER.sink = self.on_lines
+        RENDERER.effects = False
+        RENDERER.configure(max_fps=0)
+
+    def emit(self, event: dict):
+        self.out.write(json.dumps(event, default=str, separators=(",", ":")) + "\n")
+        self.out.flush()
+
+    def on_lines(self, lines):
+        for line in lines:
+            text = _SGR.sub("", line).strip()
+            if text:
+                self.emit({"event": "log", "text": text})
+
+    def on_response(self, response: dict):
+        name = TYPE_NAMES.get(response.get("response_type"), "unknown").lower()
+        self.emit({"event": name, **response})
+
+    def handle_line(self, line: str):
+        line = line.strip()
+        if not line:
+            return
+        try:
+            command = json.loads(line)
+            if not isinstance(command, dict):
+                raise ValueError("a command is a JSON object")
+        except ValueError as e:
+            self.emit({"event": "result", "id": None, "ok": False, "error": f"bad command: {e}"})
+            return
+        self.commands.put_nowait(command)
+
+    async def worker(self):
+        while True:
+            command = await self.commands.get()
+            await self.run(command)
+            self.commands.task_done()
+
+    async def run(self, command: dict):
+        ident = command.pop("id", None)
+        name = command.pop("cmd", None)
+        result = {"event": "result", "id": ident, "cmd": name}
+        try:
+            if name == "quit":
+                await self.client.disconnect()
+                self.done.set()
+                result.update(ok=True)
+            elif name == "stats":
+                result.update(ok=True, result=self.client.metrics.snapshot())
+            elif name in COMMANDS:
+                value = await getattr(self.client, COMMANDS[name])(**command)
+                if name == "connect" and self.client.connected:
+                    self.client.start_background()
+                ok = value is not None and not (isinstance(value, dict) and value.get("response_type") == 20)
+                result.update(ok=ok, result=value)
+            else:
+                result.update(ok=False, error=f"unknown command: {name}")
+        except TypeError as e: #wrong arguments for the method
+            result.update(ok=False, error=str(e))
+        self.emit(result)
+
+    async def read_stdin(self):
+        loop = asyncio.get_running_loop()
+        if os.name == "posix":
+            reader = asyncio.StreamReader()
+            await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+            while not self.done.is_set():
+                line = await reader.readline()
+                if not line:
+                    break
+                self.handle_line(line.decode("utf-8", "replace"))
+        else: #no pipe transports for the console, read on a thread
+            while not self.done.is_set():
+                line = await loop.run_in_executor(None, sys.stdin.readline)
+                if not line:
+                    break
+                self.handle_line(line)
+        await self.commands.join() #stdin closed, finish what was asked
+        await self.client.disconnect()
+        self.done.set()
+
+async def main():
+    parser = argparse.ArgumentParser(description="Headless JSON-lines chat client")
+    parser.add_argument("--servers", default=os.environ.get("CHAT_SERVERS", ""), help="host:port,host:port")
+    parser.add_argument("--history", help="store messages in this directory")
+    args = parser.parse_args()
+
+    client = ChatClient(endpoints=parse_endpoints(args.servers, SERVER_PORT))
+    client.minimal_mode = True
+    if args.history:
+        from history import HistoryStore
+        client.history = HistoryStore(args.history)
+    headless = Headless(client)
+    headless.emit({"event": "ready", "pid": os.getpid()})
+    reader = asyncio.create_task(headless.read_stdin())
+    worker = asyncio.create_task(headless.worker())
+    await headless.done.wait()
+    reader.cancel()
+    worker.cancel()
+    client.supervisor.cancel()
+    client.stop_background()
+    client.close()
+    if client.history is not None:
+        client.history.close()
+
+if __name__ == "__main__":
+    asyncio.run(main())
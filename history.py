@@ -0,0 +1,182 @@
+import mmap
+import os
+import struct
+import time
+from array import array
+from bisect import bisect_left
+
+CHANNEL = 0
+DIRECT = 1
+INCOMING = 0
+OUTGOING = 1
+
+DEFAULT_DIR = os.path.join(os.path.expanduser("~"), ".chat_history")
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+COMPACT_TO = 0.75 #fraction of max_bytes kept after a compaction
+
+#record: total length, message id, unix time, kind, direction, key length, sender length, text length,
+#then key (channel or DM peer), sender and text as utf-8
+HEADER = struct.Struct("<IQdBBHHI")
+FILE_MAGIC = b"CHATLOG1"
+
+class Message:
+    __slots__ = ("msg_id", "timestamp", "kind", "direction", "key", "sender", "text")
+
+    def __init__(self, msg_id, timestamp, kind, direction, key, sender, text):
+        self.msg_id = msg_id
+        self.timestamp = timestamp
+        self.kind = kind
+        self.direction = direction
+        self.key = key
+        self.sender = sender
+        self.text = text
+
+#append-only message log, read through mmap, with an offset index per channel and per DM peer
+class HistoryStore:
+    def __init__(self, directory: str = DEFAULT_DIR, max_bytes: int = DEFAULT_MAX_BYTES):
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, "history.log")
+        self.max_bytes = max_bytes
+        self.file = None
+        self.map = None
+        self.mapped = 0 #bytes covered by self.map
+        self.compactions = 0
+        self.listeners = [] #objects with history_appended(message) and history_compacted(first_id)
+        self._open()
+
+    def _open(self):
+        if not os.path.exists(self.path) or os.path.getsize(self.path) < len(FILE_MAGIC):
+            with open(self.path, "wb") as f:
+                f.write(FILE_MAGIC)
+        self.file = open(self.path, "r+b")
+        if self.file.read(len(FILE_MAGIC)) != FILE_MAGIC:
+            raise ValueError(f"{self.path} is not a chat history file")
+        self._scan()
+
+    def _scan(self):
+        #rebuild the indexes in one pass, cutting off a torn last record if the client died mid-write
+        self.index = {} #(kind, key) -> array of offsets
+        self.offsets = array("Q") #offset of message first_id + i
+        self.first_id = 0
+        self.next_id = 0
+        self._remap()
+        size = os.path.getsize(self.path)
+        offset = len(FILE_MAGIC)
+        while offset + HEADER.size <= size:
+            length, msg_id, _, kind, _, key_len, _, _ = HEADER.unpack_from(self.map, offset)
+            if length < HEADER.size or offset + length > size:
+                break
+            key = bytes(self.map[offset + HEADER.size:offset + HEADER.size + key_len]).decode("utf-8", "replace")
+            if not self.offsets:
+                self.first_id = msg_id
+            self.offsets.append(offset)
+            self._index(kind, key, offset)
+            self.next_id = msg_id + 1
+            offset += length
+        if offset != size:
+            self.file.truncate(offset)
+            self._remap()
+        self.file.seek(0, os.SEEK_END)
+
+    def _remap(self):
+        if self.map is not None:
+            self.map.close()
+        self.file.flush()
+        size = os.path.getsize(self.path)
+        self.map = mmap.mmap(self.file.fileno(), size, access=mmap.ACCESS_READ) if size else None
+        self.mapped = size
+
+    def _index(self, kind: int, key: str, offset: int):
+        offsets = self.index.get((kind, key))
+        if offsets is None:
+            offsets = self.index[(kind, key)] = array("Q")
+        offsets.append(offset)
+
+    def append(self, kind: int, key: str, sender: str, text: str, direction: int = INCOMING, timestamp: float = None) -> int:
+        key_b = key.encode("utf-8")
+        sender_b = sender.encode("utf-8")
+        text_b = text.encode("utf-8")
+        length = HEADER.size + len(key_b) + len(sender_b) + len(text_b)
+        msg_id = self.next_id
+        if timestamp is None:
+            timestamp = time.time()
+        offset = self.file.seek(0, os.SEEK_END)
+        self.file.write(HEADER.pack(length, msg_id, timestamp, kind,
+                                    direction, len(key_b), len(sender_b), len(text_b)) + key_b + sender_b + text_b)
+        self.file.flush()
+        if not self.offsets:
+            self.first_id = msg_id
+        self.offsets.append(offset)
+        self._index(kind, key, offset)
+        self.next_id = msg_id + 1
+        if self.listeners:
+            message = Message(msg_id, timestamp, kind, direction, key, sender, text)
+            for listener in self.listeners:
+                listener.history_appended(message)
+        if offset + length > self.max_bytes:
+            self.compact()
+        return msg_id
+
+    def read(self, offset: int) -> Message:
+        if offset + HEADER.size > self.mapped:
+            self._remap() #appended since the last map
+        length, msg_id, timestamp, kind, direction, key_len, sender_len, text_len = HEADER.unpack_from(self.map, offset)
+        start = offset + HEADER.size
+        key = self.map[start:start + key_len].decode("utf-8", "replace")
+        start += key_len
+        sender = self.map[start:start + sender_len].decode("utf-8", "replace")
+        start += sender_len
+        text = self.map[start:start + text_len].decode("utf-8", "replace")
+        return Message(msg_id, timestamp, kind, direction, key, sender, text)
+
+    def get(self, msg_id: int):
+        #None once the message has been compacted away
+        position = msg_id - self.first_id
+        if position < 0 or position >= len(self.offsets):
+            return None
+        return self.read(self.offsets[position])
+
+    def last(self, kind: int, key: str, count: int = 20) -> list:
+        offsets = self.index.get((kind, key))
+        if not offsets:
+            return []
+        return [self.read(offset) for offset in offsets[-count:]]
+
+    def keys(self, kind: int) -> list:
+        return sorted(key for k, key in self.index if k == kind)
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def compact(self):
+        #keep the newest messages that fit in COMPACT_TO of the budget, ids are preserved
+        self.file.flush()
+        next_id = self.next_id
+        budget = int(self.max_bytes * COMPACT_TO)
+        size = os.path.getsize(self.path)
+        keep_from = bisect_left(self.offsets, size - budget)
+        start = self.offsets[keep_from] if keep_from < len(self.offsets) else size
+        self._remap()
+        temp = self.path + ".tmp"
+        with open(temp, "wb") as out:
+            out.write(FILE_MAGIC)
+            out.write(self.map[start:size] if self.map is not None else b"")
+        self.map.close()
+        self.map = None
+        self.file.close()
+        os.replace(temp, self.path)
+        self.file = open(self.path, "r+b")
+        self._scan()
+        if not self.offsets: #everything went, ids still must not be reused
+            self.first_id = self.next_id = next_id
+        self.compactions += 1
+        for listener in self.listeners:
+            listener.history_compacted(self.first_id)
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+        if self.file is not None:
+            self.file.close()
+            self.file = None
@@ -0,0 +1,165 @@
+import asyncio
+from collections import OrderedDict, deque
+
+#retransmission policy per request_type: (first attempt timeout, retries, backoff factor)
+#only requests that are safe to repeat get retries, sends/creates are never duplicated. CONNECT is not
+#either: every copy the server sees opens another session, so a lost one fails over to the next endpoint
+RETRY_POLICY = {
+    1: (3.0, 0, 1.0),   #CONNECT
+    2: (1.0, 2, 2.0),   #DISCONNECT
+    3: (2.0, 0, 1.0),   #PING, the keepalive counts misses itself
+    4: (3.0, 0, 1.0),   #CHANNEL_CREATE
+    5: (1.0, 3, 2.0),   #CHANNEL_LIST
+    6: (1.0, 3, 2.0),   #CHANNEL_INFO
+    7: (1.0, 3, 2.0),   #CHANNEL_JOIN
+    8: (1.0, 3, 2.0),   #CHANNEL_LEAVE
+    9: (3.0, 0, 1.0),   #CHANNEL_MESSAGE
+    10: (1.0, 3, 2.0),  #WHOIS
+    11: (1.0, 3, 2.0),  #WHOAMI
+    12: (3.0, 0, 1.0),  #USER_MESSAGE
+    13: (3.0, 0, 1.0),  #SETUSERNAME
+    14: (1.0, 3, 2.0),  #USER_LIST
+}
+DEFAULT_POLICY = (1.0, 2, 2.0)
+
+class RequestTimeout(Exception):
+    pass
+
+class RequestShed(RequestTimeout):
+    #the send queue was full, the request never left; a RequestTimeout so callers need no new case
+    pass
+
+class InflightRequest:
+    __slots__ = ("handle", "request_type", "packet", "future", "started_at", "sent_at", "attempts")
+
+    def __init__(self, handle, request_type, packet, future):
+        self.handle = handle
+        self.request_type = request_type
+        self.packet = packet
+        self.future = future
+        self.started_at = 0.0
+        self.sent_at = 0.0
+        self.attempts = 0
+
+class InflightTable:
+    def __init__(self, send, policy=None, completed_limit: int = 1024, rtt_samples: int = 256, metrics=None, estimator=None):
+        self.send = send #callable taking the packet dict and a priority class (None for the default), False if it shed the packet
+        self.metrics = metrics #optional Metrics, gets rtt/latency histograms and per-type failures
+        self.estimator = estimator #optional RttEstimator, fed every sample and consulted for timeouts
+        self.policy = dict(RETRY_POLICY if policy is None else policy)
+        self.pending = {} #request_handle -> InflightRequest
+        self.completed = OrderedDict() #recently answered handles, for duplicate suppression
+        self.completed_limit = completed_limit
+        self.rtt = {} #request_type -> deque of recent round-trip times (seconds)
+        self.rtt_samples = rtt_samples
+        self.coalescing = {} #packet contents -> task already asking the same thing
+        self.retransmits = 0
+        self.timeouts = 0
+        self.duplicates = 0
+        self.coalesced = 0
+
+    async def request(self, packet: dict, timeout: float = None, priority: int = None, coalesce: bool = False):
+        if not coalesce:
+            return await self._request(packet, timeout, priority)
+        #an identical query already in flight answers for this one too
+        key = tuple((k, v) for k, v in packet.items() if k != "request_handle")
+        task = self.coalescing.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._request(packet, timeout, priority))
+            self.coalescing[key] = task
+            task.add_done_callback(lambda _: self.coalescing.pop(key, None))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    async def _request(self, packet: dict, timeout: float, priority: int):
+        loop = asyncio.get_running_loop()
+        handle = packet["request_handle"]
+        request_type = packet["request_type"]
+        wait, retries, backoff = self.policy.get(request_type, DEFAULT_POLICY)
+        if self.estimator is not None and self.estimator.samples:
+            #retried requests time out on the measured RTO; one-shot ones never wait less than their policy
+            wait = self.estimator.rto if retries else max(wait, self.estimator.rto)
+        deadline = None if timeout is None else loop.time() + timeout
+
+        entry = InflightRequest(handle, request_type, packet, loop.create_future())
+        entry.started_at = loop.time()
+        self.pending[handle] = entry
+        try:
+            for _ in range(retries + 1):
+                if entry.attempts:
+                    self.retransmits += 1
+                    if self.metrics is not None:
+                        self.metrics.inc("retransmits", request_type)
+                entry.attempts += 1
+                entry.sent_at = loop.time()
+                if self.send(packet, priority) is False: #counted by the scheduler as send_shed
+                    raise RequestShed(f"request_type {request_type} shed, the send queue is full")
+                if deadline is not None:
+                    wait = min(wait, deadline - entry.sent_at)
+                    if wait <= 0:
+                        break
+                try:
+                    return await asyncio.wait_for(asyncio.shield(entry.future), wait)
+                except asyncio.TimeoutError:
+                    wait *= backoff
+            self.timeouts += 1
+            if self.metrics is not None:
+                self.metrics.inc("timeouts", request_type)
+            raise RequestTimeout(f"no response to request_type {request_type} after {entry.attempts} attempt(s)")
+        finally:
+            self.pending.pop(handle, None)
+            if not entry.future.done():
+                entry.future.cancel()
+
+    #returns False if the response is a duplicate and should be dropped
+    def resolve(self, response: dict) -> bool:
+        handle = response.get("response_handle")
+        if handle is None: #server initiated broadcast
+            return True
+        if handle in self.completed:
+            self.duplicates += 1
+            if self.metrics is not None:
+                self.metrics.inc("duplicates")
+            return False
+        self.completed[handle] = True
+        if len(self.completed) > self.completed_limit:
+            self.completed.popitem(last=False)
+
+        entry = self.pending.get(handle)
+        if entry is not None and not entry.future.done():
+            now = asyncio.get_running_loop().time()
+            #Karn's rule: only time unambiguous (non-retransmitted) requests
+            if entry.attempts == 1:
+                sample = now - entry.sent_at
+                samples = self.rtt.get(entry.request_type)
+                if samples is None:
+                    samples = self.rtt[entry.request_type] = deque(maxlen=self.rtt_samples)
+                samples.append(sample)
+                if self.estimator is not None:
+                    self.estimator.observe(sample)
+                if self.metrics is not None:
+                    self.metrics.observe("rtt", entry.request_type, sample)
+            if self.metrics is not None: #what the user waited, retransmissions included
+                self.metrics.observe("latency", entry.request_type, now - entry.started_at)
+            entry.future.set_result(response)
+        return True
+
+    #fail every outstanding request, e.g. when the session goes away
+    def cancel_all(self, reason: str = "session closed"):
+        for entry in self.pending.values():
+            if not entry.future.done():
+                entry.future.set_exception(RequestTimeout(reason))
+
+    def rtt_stats(self, request_type: int):
+        samples = self.rtt.get(request_type)
+        if not samples:
+            return None
+        ordered = sorted(samples)
+        return {
+            "count": len(ordered),
+            "min": ordered[0],
+            "avg": sum(ordered) / len(ordered),
+            "max": ordered[-1],
+            "last": samples[-1],
+        }
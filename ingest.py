@@ -0,0 +1,94 @@
+import asyncio
+import socket
+from collections import deque
+
+DROP_OLDEST = "drop-oldest" #keep the freshest traffic
+DROP_NEWEST = "drop-newest" #keep what is already queued
+
+DEFAULT_RCVBUF = 1 << 20 #1 MiB kernel receive buffer
+DEFAULT_QUEUE_SIZE = 4096
+DEFAULT_BATCH_SIZE = 64
+
+def set_rcvbuf(sock: socket.socket, size: int) -> int:
+    #returns the size the kernel actually granted (Linux doubles it, and caps it at rmem_max)
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, size)
+    except OSError:
+        pass
+    return sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+
+#receives datagrams straight from the event loop into a bounded queue,
+#so the socket keeps being drained while the consumer is busy rendering
+class IngestProtocol(asyncio.DatagramProtocol):
+    def __init__(self, maxsize: int = DEFAULT_QUEUE_SIZE, overflow: str = DROP_OLDEST):
+        if overflow not in (DROP_OLDEST, DROP_NEWEST):
+            raise ValueError(f"unknown overflow policy: {overflow}")
+        self.maxsize = maxsize
+        self.overflow = overflow
+        self.queue = deque()
+        self.transport = None
+        self.closed = False
+        self.waiter = None
+        #counters
+        self.received = 0
+        self.dropped = 0
+        self.errors = 0
+        self.high_water = 0
+        self.batches = 0
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.closed = False
+        self.queue.clear() #anything left belongs to the previous transport
+
+    def connection_lost(self, exc):
+        self.transport = None
+        self.closed = True
+        self._wake()
+
+    def datagram_received(self, data, addr):
+        self.received += 1
+        queue = self.queue
+        if len(queue) >= self.maxsize:
+            self.dropped += 1
+            if self.overflow == DROP_NEWEST:
+                return
+            queue.popleft()
+        queue.append(data)
+        if len(queue) > self.high_water:
+            self.high_water = len(queue)
+        self._wake()
+
+    def error_received(self, exc):
+        #e.g. ICMP port unreachable on Linux, the next read carries on
+        self.errors += 1
+
+    def _wake(self):
+        waiter = self.waiter
+        if waiter is not None and not waiter.done():
+            waiter.set_result(None)
+
+    #wait for at least one datagram and take up to limit of them in one go
+    async def get_batch(self, limit: int = DEFAULT_BATCH_SIZE) -> list:
+        queue = self.queue
+        while not queue:
+            if self.closed:
+                raise ConnectionError("receive transport closed")
+            self.waiter = asyncio.get_running_loop().create_future()
+            try:
+                await self.waiter
+            finally:
+                self.waiter = None
+        count = min(limit, len(queue))
+        self.batches += 1
+        return [queue.popleft() for _ in range(count)]
+
+    def stats(self) -> dict:
+        return {
+            "received": self.received,
+            "dropped": self.dropped,
+            "queued": len(self.queue),
+            "high_water": self.high_water,
+            "batches": self.batches,
+            "errors": self.errors,
+        }
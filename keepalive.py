@@ -0,0 +1,93 @@
+import asyncio
+import time
+
+#RFC 6298 constants
+ALPHA = 1 / 8
+BETA = 1 / 4
+K = 4
+MIN_RTO = 0.2
+MAX_RTO = 10.0
+
+DEFAULT_INTERVAL = 20.0 #seconds of silence before a ping is sent
+DEFAULT_MAX_MISSED = 3  #consecutive unanswered pings before the session is declared dead
+
+#smoothed round-trip time and its variance, as TCP keeps them; rto is the timeout derived from both
+class RttEstimator:
+    def __init__(self, min_rto: float = MIN_RTO, max_rto: float = MAX_RTO):
+        self.min_rto = min_rto
+        self.max_rto = max_rto
+        self.reset()
+
+    def reset(self):
+        self.srtt = None
+        self.rttvar = None
+        self.rto = 1.0 #until the first sample
+        self.samples = 0
+
+    def observe(self, sample: float):
+        #only unambiguous samples belong here, see Karn's rule in InflightTable.resolve
+        if self.srtt is None:
+            self.srtt = sample
+            self.rttvar = sample / 2
+        else:
+            self.rttvar = (1 - BETA) * self.rttvar + BETA * abs(self.srtt - sample)
+            self.srtt = (1 - ALPHA) * self.srtt + ALPHA * sample
+        self.rto = min(self.max_rto, max(self.min_rto, self.srtt + K * self.rttvar))
+        self.samples += 1
+
+#pings only when nothing has been sent to the server for interval seconds, since the server refreshes a
+#session on requests alone, and gives up after max_missed pongs in a row go missing. Inbound traffic
+#proves the path is alive but does not keep the session from expiring on the server
+class Keepalive:
+    def __init__(self, ping, on_dead, interval: float = DEFAULT_INTERVAL, max_missed: int = DEFAULT_MAX_MISSED):
+        self.ping = ping #coroutine function, True when the matching pong came back
+        self.on_dead = on_dead #called with a reason once the session is considered gone
+        self.interval = interval
+        self.max_missed = max_missed
+        self.last_heard = time.monotonic()
+        self.last_sent = self.last_heard
+        self.missed = 0 #consecutive
+        self.pings = 0
+        self.skipped = 0 #intervals where other requests made a ping unnecessary
+
+    def heard(self):
+        self.last_heard = time.monotonic()
+        self.missed = 0
+
+    def sent(self):
+        #any request refreshes the session on the server, so it stands in for a ping
+        self.last_sent = time.monotonic()
+
+    def due_in(self) -> float:
+        #seconds until a ping is due, <= 0 means now
+        if self.missed:
+            return 0.0 #an unanswered ping is followed up straight away
+        return self.interval - (time.monotonic() - self.last_sent)
+
+    async def probe(self, alive) -> bool:
+        #one ping; False once the session should not be kept alive any more
+        self.pings += 1
+        if await self.ping():
+            self.heard()
+            return True
+        if not alive():
+            return False
+        self.missed += 1
+        if self.missed >= self.max_missed:
+            self.on_dead(f"no response to {self.missed} pings")
+            return False
+        return True #probe again straight away, see due_in
+
+    async def run(self, alive):
+        #alive: callable, the loop ends once it returns False. engine.SessionEngine drives
+        #due_in/probe from a shared timer wheel instead of one of these loops per session
+        self.heard()
+        while alive():
+            wait = self.due_in()
+            if wait > 0:
+                await asyncio.sleep(wait)
+                if self.due_in() > 0:
+                    self.skipped += 1 #something was sent meanwhile
+                continue
+            if not await self.probe(alive):
+                return
@@ -0,0 +1,306 @@
+#local stand-in for the chat server, speaks the same msgpack protocol over UDP
+#usage: python local_server.py [--host 127.0.0.1] [--port 51825] [--page-size 20] [--loss 0.0]
+import argparse
+import asyncio
+import random
+import secrets
+import signal
+import time
+import msgpack
+
+SESSION_TIMEOUT = 90 #seconds without traffic before a session is dropped
+
+class Session:
+    __slots__ = ("session_id", "addr", "username", "channels", "last_seen")
+
+    def __init__(self, session_id, addr, username):
+        self.session_id = session_id
+        self.addr = addr
+        self.username = username
+        self.channels = set()
+        self.last_seen = time.monotonic()
+
+class Channel:
+    __slots__ = ("name", "description", "members")
+
+    def __init__(self, name, description):
+        self.name = name
+        self.description = description
+        self.members = set() #session ids
+
+class ChatServer(asyncio.DatagramProtocol):
+    def __init__(self, page_size: int = 20, loss: float = 0.0, delay: float = 0.0, seed=None):
+        self.page_size = page_size
+        self.loss = loss #probability of dropping an outgoing datagram
+        self.delay = delay #extra one-way delay in seconds
+        self.rng = random.Random(seed)
+        self.transport = None
+        self.sessions = {} #session id -> Session
+        self.by_name = {} #username -> Session
+        self.channels = {} #name -> Channel
+        self.next_user = 1
+        self.received = 0
+        self.sent = 0
+        self.dropped = 0
+        self.handlers = {
+            1: self.on_connect,
+            2: self.on_disconnect,
+            3: self.on_ping,
+            4: self.on_channel_create,
+            5: self.on_channel_list,
+            6: self.on_channel_info,
+            7: self.on_channel_join,
+            8: self.on_channel_leave,
+            9: self.on_channel_message,
+            10: self.on_whois,
+            11: self.on_whoami,
+            12: self.on_user_message,
+            13: self.on_set_username,
+            14: self.on_user_list,
+        }
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        self.received += 1
+        try:
+            request = msgpack.unpackb(data)
+            handler = self.handlers.get(request.get("request_type"))
+        except Exception:
+            return
+        handle = request.get("request_handle")
+        if handler is None:
+            self.reply(addr, handle, 20, error="Unknown request type.")
+            return
+        session = None
+        if request["request_type"] != 1:
+            session = self.sessions.get(request.get("session"))
+            if session is None:
+                self.reply(addr, handle, 20, error="Invalid session.")
+                return
+            session.addr = addr
+            session.last_seen = time.monotonic()
+        handler(request, session, addr, handle)
+
+    #outgoing
+    def send(self, addr, message: dict):
+        if self.loss and self.rng.random() < self.loss:
+            self.dropped += 1
+            return
+        self.sent += 1
+        packed = msgpack.packb(message)
+        if self.delay:
+            asyncio.get_running_loop().call_later(self.delay, self.transport.sendto, packed, addr)
+        else:
+            self.transport.sendto(packed, addr)
+
+    def reply(self, addr, handle, response_type: int, **fields):
+        fields["response_type"] = response_type
+        fields["response_handle"] = handle
+        self.send(addr, fields)
+
+    def push(self, session: Session, response_type: int, **fields):
+        fields["response_type"] = response_type
+        self.send(session.addr, fields)
+
+    def page(self, items, offset):
+        offset = max(0, int(offset or 0))
+        chunk = items[offset:offset + self.page_size]
+        return chunk, offset + self.page_size < len(items)
+
+    def remove_session(self, session: Session):
+        for name in list(session.channels):
+            self.leave(session, self.channels[name])
+        self.sessions.pop(session.session_id, None)
+        self.by_name.pop(session.username, None)
+
+    def leave(self, session: Session, channel: Channel):
+        channel.members.discard(session.session_id)
+        session.channels.discard(channel.name)
+        for sid in channel.members:
+            self.push(self.sessions[sid], 29, channel=channel.name, username=session.username)
+
+    #request handlers
+    def on_connect(self, request, session, addr, handle):
+        while f"clear-user{self.next_user}" in self.by_name:
+            self.next_user += 1
+        username = f"clear-user{self.next_user}"
+        self.next_user += 1
+        session_id = secrets.randbits(32)
+        session = Session(session_id, addr, username)
+        self.sessions[session_id] = session
+        self.by_name[username] = session
+        self.reply(addr, handle, 22, session=session_id, username=username, message=f"Welcome {username}!")
+
+    def on_disconnect(self, request, session, addr, handle):
+        self.remove_session(session)
+        self.reply(addr, handle, 23, message="Goodbye.")
+
+    def on_ping(self, request, session, addr, handle):
+        self.reply(addr, handle, 24)
+
+    def on_channel_create(self, request, session, addr, handle):
+        name = request.get("channel", "")
+        description = request.get("description", "")
+        if not name or len(name) > 20:
+            self.reply(addr, handle, 20, error="Invalid channel name.")
+        elif name in self.channels:
+            self.reply(addr, handle, 20, error=f"Channel {name} already exists.")
+        else:
+            channel = self.channels[name] = Channel(name, description)
+            channel.members.add(session.session_id)
+            session.channels.add(name)
+            self.reply(addr, handle, 25, channel=name, description=description)
+
+    def on_channel_list(self, request, session, addr, handle):
+        channels, next_page = self.page(sorted(self.channels), request.get("offset"))
+        self.reply(addr, handle, 26, channels=channels, next_page=next_page)
+
+    def on_channel_info(self, request, session, addr, handle):
+        channel = self.channels.get(request.get("channel"))
+        if channel is None:
+            self.reply(addr, handle, 20, error="No such channel.")
+            return
+        members = sorted(self.sessions[sid].username for sid in channel.members)
+        self.reply(addr, handle, 27, channel=channel.name, description=channel.description, members=members)
+
+    def on_channel_join(self, request, session, addr, handle):
+        channel = self.channels.get(request.get("channel"))
+        if channel is None:
+            self.reply(addr, handle, 20, error="No such channel.")
+            return
+        if session.session_id not in channel.members:
+            for sid in channel.members:
+                self.push(self.sessions[sid], 28, channel=channel.name, username=session.username)
+            channel.members.add(session.session_id)
+            session.channels.add(channel.name)
+        self.reply(addr, handle, 28, channel=channel.name, username=session.username, description=channel.description)
+
+    def on_channel_leave(self, request, session, addr, handle):
+        channel = self.channels.get(request.get("channel"))
+        if channel is None or session.session_id not in channel.members:
+            self.reply(addr, handle, 20, error="You are not in that channel.")
+            return
+        self.leave(session, channel)
+        self.reply(addr, handle, 29, channel=channel.name, username=session.username)
+
+    def on_channel_message(self, request, session, addr, handle):
+        channel = self.channels.get(request.get("channel"))
+        message = request.get("message", "")
+        if channel is None or session.session_id not in channel.members:
+            self.reply(addr, handle, 20, error="You are not in that channel.")
+            return
+        if len(message) > 500:
+            self.reply(addr, handle, 20, error="Message too long.")
+            return
+        for sid in channel.members:
+            if sid != session.session_id:
+                self.push(self.sessions[sid], 30, channel=channel.name, username=session.username, message=message)
+        self.reply(addr, handle, 30, channel=channel.name, username=session.username, message=message)
+
+    def on_whois(self, request, session, addr, handle):
+        target = self.by_name.get(request.get("username"))
+        if target is None:
+            self.reply(addr, handle, 20, error="No such user.")
+            return
+        self.reply(addr, handle, 31, username=target.username, status="active", transport="udp",
+                   channels=sorted(target.channels), wireguard_public_key="")
+
+    def on_whoami(self, request, session, addr, handle):
+        self.reply(addr, handle, 32, username=session.username)
+
+    def on_user_message(self, request, session, addr, handle):
+        target = self.by_name.get(request.get("to_username"))
+        message = request.get("message", "")
+        if target is None:
+            self.reply(addr, handle, 20, error="No such user.")
+            return
+        if len(message) > 500:
+            self.reply(addr, handle, 20, error="Message too long.")
+            return
+        if target is not session:
+            self.push(target, 33, from_username=session.username, message=message)
+        self.reply(addr, handle, 33, from_username=session.username, message=message)
+
+    def on_set_username(self, request, session, addr, handle):
+        new = request.get("username", "")
+        if not new or ":" in new or len(new) > 20:
+            self.reply(addr, handle, 20, error="Invalid username.")
+            return
+        if new in self.by_name and self.by_name[new] is not session:
+            self.reply(addr, handle, 20, error="Username taken.")
+            return
+        old = session.username
+        del self.by_name[old]
+        session.username = new
+        self.by_name[new] = session
+        self.reply(addr, handle, 34, old_username=old, new_username=new)
+
+    def on_user_list(self, request, session, addr, handle):
+        name = request.get("channel")
+        if name:
+            channel = self.channels.get(name)
+            if channel is None:
+                self.reply(addr, handle, 20, error="No such channel.")
+                return
+            names = sorted(self.sessions[sid].username for sid in channel.members)
+        else:
+            names = sorted(self.by_name)
+        users, next_page = self.page(names, request.get("offset"))
+        self.reply(addr, handle, 35, users=users, next_page=next_page)
+
+    #housekeeping
+    def broadcast(self, message: str):
+        for session in list(self.sessions.values()):
+            self.push(session, 36, message=message)
+
+    def shutdown(self):
+        for session in list(self.sessions.values()):
+            self.push(session, 37)
+        self.sessions.clear()
+        self.by_name.clear()
+        self.channels.clear()
+
+    def expire_sessions(self, timeout: float = SESSION_TIMEOUT):
+        cutoff = time.monotonic() - timeout
+        for session in [s for s in self.sessions.values() if s.last_seen < cutoff]:
+            self.remove_session(session)
+
+async def start_server(host: str = "127.0.0.1", port: int = 51825, **options):
+    loop = asyncio.get_running_loop()
+    transport, server = await loop.create_datagram_endpoint(lambda: ChatServer(**options), local_addr=(host, port))
+    return transport, server
+
+async def serve(host: str, port: int, **options):
+    transport, server = await start_server(host, port, **options)
+    print(f"Listening on {host}:{transport.get_extra_info('sockname')[1]}", flush=True)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    try:
+        while not stop.is_set():
+            try:
+                await asyncio.wait_for(stop.wait(), 10)
+            except asyncio.TimeoutError:
+                server.expire_sessions()
+    finally:
+        server.shutdown()
+        await asyncio.sleep(0.05) #let the shutdown notices go out
+        transport.close()
+        print(f"received {server.received} sent {server.sent} dropped {server.dropped}", flush=True)
+
+def main():
+    parser = argparse.ArgumentParser(description="Local UDP stand-in for the chat server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=51825)
+    parser.add_argument("--page-size", type=int, default=20)
+    parser.add_argument("--loss", type=float, default=0.0, help="probability of dropping each outgoing datagram")
+    parser.add_argument("--delay", type=float, default=0.0, help="extra one-way delay in seconds")
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+    asyncio.run(serve(args.host, args.port, page_size=args.page_size, loss=args.loss, delay=args.delay, seed=args.seed))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+import traceback
+
+DEFAULT_INTERVAL = 0.05  #how often the loop is asked to run a tick
+DEFAULT_THRESHOLD = 0.1  #a tick this late means something held the loop
+STACK_DEPTH = 8
+
+class StallSite:
+    __slots__ = ("where", "stack", "count", "total", "worst")
+
+    def __init__(self, where, stack):
+        self.where = where #innermost "file:line function" of the sampled stack
+        self.stack = stack #formatted frames, outermost first
+        self.count = 0
+        self.total = 0.0
+        self.worst = 0.0
+
+#opt-in loop health monitor: a tick scheduled every interval measures how late the loop runs it,
+#and a watchdog thread samples the loop thread's stack when a tick is overdue, so a stall is
+#charged to the call that was running while it happened
+class LoopMonitor:
+    def __init__(self, interval: float = DEFAULT_INTERVAL, threshold: float = DEFAULT_THRESHOLD, metrics=None):
+        self.interval = interval
+        self.threshold = threshold
+        self.metrics = metrics #optional Metrics, gets a loop_lag histogram and loop_stalls counter
+        self.loop = None
+        self.loop_thread = None
+        self.handle = None
+        self.watchdog = None
+        self.stopping = threading.Event()
+        self.expected = 0.0
+        self.heartbeat = 0.0 #monotonic time of the last tick, read by the watchdog
+        self.sampled = None #StallSite charged for the stall in progress
+        self.sites = {}
+        self.ticks = 0
+        self.stalls = 0
+        self.max_lag = 0.0
+        self.total_lag = 0.0
+
+    @property
+    def running(self) -> bool:
+        return self.handle is not None
+
+    def start(self):
+        if self.running:
+            return
+        self.loop = asyncio.get_running_loop()
+        self.loop_thread = threading.get_ident()
+        self.heartbeat = time.monotonic()
+        self.expected = self.loop.time() + self.interval
+        self.handle = self.loop.call_at(self.expected, self._tick)
+        self.stopping.clear()
+        self.watchdog = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self.watchdog.start()
+
+    def stop(self):
+        if self.handle is not None:
+            self.handle.cancel()
+            self.handle = None
+        self.stopping.set()
+        if self.watchdog is not None:
+            self.watchdog.join()
+            self.watchdog = None
+
+    def _tick(self):
+        now = self.loop.time()
+        lag = max(0.0, now - self.expected)
+        self.heartbeat = time.monotonic()
+        self.ticks += 1
+        self.total_lag += lag
+        self.max_lag = max(self.max_lag, lag)
+        if self.metrics is not None:
+            self.metrics.observe("loop_lag", None, lag)
+        if lag >= self.threshold:
+            self.stalls += 1
+            if self.metrics is not None:
+                self.metrics.inc("loop_stalls")
+            site = self.sampled
+            if site is not None:
+                site.total += lag
+                site.worst = max(site.worst, lag)
+        self.sampled = None
+        self.expected = now + self.interval
+        self.handle = self.loop.call_at(self.expected, self._tick)
+
+    def _watch(self):
+        while not self.stopping.wait(self.threshold / 2):
+            overdue = time.monotonic() - self.heartbeat - self.interval
+            if overdue >= self.threshold and self.sampled is None:
+                self.sampled = self._sample()
+
+    def _sample(self):
+        frame = sys._current_frames().get(self.loop_thread)
+        if frame is None:
+            return None
+        frames = traceback.extract_stack(frame)[-STACK_DEPTH:]
+        if not frames:
+            return None
+        top = frames[-1]
+        where = f"{os.path.basename(top.filename)}:{top.lineno} {top.name}"
+        site = self.sites.get(where)
+        if site is None:
+            stack = [f"{os.path.basename(f.filename)}:{f.lineno} {f.name}" for f in frames]
+            site = self.sites[where] = StallSite(where, stack)
+        site.count += 1
+        return site
+
+    def report(self, limit: int = 5) -> list:
+        #worst offenders by total time stalled
+        return sorted(self.sites.values(), key=lambda site: site.total, reverse=True)[:limit]
+
+    def stats(self) -> dict:
+        return {
+            "ticks": self.ticks,
+            "stalls": self.stalls,
+            "avg_lag_ms": round(self.total_lag / self.ticks * 1000, 3) if self.ticks else 0.0,
+            "max_lag_ms": round(self.max_lag * 1000, 3),
+        }
@@ -0,0 +1,122 @@
+from cache import LruCache
+
+LIVE_MAX_AGE = 300.0     #channels we are in get every join/leave broadcast, trust them longer
+UNJOINED_MAX_AGE = 15.0  #no broadcasts for these, only the last CHANNEL_INFO snapshot
+USER_MAX_AGE = 30.0      #WHOIS status can change without any event reaching us
+CHANNEL_CAPACITY = 512
+USER_CAPACITY = 2048
+
+class ChannelState:
+    __slots__ = ("name", "description", "members", "live")
+
+    def __init__(self, name, description, members, live):
+        self.name = name
+        self.description = description
+        self.members = set(members)
+        self.live = live #receiving join/leave broadcasts for it
+
+class UserState:
+    __slots__ = ("username", "status", "transport", "pubkey", "channels")
+
+    def __init__(self, username, status, transport, pubkey, channels):
+        self.username = username
+        self.status = status
+        self.transport = transport
+        self.pubkey = pubkey
+        self.channels = set(channels)
+
+#channel membership seeded from CHANNEL_INFO (and user channel lists from WHOIS),
+#patched by CHANNEL_JOIN/CHANNEL_LEFT broadcasts; anything inconsistent, renamed or too old is
+#dropped so the caller goes back to the server. Both are LRU caches, bounded in size
+class MembershipModel:
+    def __init__(self, live_max_age: float = LIVE_MAX_AGE, unjoined_max_age: float = UNJOINED_MAX_AGE,
+                 user_max_age: float = USER_MAX_AGE, on_gap=None, channel_capacity: int = CHANNEL_CAPACITY,
+                 user_capacity: int = USER_CAPACITY):
+        self.live_max_age = live_max_age
+        self.unjoined_max_age = unjoined_max_age
+        self.on_gap = on_gap #called with the channel name when a live channel needs a resync
+        self.channels = LruCache(channel_capacity, unjoined_max_age) #CHANNEL_INFO
+        self.users = LruCache(user_capacity, user_max_age) #WHOIS
+        self.username = None #ourselves, set by the client
+        self.gaps = 0
+
+    #seeding
+    def seed_channel(self, name: str, description: str, members, live: bool):
+        channel = ChannelState(name, description, members, live)
+        self.channels.put(name, channel, self._max_age(live))
+        members = channel.members #the set it already built, members may be a list from the server
+        for state in self.users.values():
+            if state.username in members:
+                state.channels.add(name)
+            else:
+                state.channels.discard(name)
+
+    def seed_user(self, username: str, status: str, transport: str, pubkey: str, channels):
+        self.users.put(username, UserState(username, status, transport, pubkey, channels))
+
+    def _max_age(self, live: bool) -> float:
+        return self.live_max_age if live else self.unjoined_max_age
+
+    #lookups, None when not known well enough
+    def channel(self, name: str):
+        return self.channels.get(name)
+
+    def user(self, username: str):
+        return self.users.get(username)
+
+    #incremental updates
+    def joined(self, name: str, username: str):
+        user = self.users.peek(username)
+        if user is not None:
+            user.channels.add(name)
+        state = self.channels.peek(name)
+        if state is None:
+            return
+        if username in state.members:
+            if username == self.username and state.live:
+                return #our own join of a channel we are already in, nothing changed
+            self._gap(state) #we missed a leave
+        state.members.add(username)
+
+    def left(self, name: str, username: str):
+        user = self.users.peek(username)
+        if user is not None:
+            user.channels.discard(name)
+        state = self.channels.peek(name)
+        if state is None:
+            return
+        if username not in state.members:
+            self._gap(state) #we missed a join
+        state.members.discard(username)
+
+    def set_live(self, name: str, live: bool):
+        #our own join/leave: broadcasts start or stop arriving
+        state = self.channels.peek(name)
+        if state is not None:
+            was_live = state.live
+            state.live = live
+            self.channels.set_ttl(name, self._max_age(live))
+            if live and not was_live: #the snapshot predates our join, nothing patched it
+                self._gap(state)
+
+    def renamed(self, old: str, new: str):
+        for state in self.channels.values():
+            if old in state.members:
+                state.members.discard(old)
+                state.members.add(new)
+        #neither name's WHOIS answer holds any more
+        self.users.invalidate(old)
+        self.users.invalidate(new)
+
+    def _gap(self, state: ChannelState):
+        self.gaps += 1
+        self.channels.invalidate(state.name)
+        if state.live and self.on_gap is not None:
+            self.on_gap(state.name)
+
+    def stats(self) -> dict:
+        return {"channel_info": self.channels.stats(), "whois": self.users.stats()}
+
+    def clear(self):
+        self.channels.clear()
+        self.users.clear()
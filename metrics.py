@@ -0,0 +1,214 @@
+import json
+import os
+import time
+
+#log-linear buckets like HdrHistogram: exact below 2*SUB microseconds, then SUB buckets per
+#power of two, so every recorded value is within 1/SUB (~6%) of its bucket
+SUB_BITS = 4
+SUB = 1 << SUB_BITS
+QUANTILES = (0.5, 0.9, 0.99)
+
+TYPE_NAMES = {
+    1: "CONNECT", 2: "DISCONNECT", 3: "PING", 4: "CHANNEL_CREATE", 5: "CHANNEL_LIST", 6: "CHANNEL_INFO",
+    7: "CHANNEL_JOIN", 8: "CHANNEL_LEAVE", 9: "CHANNEL_MESSAGE", 10: "WHOIS", 11: "WHOAMI",
+    12: "USER_MESSAGE", 13: "SETUSERNAME", 14: "USER_LIST",
+    20: "ERROR", 21: "OK", 22: "CONNECT", 23: "DISCONNECT", 24: "PONG", 25: "CHANNEL_CREATE",
+    26: "CHANNEL_LIST", 27: "CHANNEL_INFO", 28: "CHANNEL_JOIN", 29: "CHANNEL_LEFT", 30: "CHANNEL_MESSAGE",
+    31: "WHOIS", 32: "WHOAMI", 33: "USER_MESSAGE", 34: "SETUSERNAME", 35: "USER_LIST",
+    36: "SERVER_MESSAGE", 37: "SERVER_SHUTDOWN",
+}
+
+def _bucket(value: int) -> int:
+    if value < SUB * 2:
+        return value
+    shift = value.bit_length() - SUB_BITS - 1
+    return shift * SUB + (value >> shift)
+
+def _bucket_value(index: int) -> int:
+    #midpoint of the bucket, in microseconds
+    if index < SUB * 2:
+        return index
+    shift = index // SUB - 1
+    return ((index - shift * SUB) << shift) + (1 << shift) // 2
+
+class Histogram:
+    __slots__ = ("counts", "count", "total", "min", "max")
+
+    def __init__(self):
+        self.counts = []
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = 0
+
+    def record(self, micros: int):
+        index = _bucket(micros)
+        counts = self.counts
+        if index >= len(counts):
+            counts.extend([0] * (index + 1 - len(counts)))
+        counts[index] += 1
+        self.count += 1
+        self.total += micros
+        if self.min is None or micros < self.min:
+            self.min = micros
+        if micros > self.max:
+            self.max = micros
+
+    def merge(self, other):
+        if len(other.counts) > len(self.counts):
+            self.counts.extend([0] * (len(other.counts) - len(self.counts)))
+        for index, n in enumerate(other.counts):
+            self.counts[index] += n
+        self.count += other.count
+        self.total += other.total
+        if other.min is not None and (self.min is None or other.min < self.min):
+            self.min = other.min
+        self.max = max(self.max, other.max)
+
+    def quantile(self, q: float) -> int:
+        if not self.count:
+            return 0
+        rank = max(1, round(q * self.count))
+        seen = 0
+        for index, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank:
+                return min(max(_bucket_value(index), self.min), self.max)
+        return self.max
+
+    def summary(self) -> dict:
+        #milliseconds
+        result = {"count": self.count}
+        if self.count:
+            result["min"] = self.min / 1000
+            result["mean"] = round(self.total / self.count / 1000, 3)
+            for q in QUANTILES:
+                result[f"p{round(q * 100)}"] = self.quantile(q) / 1000
+            result["max"] = self.max / 1000
+        return result
+
+#counters, gauges and latency histograms, each optionally keyed (by request_type/response_type).
+#recording is a dict update; components that already count things are read through collectors
+#only when a snapshot is taken
+class Metrics:
+    def __init__(self):
+        self.counters = {} #(name, key) -> int
+        self.gauges = {} #(name, key) -> number
+        self.histograms = {} #(name, key) -> Histogram
+        self.collectors = [] #callables returning {(name, key): value} gauges
+        self.started = time.time()
+
+    def inc(self, name: str, key=None, n: int = 1):
+        slot = (name, key)
+        self.counters[slot] = self.counters.get(slot, 0) + n
+
+    def set(self, name: str, value, key=None):
+        self.gauges[(name, key)] = value
+
+    def observe(self, name: str, key, seconds: float):
+        slot = (name, key)
+        histogram = self.histograms.get(slot)
+        if histogram is None:
+            histogram = self.histograms[slot] = Histogram()
+        histogram.record(int(seconds * 1e6))
+
+    def collector(self, fn):
+        self.collectors.append(fn)
+
+    def count(self, name: str, key=None) -> int:
+        return self.counters.get((name, key), 0)
+
+    def total(self, name: str) -> int:
+        return sum(v for (n, _), v in self.counters.items() if n == name)
+
+    def histogram(self, name: str, key=None):
+        #key None merges every key recorded under the name
+        if key is not None:
+            return self.histograms.get((name, key))
+        merged = None
+        for (n, _), histogram in self.histograms.items():
+            if n == name:
+                if merged is None:
+                    merged = Histogram()
+                merged.merge(histogram)
+        return merged
+
+    def merge(self, other):
+        #adds another registry's counters and histograms to this one (e.g. many sessions into one report);
+        #gauges are point readings of one component and are left alone
+        for slot, n in other.counters.items():
+            self.counters[slot] = self.counters.get(slot, 0) + n
+        for slot, histogram in other.histograms.items():
+            mine = self.histograms.get(slot)
+            if mine is None:
+                mine = self.histograms[slot] = Histogram()
+            mine.merge(histogram)
+
+    def reset(self):
+        self.counters.clear()
+        self.gauges.clear()
+        self.histograms.clear()
+        self.started = time.time()
+
+    def _gauges(self) -> dict:
+        gauges = dict(self.gauges)
+        for fn in self.collectors:
+            gauges.update(fn())
+        return gauges
+
+    def snapshot(self) -> dict:
+        def group(items, value=lambda v: v):
+            grouped = {}
+            for (name, key), v in sorted(items, key=lambda item: (item[0][0], str(item[0][1]))):
+                grouped.setdefault(name, {})["" if key is None else str(key)] = value(v)
+            return grouped
+        return {
+            "time": round(time.time(), 3),
+            "uptime": round(time.time() - self.started, 3),
+            "counters": group(self.counters.items()),
+            "gauges": group(self._gauges().items()),
+            "histograms_ms": group(self.histograms.items(), Histogram.summary),
+        }
+
+    def json_line(self) -> str:
+        return json.dumps(self.snapshot(), separators=(",", ":"))
+
+    def prometheus(self, prefix: str = "chat") -> str:
+        #text exposition format, histograms as summaries in seconds
+        def labels(key, extra=""):
+            parts = [] if key is None else [f'type="{key}"']
+            if extra:
+                parts.append(extra)
+            return "{" + ",".join(parts) + "}" if parts else ""
+        lines = []
+        for kind, items in (("counter", self.counters.items()), ("gauge", self._gauges().items())):
+            seen = set()
+            for (name, key), value in sorted(items, key=lambda item: (item[0][0], str(item[0][1]))):
+                metric = f"{prefix}_{name}_total" if kind == "counter" else f"{prefix}_{name}"
+                if metric not in seen:
+                    seen.add(metric)
+                    lines.append(f"# TYPE {metric} {kind}")
+                lines.append(f"{metric}{labels(key)} {value}")
+        seen = set()
+        for (name, key), histogram in sorted(self.histograms.items(), key=lambda item: (item[0][0], str(item[0][1]))):
+            metric = f"{prefix}_{name}_seconds"
+            if metric not in seen:
+                seen.add(metric)
+                lines.append(f"# TYPE {metric} summary")
+            for q in QUANTILES:
+                quantile = 'quantile="%s"' % q
+                lines.append(f"{metric}{labels(key, quantile)} {histogram.quantile(q) / 1e6}")
+            lines.append(f"{metric}_sum{labels(key)} {histogram.total / 1e6}")
+            lines.append(f"{metric}_count{labels(key)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def dump(self, path: str):
+        #*.prom files are rewritten whole (textfile collectors read them), anything else gets a JSON line appended
+        if path.endswith(".prom"):
+            temp = path + ".tmp"
+            with open(temp, "w") as f:
+                f.write(self.prometheus())
+            os.replace(temp, path)
+        else:
+            with open(path, "a") as f:
+                f.write(self.json_line() + "\n")
@@ -0,0 +1,129 @@
+import asyncio
+import random
+import time
+from collections import deque
+from utility import *
+
+DEFAULT_BASE = 1.0   #first backoff ceiling, seconds
+DEFAULT_CAP = 60.0   #backoff ceiling never grows past this
+DEFAULT_QUEUE_LIMIT = 100
+DEFAULT_QUEUE_AGE = 300.0 #queued messages older than this are not sent after all
+
+class QueuedMessage:
+    __slots__ = ("queued_at", "kind", "target", "text")
+
+    def __init__(self, queued_at, kind, target, text):
+        self.queued_at = queued_at
+        self.kind = kind
+        self.target = target
+        self.text = text
+
+#messages typed while the session is down, sent in order once it is back
+class OfflineQueue:
+    def __init__(self, limit: int = DEFAULT_QUEUE_LIMIT, max_age: float = DEFAULT_QUEUE_AGE):
+        self.limit = limit
+        self.max_age = max_age
+        self.items = deque()
+        self.rejected = 0
+        self.expired = 0
+
+    def __len__(self):
+        return len(self.items)
+
+    def put(self, kind: int, target: str, text: str) -> bool:
+        #False when full, the newest message is refused rather than silently dropping an older one
+        self._expire()
+        if len(self.items) >= self.limit:
+            self.rejected += 1
+            return False
+        self.items.append(QueuedMessage(time.monotonic(), kind, target, text))
+        return True
+
+    def _expire(self) -> int:
+        cutoff = time.monotonic() - self.max_age
+        expired = 0
+        while self.items and self.items[0].queued_at < cutoff:
+            self.items.popleft()
+            expired += 1
+        self.expired += expired
+        return expired
+
+    def take(self):
+        #(messages still worth sending, how many expired)
+        expired = self._expire()
+        items = list(self.items)
+        self.items.clear()
+        return items, expired
+
+    def clear(self):
+        self.items.clear()
+
+#brings a lost session back: reconnects with full-jitter exponential backoff, then restores the
+#username and channels the old session had, restarts the client's background tasks and sends
+#whatever was queued meanwhile
+class ReconnectSupervisor:
+    def __init__(self, client, base: float = DEFAULT_BASE, cap: float = DEFAULT_CAP, max_attempts: int = None):
+        self.client = client
+        self.base = base
+        self.cap = cap
+        self.max_attempts = max_attempts #None keeps trying until cancelled
+        self.task = None
+        self.wake = asyncio.Event()
+        self.attempts = 0
+        self.reconnects = 0
+
+    @property
+    def active(self) -> bool:
+        return self.task is not None and not self.task.done()
+
+    def trigger(self, username: str, channels):
+        if not self.active:
+            self.task = asyncio.create_task(self._run(username, set(channels)))
+
+    def retry_now(self):
+        self.wake.set()
+
+    def cancel(self):
+        if self.active and self.task is not asyncio.current_task():
+            self.task.cancel()
+        self.task = None
+
+    async def _run(self, username: str, channels: set):
+        client = self.client
+        attempt = 0
+        while not client.connected:
+            if self.max_attempts is not None and attempt >= self.max_attempts:
+                error_msg(f"[!] Giving up after {attempt} reconnect attempts, /connect to try again.")
+                client.offline.clear()
+                return
+            delay = random.uniform(0, min(self.cap, self.base * 2 ** attempt))
+            progress_msg(f"[*] Reconnecting in {delay:.1f}s (attempt {attempt + 1})...", client.minimal_mode)
+            try:
+                await asyncio.wait_for(self.wake.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+            self.wake.clear()
+            attempt += 1
+            self.attempts += 1
+            await client.connect()
+        self.reconnects += 1
+        await self.restore(username, channels)
+
+    async def restore(self, username: str, channels: set):
+        client = self.client
+        client.start_background()
+        if username and client.username != username:
+            response = await client.set_username(username, raw=True)
+            if response is None or response.get("response_type") == 20:
+                error_msg(f"[!] Could not get the username {username} back, you are {client.username}.")
+        failed = []
+        for channel in sorted(channels):
+            response = await client.join_channel(channel)
+            if response is None or response.get("response_type") == 20:
+                failed.append(channel)
+        await client.flush_offline()
+        rejoined = len(channels) - len(failed)
+        progress_msg(f"[+] Reconnected as {client.username}"
+                     f"{f', rejoined {rejoined} channel(s)' if rejoined else ''}.")
+        if failed:
+            error_msg(f"[!] Could not rejoin {', '.join(failed)}.")
@@ -0,0 +1,225 @@
+import os
+import re
+
+MUTE = "mute"
+HIGHLIGHT = "highlight"
+ROUTE = "route"
+ACTIONS = (MUTE, HIGHLIGHT, ROUTE)
+SENDER = "sender"
+CHANNEL = "channel"
+WORD = "word"
+FIELDS = (SENDER, CHANNEL, WORD)
+DEFAULT_PATH = os.path.join(os.path.expanduser("~"), ".chat_rules")
+
+class RuleError(ValueError):
+    pass
+
+class Rule:
+    __slots__ = ("action", "field", "value", "view")
+
+    def __init__(self, action: str, field: str, value: str, view: str = None):
+        if action not in ACTIONS:
+            raise RuleError(f"unknown action {action!r}, expected one of {', '.join(ACTIONS)}")
+        if field not in FIELDS:
+            raise RuleError(f"unknown field {field!r}, expected one of {', '.join(FIELDS)}")
+        if not value:
+            raise RuleError("a rule needs a value")
+        if (action == ROUTE) != bool(view):
+            raise RuleError("route rules, and only route rules, name a view")
+        self.action = action
+        self.field = field
+        self.value = value.lower() if field == WORD else value
+        self.view = view
+
+    def __str__(self):
+        return f"{self.action} {self.field} {self.value}" + (f" {self.view}" if self.view else "")
+
+    def __eq__(self, other):
+        return isinstance(other, Rule) and str(self) == str(other)
+
+def parse_rule(line: str) -> Rule:
+    #"<mute|highlight> <sender|channel|word> <value>" or "route <sender|channel|word> <value> <view>";
+    #word values may be phrases
+    parts = line.split()
+    if len(parts) < 3:
+        raise RuleError("expected: <action> <field> <value> [view]")
+    action, field = parts[0].lower(), parts[1].lower()
+    if action == ROUTE:
+        if len(parts) < 4:
+            raise RuleError("expected: route <field> <value> <view>")
+        return Rule(action, field, " ".join(parts[2:-1]), parts[-1])
+    return Rule(action, field, " ".join(parts[2:]))
+
+def _trie_pattern(words) -> str:
+    #one alternation per trie node instead of one per word, so the regex engine walks shared
+    #prefixes once and the cost of a match barely grows with the number of words
+    trie = {}
+    for word in words:
+        node = trie
+        for ch in word:
+            node = node.setdefault(ch, {})
+        node[""] = {}
+
+    def emit(node) -> str:
+        end = "" in node
+        branches = [(ch, emit(child)) for ch, child in sorted(node.items()) if ch]
+        if not branches:
+            return ""
+        if all(not rest for _, rest in branches) and len(branches) > 1:
+            body = "[" + "".join(re.escape(ch) for ch, _ in branches) + "]"
+        elif len(branches) == 1:
+            body = re.escape(branches[0][0]) + branches[0][1]
+        else:
+            body = "(?:" + "|".join(re.escape(ch) + rest for ch, rest in branches) + ")"
+        if end:
+            return f"(?:{body})?" if len(branches) > 1 or branches[0][1] else f"{body}?"
+        return body
+
+    return emit(trie)
+
+class Verdict:
+    __slots__ = ("muted", "highlight", "views", "spans")
+
+    def __init__(self, muted, highlight, views, spans):
+        self.muted = muted
+        self.highlight = highlight
+        self.views = views #tuple of view names the message is routed to
+        self.spans = spans #(start, end) of highlighted words in the text
+
+#mute/highlight/route rules compiled for one pass per message: senders and channels are set and
+#dict lookups, every keyword (and the mention of our own name) is one trie-shaped regex over the
+#lowercased text
+class RuleEngine:
+    def __init__(self, path: str = None):
+        self.path = path
+        self.rules = []
+        self.mentions = True #highlight messages naming us
+        self.username = None
+        self.matched = 0
+        self.compile()
+
+    #editing
+    def add(self, rule: Rule) -> bool:
+        if rule in self.rules:
+            return False
+        self.rules.append(rule)
+        self.compile()
+        return True
+
+    def remove(self, index: int) -> Rule:
+        rule = self.rules.pop(index)
+        self.compile()
+        return rule
+
+    def clear(self):
+        self.rules.clear()
+        self.compile()
+
+    def set_username(self, username: str):
+        if username != self.username:
+            self.username = username
+            self.compile()
+
+    def set_mentions(self, enabled: bool):
+        self.mentions = enabled
+        self.compile()
+
+    #files: one rule per line, "#" comments, "mentions off" to stop highlighting our own name
+    def load(self, path: str = None) -> int:
+        path = path or self.path
+        rules = []
+        mentions = True
+        with open(path, encoding="utf-8") as f:
+            for number, line in enumerate(f, 1):
+                line = line.split("#", 1)[0].strip()
+                if not line:
+                    continue
+                if line.lower() in ("mentions on", "mentions off"):
+                    mentions = line.lower() == "mentions on"
+                    continue
+                try:
+                    rules.append(parse_rule(line))
+                except RuleError as e:
+                    raise RuleError(f"{path}:{number}: {e}") from None
+        self.path = path
+        self.rules = rules
+        self.mentions = mentions
+        self.compile()
+        return len(rules)
+
+    def save(self, path: str = None):
+        path = path or self.path
+        temp = path + ".tmp"
+        with open(temp, "w", encoding="utf-8") as f:
+            if not self.mentions:
+                f.write("mentions off\n")
+            for rule in self.rules:
+                f.write(f"{rule}\n")
+        os.replace(temp, path)
+        self.path = path
+
+    #compiled form
+    def compile(self):
+        self.muted_senders = set()
+        self.muted_channels = set()
+        self.highlight_senders = set()
+        self.highlight_channels = set()
+        self.route_senders = {} #sender -> views
+        self.route_channels = {} #channel -> views
+        words = {} #word -> [muted, highlighted, views]
+        for rule in self.rules:
+            if rule.field == WORD:
+                entry = words.setdefault(rule.value, [False, False, ()])
+                if rule.action == MUTE:
+                    entry[0] = True
+                elif rule.action == HIGHLIGHT:
+                    entry[1] = True
+                elif rule.view not in entry[2]:
+                    entry[2] += (rule.view,)
+            elif rule.action == ROUTE:
+                table = self.route_senders if rule.field == SENDER else self.route_channels
+                if rule.view not in table.get(rule.value, ()):
+                    table[rule.value] = table.get(rule.value, ()) + (rule.view,)
+            elif rule.field == SENDER:
+                (self.muted_senders if rule.action == MUTE else self.highlight_senders).add(rule.value)
+            else:
+                (self.muted_channels if rule.action == MUTE else self.highlight_channels).add(rule.value)
+        if self.mentions and self.username:
+            words.setdefault(self.username.lower(), [False, False, ()])[1] = True
+        self.words = {word: tuple(entry) for word, entry in words.items()}
+        self.matcher = None
+        if words:
+            self.matcher = re.compile(r"(?<!\w)(?:" + _trie_pattern(words) + r")(?!\w)")
+
+    def evaluate(self, channel, sender: str, text: str):
+        #None when no rule applies, which is the common case
+        if sender in self.muted_senders or channel in self.muted_channels:
+            self.matched += 1
+            return Verdict(True, False, (), ())
+        highlight = sender in self.highlight_senders or channel in self.highlight_channels
+        views = self.route_senders.get(sender, ())
+        if channel in self.route_channels:
+            views += self.route_channels[channel]
+        spans = []
+        if self.matcher is not None:
+            lowered = text.lower()
+            for match in self.matcher.finditer(lowered):
+                muted, highlighted, routed = self.words[match.group()]
+                if muted:
+                    self.matched += 1
+                    return Verdict(True, False, (), ())
+                if highlighted:
+                    highlight = True
+                    spans.append(match.span())
+                for view in routed:
+                    if view not in views:
+                        views += (view,)
+            if len(lowered) != len(text):
+                spans = [] #lowercasing changed the length (rare unicode), positions do not carry over
+        if not highlight and not views:
+            return None
+        self.matched += 1
+        return Verdict(False, highlight, views, spans)
+
+    def stats(self) -> dict:
+        return {"rules": len(self.rules), "words": len(self.words), "matched": self.matched}
@@ -0,0 +1,147 @@
+import asyncio
+import time
+from collections import deque
+
+#priority classes, lower goes first
+CONTROL = 0      #connect, disconnect, keepalive
+INTERACTIVE = 1  #anything the user typed
+BULK = 2         #background refreshes and listings
+CLASS_NAMES = ("control", "interactive", "bulk")
+
+#default class per request_type
+PRIORITY = {
+    1: CONTROL, 2: CONTROL, 3: CONTROL,
+    4: INTERACTIVE, 5: INTERACTIVE, 6: INTERACTIVE, 7: INTERACTIVE, 8: INTERACTIVE,
+    9: INTERACTIVE, 10: INTERACTIVE, 11: INTERACTIVE, 12: INTERACTIVE, 13: INTERACTIVE,
+    14: INTERACTIVE,
+} #background polls pass BULK explicitly
+
+DEFAULT_RATE = 20.0 #packets per second once the burst is spent
+DEFAULT_BURST = 20
+DEFAULT_LIMITS = (None, 512, 64) #queue bound per class, control is never shed
+
+#token bucket in front of the socket: sends go straight out while tokens last,
+#then queue per priority class and drain highest class first as tokens refill
+class SendScheduler:
+    def __init__(self, transmit, rate: float = DEFAULT_RATE, burst: int = DEFAULT_BURST, limits=DEFAULT_LIMITS):
+        self.transmit = transmit #callable taking the encoded datagram
+        self.rate = rate
+        self.burst = burst
+        self.limits = limits
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.queues = tuple(deque() for _ in CLASS_NAMES)
+        self.queued = 0
+        self.keys = set() #keys of queued packets
+        self.handle = None #scheduled drain
+        self.sent = [0] * len(CLASS_NAMES)
+        self.shed = [0] * len(CLASS_NAMES)
+
+    def configure(self, rate: float = None, burst: int = None):
+        if rate is not None:
+            self.rate = rate
+        if burst is not None:
+            self.burst = burst
+            self.tokens = min(self.tokens, burst)
+        if self.handle is not None: #the wait was worked out for the old rate
+            self.handle.cancel()
+            self.handle = None
+        if self.rate <= 0:
+            self._flush() #pacing is off, nothing may stay behind in the queues
+        else:
+            self._schedule()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def submit(self, data: bytes, priority: int = INTERACTIVE, key=None) -> bool:
+        #returns False if the packet was shed; a key that is still queued (a retransmission
+        #of a request that never left) is not queued twice
+        if self.rate <= 0: #unlimited
+            self._flush() #never overtake what was queued while pacing was on
+            self.sent[priority] += 1
+            self.transmit(data)
+            return True
+        self._refill()
+        if not self.queued and self.tokens >= 1:
+            self.tokens -= 1
+            self.sent[priority] += 1
+            self.transmit(data)
+            return True
+        if key is not None and key in self.keys:
+            return True
+        queue = self.queues[priority]
+        limit = self.limits[priority]
+        if limit is not None and len(queue) >= limit:
+            self.shed[priority] += 1
+            return False
+        queue.append((key, data))
+        if key is not None:
+            self.keys.add(key)
+        self.queued += 1
+        self._schedule()
+        return True
+
+    def _schedule(self):
+        if self.handle is None and self.queued and self.rate > 0:
+            delay = max(0.0, (1 - self.tokens) / self.rate)
+            self.handle = asyncio.get_running_loop().call_later(delay, self._drain)
+
+    def _flush(self):
+        #everything queued goes out at once, highest class first
+        for priority, queue in enumerate(self.queues):
+            while queue:
+                key, data = queue.popleft()
+                self.keys.discard(key)
+                self.queued -= 1
+                self.sent[priority] += 1
+                self.transmit(data)
+
+    def _drain(self):
+        self.handle = None
+        self._refill()
+        for priority, queue in enumerate(self.queues):
+            while queue and self.tokens >= 1:
+                key, data = queue.popleft()
+                self.keys.discard(key)
+                self.tokens -= 1
+                self.queued -= 1
+                self.sent[priority] += 1
+                self.transmit(data)
+            if self.tokens < 1:
+                break
+        self._schedule()
+
+    def drop(self, keys) -> int:
+        #removes the queued packets with these keys, e.g. the rest of a request that was abandoned;
+        #returns how many were still queued
+        keys = self.keys.intersection(keys)
+        if not keys:
+            return 0
+        for queue in self.queues:
+            kept = [entry for entry in queue if entry[0] not in keys]
+            self.queued -= len(queue) - len(kept)
+            queue.clear()
+            queue.extend(kept)
+        self.keys -= keys
+        return len(keys)
+
+    def clear(self):
+        #drop everything still queued, e.g. when the transport is replaced
+        if self.handle is not None:
+            self.handle.cancel()
+            self.handle = None
+        for queue in self.queues:
+            queue.clear()
+        self.keys.clear()
+        self.queued = 0
+
+    def stats(self) -> dict:
+        return {
+            "tokens": round(self.tokens, 2),
+            "depth": {name: len(q) for name, q in zip(CLASS_NAMES, self.queues)},
+            "sent": dict(zip(CLASS_NAMES, self.sent)),
+            "shed": dict(zip(CLASS_NAMES, self.shed)),
+        }
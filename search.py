@@ -0,0 +1,222 @@
+import os
+import re
+import struct
+from array import array
+from bisect import bisect_left
+
+from history import Message
+
+_TOKEN = re.compile(r"\w+")
+MIN_TOKEN = 2
+
+#record: total length, message id, unix time, kind, key length, sender length, tokens length,
+#then key, sender and the message's distinct tokens joined by NUL, all utf-8
+HEADER = struct.Struct("<IQdBHHH")
+FILE_MAGIC = b"CHATIDX1"
+
+def tokenize(text: str) -> list:
+    #distinct lowercase word tokens, in first-seen order
+    return list(dict.fromkeys(t for t in _TOKEN.findall(text.lower()) if len(t) >= MIN_TOKEN))
+
+#inverted index over a HistoryStore: token -> ascending array of message ids, plus per-message
+#key/sender/time columns for filtering. The postings are persisted as an append-only log next to
+#the history file and extended as messages are appended, never rebuilt from scratch unless the two
+#files disagree. The message texts themselves live in the history log.
+class SearchIndex:
+    def __init__(self, history):
+        self.history = history
+        self.path = os.path.join(os.path.dirname(history.path), "search.log")
+        self.file = None
+        self._reset()
+        self._load()
+        history.listeners.append(self)
+
+    def _reset(self):
+        self.postings = {} #token -> array of message ids
+        self.base_id = self.history.first_id #message id of column position 0
+        self.kinds = array("B")
+        self.keys = array("I") #interned key ids
+        self.senders = array("I") #interned sender ids
+        self.times = array("d")
+        self.names = {} #string -> interned id
+        self.strings = []
+        self.next_id = self.base_id
+
+    def _intern(self, value: str) -> int:
+        ident = self.names.get(value)
+        if ident is None:
+            ident = self.names[value] = len(self.strings)
+            self.strings.append(value)
+        return ident
+
+    def _load(self):
+        if os.path.exists(self.path):
+            with open(self.path, "rb") as f:
+                data = f.read()
+        else:
+            data = b""
+        good = len(FILE_MAGIC)
+        if data[:good] != FILE_MAGIC:
+            data = b""
+        else:
+            offset = good
+            while offset + HEADER.size <= len(data):
+                length, msg_id, timestamp, kind, key_len, sender_len, tokens_len = HEADER.unpack_from(data, offset)
+                if length < HEADER.size or offset + length > len(data):
+                    break
+                if msg_id >= self.history.next_id: #index is ahead of the history it describes
+                    data = b""
+                    break
+                start = offset + HEADER.size
+                key = data[start:start + key_len].decode("utf-8", "replace")
+                start += key_len
+                sender = data[start:start + sender_len].decode("utf-8", "replace")
+                start += sender_len
+                tokens = data[start:start + tokens_len].decode("utf-8", "replace").split("\0") if tokens_len else []
+                if msg_id >= self.history.first_id:
+                    self._add(msg_id, timestamp, kind, key, sender, tokens)
+                offset += length
+            good = offset
+        if not data:
+            self._reset()
+            with open(self.path, "wb") as f:
+                f.write(FILE_MAGIC)
+            good = len(FILE_MAGIC)
+        self.file = open(self.path, "r+b")
+        self.file.truncate(good) #torn last record
+        self.file.seek(0, os.SEEK_END)
+        #index whatever the history gained while the index was not looking
+        for msg_id in range(max(self.next_id, self.history.first_id), self.history.next_id):
+            message = self.history.get(msg_id)
+            if message is not None:
+                self.history_appended(message)
+
+    def _add(self, msg_id: int, timestamp: float, kind: int, key: str, sender: str, tokens):
+        if not self.kinds:
+            self.base_id = msg_id
+        #ids are dense from base_id, pad any hole so positions stay aligned
+        while self.base_id + len(self.kinds) < msg_id:
+            self.kinds.append(255)
+            self.keys.append(0)
+            self.senders.append(0)
+            self.times.append(0.0)
+        self.kinds.append(kind)
+        self.keys.append(self._intern(key))
+        self.senders.append(self._intern(sender))
+        self.times.append(timestamp)
+        postings = self.postings
+        for token in tokens:
+            ids = postings.get(token)
+            if ids is None:
+                ids = postings[token] = array("Q")
+            ids.append(msg_id)
+        self.next_id = msg_id + 1
+
+    #HistoryStore listener
+    def history_appended(self, message: Message):
+        if message.msg_id < self.next_id:
+            return
+        tokens = tokenize(message.text)
+        key_b = message.key.encode("utf-8")
+        sender_b = message.sender.encode("utf-8")
+        tokens_b = "\0".join(tokens).encode("utf-8")
+        length = HEADER.size + len(key_b) + len(sender_b) + len(tokens_b)
+        self.file.write(HEADER.pack(length, message.msg_id, message.timestamp, message.kind,
+                                    len(key_b), len(sender_b), len(tokens_b)) + key_b + sender_b + tokens_b)
+        self.file.flush()
+        self._add(message.msg_id, message.timestamp, message.kind, message.key, message.sender, tokens)
+
+    def history_compacted(self, first_id: int):
+        #drop postings for messages that no longer exist and rewrite the log without them
+        cut = max(0, min(len(self.kinds), first_id - self.base_id))
+        for token in list(self.postings):
+            ids = self.postings[token]
+            keep = bisect_left(ids, first_id)
+            if keep == len(ids):
+                del self.postings[token]
+            elif keep:
+                del ids[:keep]
+        del self.kinds[:cut]
+        del self.keys[:cut]
+        del self.senders[:cut]
+        del self.times[:cut]
+        self.base_id += cut
+        self._rewrite()
+
+    def _rewrite(self):
+        tokens_of = {}
+        for token, ids in self.postings.items():
+            for msg_id in ids:
+                tokens_of.setdefault(msg_id, []).append(token)
+        temp = self.path + ".tmp"
+        with open(temp, "wb") as out:
+            out.write(FILE_MAGIC)
+            for position, kind in enumerate(self.kinds):
+                if kind == 255:
+                    continue
+                msg_id = self.base_id + position
+                key_b = self.strings[self.keys[position]].encode("utf-8")
+                sender_b = self.strings[self.senders[position]].encode("utf-8")
+                tokens_b = "\0".join(tokens_of.get(msg_id, ())).encode("utf-8")
+                length = HEADER.size + len(key_b) + len(sender_b) + len(tokens_b)
+                out.write(HEADER.pack(length, msg_id, self.times[position], kind,
+                                      len(key_b), len(sender_b), len(tokens_b)) + key_b + sender_b + tokens_b)
+        self.file.close()
+        os.replace(temp, self.path)
+        self.file = open(self.path, "r+b")
+        self.file.seek(0, os.SEEK_END)
+
+    def search(self, query: str, key: str = None, sender: str = None, kind: int = None,
+               since: float = None, until: float = None, limit: int = 20) -> list:
+        #newest first; every token must appear (AND), filters are exact matches
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+        lists = []
+        for token in tokens:
+            ids = self.postings.get(token)
+            if not ids:
+                return []
+            lists.append(ids)
+        lists.sort(key=len)
+        shortest, others = lists[0], lists[1:]
+        key_id = None if key is None else self.names.get(key, -1)
+        sender_id = None if sender is None else self.names.get(sender, -1)
+        first_id = self.history.first_id
+        results = []
+        for i in range(len(shortest) - 1, -1, -1):
+            msg_id = shortest[i]
+            if msg_id < first_id:
+                break
+            position = msg_id - self.base_id
+            if key_id is not None and self.keys[position] != key_id:
+                continue
+            if sender_id is not None and self.senders[position] != sender_id:
+                continue
+            if kind is not None and self.kinds[position] != kind:
+                continue
+            timestamp = self.times[position]
+            if until is not None and timestamp > until:
+                continue
+            if since is not None and timestamp < since:
+                break #ids are in time order, nothing older can match
+            matched = True
+            for ids in others:
+                j = bisect_left(ids, msg_id)
+                if j == len(ids) or ids[j] != msg_id:
+                    matched = False
+                    break
+            if matched:
+                message = self.history.get(msg_id)
+                if message is not None:
+                    results.append(message)
+                    if len(results) >= limit:
+                        break
+        return results
+
+    def close(self):
+        if self in self.history.listeners:
+            self.history.listeners.remove(self)
+        if self.file is not None:
+            self.file.close()
+            self.file = None
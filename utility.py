@@ -1,16 +1,29 @@
-import os
-from prompt_toolkit.formatted_text.ansi import ANSI
-from prompt_toolkit.shortcuts import print_formatted_text
+import asyncio
+import re
+from functools import lru_cache
 import sys
-import time
 from datetime import datetime
 
-def typewriter_effect(text: str, delay: float = 0.02):
-    for char in text:
-        sys.stdout.write(char)
+EFFECT_MAX_SECONDS = 1.0 #a typewriter line never takes longer than this
+
+async def typewriter_effect(text: str, delay: float = 0.02):
+    #types between loop iterations so datagrams keep being received; lines rendered meanwhile
+    #are held back until the line is finished instead of landing in the middle of it
+    if not RENDERER.effects or not text:
+        RENDERER.write(text)
+        return
+    delay = min(delay, EFFECT_MAX_SECONDS / len(text))
+    RENDERER.flush()
+    RENDERER.hold()
+    try:
+        for char in text:
+            sys.stdout.write(char)
+            sys.stdout.flush()
+            await asyncio.sleep(delay)
+        sys.stdout.write("\n")
         sys.stdout.flush()
-        time.sleep(delay)
-    print()  # move to the next line
+    finally:
+        RENDERER.release()
 
 BOLD = "\033[1m"
 BRIGHT_BLUE = "\033[94m"
@@ -34,22 +47,154 @@ RESET = "\033[0m"
 
 CHAT_HEADER = f"{BRIGHT_CYAN}Welcome to CLI Chat — Stay connected, securely.{RESET}"
 
+#rendering fidelity, from most faithful to fastest
+EXACT = "exact"   #prompt_toolkit ANSI parser on every line
+CACHED = "cached" #split on SGR escapes, styles looked up from a cache
+PLAIN = "plain"   #escapes stripped, no colours
+
+_SGR = re.compile(r"\x1b\[([0-9;]*)m")
+
+@lru_cache(maxsize=1024)
+def _style_for(codes: str) -> str:
+    #style string prompt_toolkit would give text after this run of escape codes
+    if not codes:
+        return ""
+    from prompt_toolkit.formatted_text import ANSI, to_formatted_text
+    return to_formatted_text(ANSI(codes + "x"))[-1][0]
+
+@lru_cache(maxsize=4096)
+def ansi_fragments(line: str) -> tuple:
+    #one (style, text) fragment per coloured run instead of one per character
+    fragments = []
+    codes = ""
+    style = ""
+    pos = 0
+    for match in _SGR.finditer(line):
+        start = match.start()
+        if start > pos:
+            fragments.append((style, line[pos:start]))
+        codes = "" if match.group(1) in ("", "0") else codes + match.group(0)
+        style = _style_for(codes)
+        pos = match.end()
+    if pos < len(line):
+        fragments.append((style, line[pos:]))
+    return tuple(fragments)
+
+#collects lines and writes them in one print_formatted_text call per frame,
+#so a burst of messages costs one prompt redraw instead of one per line
+class Renderer:
+    def __init__(self, max_fps: float = 30, fidelity: str = CACHED, output=None):
+        self.max_fps = max_fps #0 writes every line immediately
+        self.fidelity = fidelity
+        self.output = output #prompt_toolkit Output, None for the terminal
+        self.effects = True #typewriter animations, off prints them at once
+        self.held = 0 #while non-zero lines are only queued, see hold/release
+        self.sink = None #callable taking the flushed lines instead of the terminal, e.g. headless.py
+        self.pending = []
+        self.handle = None #scheduled flush
+        self.last_flush = 0.0
+        self.lines = 0
+        self.frames = 0
+
+    def configure(self, max_fps: float = None, fidelity: str = None, output=None):
+        if output is not None:
+            self.output = output
+        if fidelity is not None:
+            if fidelity not in (EXACT, CACHED, PLAIN):
+                raise ValueError(f"unknown fidelity: {fidelity}")
+            self.fidelity = fidelity
+        if max_fps is not None:
+            self.max_fps = max(0, max_fps)
+        self.flush()
+
+    def write(self, line: str):
+        self.pending.append(line)
+        if self.held:
+            return
+        if self.max_fps <= 0:
+            self.flush()
+            return
+        if self.handle is not None:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError: #no event loop, nothing to batch against
+            self.flush()
+            return
+        delay = self.last_flush + 1 / self.max_fps - loop.time()
+        self.handle = loop.call_later(max(0, delay), self.flush)
+
+    def hold(self):
+        self.held += 1
+
+    def release(self):
+        self.held = max(0, self.held - 1)
+        if not self.held:
+            self.flush()
+
+    def flush(self):
+        if self.handle is not None:
+            self.handle.cancel()
+            self.handle = None
+        if not self.pending or self.held:
+            return
+        lines, self.pending = self.pending, []
+        if self.sink is not None:
+            self.sink(lines)
+        else:
+            self._print(lines)
+        try:
+            self.last_flush = asyncio.get_running_loop().time()
+        except RuntimeError:
+            pass
+        self.lines += len(lines)
+        self.frames += 1
+
+    def _print(self, lines):
+        #prompt_toolkit is imported on first use so headless clients never load it
+        from prompt_toolkit.formatted_text import ANSI, FormattedText, to_formatted_text
+        from prompt_toolkit.shortcuts import print_formatted_text
+        fragments = []
+        if self.fidelity == EXACT:
+            for line in lines:
+                fragments.extend(to_formatted_text(ANSI(line)))
+                fragments.append(("", "\n"))
+        elif self.fidelity == PLAIN:
+            fragments.append(("", "\n".join(_SGR.sub("", line) for line in lines) + "\n"))
+        else:
+            for line in lines:
+                fragments.extend(ansi_fragments(line))
+                fragments.append(("", "\n"))
+        print_formatted_text(FormattedText(fragments), end="", output=self.output)
+
+RENDERER = Renderer()
+
+def configure_renderer(max_fps: float = None, fidelity: str = None, output=None):
+    RENDERER.configure(max_fps, fidelity, output)
+
 def mod_print(message):
-    print_formatted_text(ANSI(message))
+    RENDERER.write(message)
 
 def error_msg(message):
-    print_formatted_text(ANSI(f"{BRIGHT_RED}{message}{RESET}"))
+    RENDERER.write(f"{BRIGHT_RED}{message}{RESET}")
 
 def server_msg(message,suppress = False):
     if not suppress:
-        print_formatted_text(ANSI(f"{GREY}[{current_time()}] {message}{RESET}"))
+        RENDERER.write(f"{GREY}[{current_time()}] {message}{RESET}")
 
 def progress_msg(message,suppress = False):
     if not suppress:
-        print_formatted_text(ANSI(f"{BRIGHT_YELLOW}{message}{RESET}"))
+        RENDERER.write(f"{BRIGHT_YELLOW}{message}{RESET}")
 
 def clear_terminal():
-    os.system('cls' if os.name == 'nt' else 'clear') 
+    RENDERER.flush()
+    from prompt_toolkit.application.current import get_app_or_none
+    app = get_app_or_none()
+    if app is not None and app.is_running:
+        app.renderer.clear() #what Ctrl+L does, the prompt is redrawn below
+    else:
+        sys.stdout.write("\033[2J\033[3J\033[H") #no subprocess, the loop keeps running
+        sys.stdout.flush()
 
 def current_time():
     return datetime.now().strftime("%H:%M:%S")
\ No newline at end of file